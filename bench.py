@@ -0,0 +1,638 @@
+"""
+Микро- и нагрузочные бенчмарки.
+
+    python bench.py keyboards [--n 20000]
+    python bench.py e2e [--users 1000] [--concurrency 100] [--api-ms 0] [--write-behind]
+    python bench.py polling [--users 50] [--latency-ms 30] [--rate-429 0.01] [--rate-5xx 0.01]
+    python bench.py lanes [--users 300] [--api-ms 2] [--no-lanes] [--replay]
+    python bench.py flood [--users 50] [--spammers 5] [--spam 300] [--spam-rate 30]
+
+e2e собирает тот же Dispatcher, что и main(), на временной БД и фейковой
+сессии (без сети): синтетические пользователи проходят весь free-тест
+(3 дня) и заявки Premium/Lux, апдейты идут через dp.feed_update.
+
+polling — те же пользователи, но через настоящий сетевой путь: long polling
+и отправка по HTTP в локальный fakeapi.FakeBotApi с задержками, 429 и 5xx.
+
+lanes — стресс на очередь пользователя: каждый день free-теста пользователь
+шлёт одной пачкой (двойное нажатие «Опубликовал», статистика без пауз),
+апдейты пачки запускаются задачами сразу, как при polling. В конце по БД
+проверяется, что у каждого ровно 3 строки статистики с его числами.
+С --replay каждая пачка доставляется повторно (как ретрай вебхука).
+
+flood — обычные пользователи в человеческом темпе и спамеры, заваливающие
+шаг материала сообщениями: сколько спама отсёк анти-флуд, сколько вызовов
+API он всё-таки стоил, дошли ли обычные пользователи до конца.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.types import Update
+
+import db
+import fakeapi
+import keyboards as kb
+from session import PreparedMarkupSession
+
+MANAGER = "manager"
+KEYBOARDS = ("main_menu", "premium_kb", "lux_kb", "after_test_kb", "manager_only_kb", "niche_kb")
+
+
+def _call(builder, uncached: bool):
+    args = (MANAGER,) if builder.__wrapped__.__code__.co_argcount else ()
+    return builder.__wrapped__(*args) if uncached else builder(*args)
+
+
+def bench_keyboards(n: int) -> None:
+    kb.warm(MANAGER)
+    bot = Bot(token="42:TEST")
+    plain, prepared = AiohttpSession(), PreparedMarkupSession()
+
+    print(f"{'keyboard':<16} {'build before':>14} {'build after':>13} {'request before':>16} {'request after':>15}  (µs/call)")
+    for name in KEYBOARDS:
+        builder = getattr(kb, name)
+
+        build_before = timeit.timeit(lambda: _call(builder, True), number=n)
+        build_after = timeit.timeit(lambda: _call(builder, False), number=n)
+
+        # keyboard + сериализация запроса, как это делает сессия перед отправкой
+        req_before = timeit.timeit(
+            lambda: plain.build_form_data(bot, SendMessage(chat_id=1, text="x", reply_markup=_call(builder, True))),
+            number=n,
+        )
+        req_after = timeit.timeit(
+            lambda: prepared.build_form_data(bot, SendMessage(chat_id=1, text="x", reply_markup=_call(builder, False))),
+            number=n,
+        )
+
+        us = 1e6 / n
+        print(
+            f"{name:<16} {build_before * us:>14.2f} {build_after * us:>13.2f} "
+            f"{req_before * us:>16.2f} {req_after * us:>15.2f}"
+        )
+
+
+# -------------------- e2e --------------------
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1_000_000
+
+
+class FakeSession(PreparedMarkupSession):
+    """Сессия без сети: сериализует запрос как настоящая и отвечает через api_ms."""
+
+    def __init__(self, api_ms: float = 0.0) -> None:
+        super().__init__()
+        self.api_ms = api_ms
+        self.calls = 0
+        self.chat_calls: Dict[Any, int] = {}
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Any = None) -> Any:
+        self.build_form_data(bot, method)
+        self.calls += 1
+        chat_id = getattr(method, "chat_id", None)
+        self.chat_calls[chat_id] = self.chat_calls.get(chat_id, 0) + 1
+        await asyncio.sleep(self.api_ms / 1000)
+        return True
+
+
+def _user(uid: int) -> Dict[str, Any]:
+    return {"id": uid, "is_bot": False, "first_name": "bench", "username": f"u{uid}"}
+
+
+class UpdateFactory:
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+
+    def message(self, uid: int, text: str = None, video: bool = False) -> Update:
+        n = next(self._ids)
+        payload: Dict[str, Any] = {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": _user(uid),
+        }
+        if video:
+            payload["video"] = {
+                "file_id": f"vid{uid}-{n}", "file_unique_id": f"u{uid}-{n}", "width": 720, "height": 1280, "duration": 15,
+            }
+        else:
+            payload["text"] = text
+        return Update.model_validate({"update_id": n, "message": payload})
+
+    def callback(self, uid: int, data: str) -> Update:
+        n = next(self._ids)
+        return Update.model_validate({
+            "update_id": n,
+            "callback_query": {
+                "id": str(n),
+                "chat_instance": str(uid),
+                "data": data,
+                "from": _user(uid),
+                "message": {"message_id": n, "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "text": "menu"},
+            },
+        })
+
+
+def synthetic_user(
+    f: UpdateFactory,
+    uid: int,
+    rnd: random.Random,
+    fast_stats: bool = False,
+    expected: Optional[Dict[tuple, tuple]] = None,
+) -> List[Update]:
+    """
+    Полный путь пользователя: free-тест на 3 дня, затем заявка Premium или Lux.
+    fast_stats — статистика дня одним сообщением ("12500 830 41 12") вместо четырёх.
+    expected — сюда кладётся {(uid, день): (просмотры, лайки, комментарии, подписки)}.
+    """
+    updates = [
+        f.message(uid, "/start"),
+        f.callback(uid, "free:start"),
+        f.callback(uid, "free:begin"),
+        f.callback(uid, f"free:niche:{rnd.choice(['Эксперт', 'Бизнес', 'Товарка', 'Блог', 'Другое'])}"),
+        f.message(uid, f"https://tiktok.com/@u{uid}"),
+        f.callback(uid, f"free:goal:{rnd.choice(['Просмотры', 'Подписчики', 'Заявки'])}"),
+    ]
+    for day in (1, 2, 3):
+        views = rnd.randint(100, 50000)
+        updates += [
+            f.message(uid, video=True),
+            f.message(uid, f"описание ролика, день {day}"),
+            f.callback(uid, "free:posted"),
+            f.message(uid, f"https://tiktok.com/@u{uid}/video/{day}"),
+            f.callback(uid, "free:stats"),
+        ]
+        numbers = [
+            views,
+            views // rnd.randint(10, 50),
+            views // rnd.randint(100, 500),
+            views // rnd.randint(200, 1000),
+        ]
+        if expected is not None:
+            expected[(uid, day)] = tuple(numbers)
+        if fast_stats:
+            updates.append(f.message(uid, " ".join(map(str, numbers))))
+        else:
+            updates += [f.message(uid, str(n)) for n in numbers]
+    if uid % 2:
+        updates.append(f.callback(uid, "premium:buy"))
+    else:
+        updates += [
+            f.callback(uid, "lux:request"),
+            f.message(uid, "заявки"),
+            f.message(uid, rnd.choice(["10", "20", "30"])),
+            f.message(uid, f"https://tiktok.com/@u{uid}"),
+        ]
+    return updates
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def _bench_e2e(args: argparse.Namespace) -> bool:
+    import bot as app
+    import db_async as adb
+    import metrics
+    from config import Config
+
+    workdir = tempfile.mkdtemp(prefix="neurolux-bench-")
+    db.DEFAULT_DB_PATH = os.path.join(workdir, "bench.db")
+    statements = itertools.count()
+    db.set_trace(lambda sql: next(statements))
+
+    cfg = Config(
+        bot_token="42:TEST",
+        admin_chat_id=ADMIN_ID,
+        manager_username=MANAGER,
+        db_readers=args.readers,
+        db_write_behind=args.write_behind,
+        out_global_rate=1e9,
+        out_chat_rate=1e9,
+        out_chat_burst=1e9,
+        metrics_port=0,
+        throttle="off",
+    )
+    app.init_database()
+    adb.start(readers=cfg.db_readers, write_behind=cfg.db_write_behind)
+    session = FakeSession(api_ms=args.api_ms)
+    bot = app.create_bot(cfg, session=session)
+    dp = app.build_dispatcher(cfg, bot)
+    await dp.emit_startup(bot=bot)
+
+    rnd = random.Random(args.seed)
+    factory = UpdateFactory()
+    expected: Dict[tuple, tuple] = {}
+    scripts = [synthetic_user(factory, FIRST_USER_ID + i, rnd, args.fast_stats, expected) for i in range(args.users)]
+    total = sum(len(s) for s in scripts)
+
+    latencies: List[float] = []
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def walk(updates: List[Update]) -> None:
+        async with sem:
+            for update in updates:
+                started = time.perf_counter()
+                await dp.feed_update(bot, update)
+                latencies.append(time.perf_counter() - started)
+
+    statements_before, calls_before = next(statements), session.calls
+    commits_before = adb.writer_stats()["commits"]
+    started = time.perf_counter()
+    await asyncio.gather(*(walk(s) for s in scripts))
+    await adb.barrier()
+    elapsed = time.perf_counter() - started
+    db_statements = next(statements) - statements_before - 1
+    commits = adb.writer_stats()["commits"] - commits_before
+    api_calls = session.calls - calls_before
+
+    db.set_trace(None)
+    rows = db.connect().execute("SELECT user_id, day, views, likes, comments, follows FROM stats").fetchall()
+    stored = {(user_id, day): tuple(numbers) for user_id, day, *numbers in rows}
+    correct = sum(1 for key, numbers in expected.items() if stored.get(key) == numbers)
+
+    await dp.emit_shutdown(bot=bot)
+    await adb.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    errors = sum(metrics.handler_errors.values.values())
+    mode = "write-behind" if args.write_behind else "commit per write"
+    stats = "one message" if args.fast_stats else "step by step"
+    print(
+        f"users={args.users} concurrency={args.concurrency} api={args.api_ms}ms db={mode} "
+        f"readers={args.readers} stats={stats}"
+    )
+    print(f"updates:          {total} in {elapsed:.2f} s -> {total / elapsed:.0f} updates/s")
+    print(
+        "latency ms:       "
+        f"p50 {_percentile(latencies, 0.5) * 1000:.2f}  p95 {_percentile(latencies, 0.95) * 1000:.2f}  "
+        f"p99 {_percentile(latencies, 0.99) * 1000:.2f}  max {latencies[-1] * 1000:.2f}"
+    )
+    print(f"DB statements:    {db_statements / total:.2f}/update ({commits / total:.2f} commits/update)")
+    print(f"API calls:        {api_calls / total:.2f}/update")
+    print(f"handler errors:   {errors}")
+    print(f"stats rows:       {correct} of {len(expected)} stored with the entered values ({len(rows)} rows)")
+    if args.routes:
+        print()
+        print(metrics.summary(limit=40))
+    ok = not errors and correct == len(expected) == len(rows)
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+async def _bench_polling(args: argparse.Namespace) -> None:
+    import bot as app
+    import db_async as adb
+    import metrics
+    from config import Config
+    from fakeapi import FakeBotApi, build_scripts
+
+    workdir = tempfile.mkdtemp(prefix="neurolux-bench-")
+    db.DEFAULT_DB_PATH = os.path.join(workdir, "bench.db")
+
+    api = FakeBotApi(
+        build_scripts(args.users, FIRST_USER_ID, args.seed),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        rate_5xx=args.rate_5xx,
+        think_ms=args.think_ms,
+        stall_s=args.stall_s,
+        seed=args.seed,
+    )
+    await api.start("127.0.0.1", args.port)
+
+    limits = {} if args.real_limits else {"out_global_rate": 1e9, "out_chat_rate": 1e9, "out_chat_burst": 1e9}
+    cfg = Config(
+        bot_token="42:TEST",
+        admin_chat_id=ADMIN_ID,
+        manager_username=MANAGER,
+        db_readers=args.readers,
+        db_write_behind=args.write_behind,
+        metrics_port=0,
+        throttle="off",
+        api_base_url=f"http://127.0.0.1:{args.port}",
+        **limits,
+    )
+    app.init_database()
+    adb.start(readers=cfg.db_readers, write_behind=cfg.db_write_behind)
+    bot = app.create_bot(cfg)
+    dp = app.build_dispatcher(cfg, bot)
+
+    polling = asyncio.create_task(
+        dp.start_polling(bot, handle_signals=False, allowed_updates=dp.resolve_used_update_types())
+    )
+    try:
+        await asyncio.wait_for(api.finished.wait(), args.deadline)
+    except asyncio.TimeoutError:
+        print(f"deadline {args.deadline}s reached, {api.active} users still active")
+    await asyncio.sleep(args.think_ms / 1000 + 0.2)  # хвостовые сообщения последних апдейтов
+    await dp.stop_polling()
+    await polling
+    await bot.session.close()
+    await adb.close()
+    await api.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    stats = api.stats()
+    retries = int(metrics.gauges["bot_outbound_retries"].value())
+    errors = sum(metrics.handler_errors.values.values())
+    elapsed = stats["elapsed_s"]
+    sends = sum(n for method, n in stats["calls"].items() if method.startswith("send"))
+    print(
+        f"users={args.users} api latency={args.latency_ms}+{args.jitter_ms}ms "
+        f"429={args.rate_429} 5xx={args.rate_5xx} limits={'real' if args.real_limits else 'off'}"
+    )
+    print(f"updates:          {stats['updates_served']} in {elapsed:.2f} s -> {stats['updates_served'] / elapsed:.0f} updates/s")
+    print(
+        f"reply latency ms: p50 {stats['reply_ms']['p50']}  p95 {stats['reply_ms']['p95']}  "
+        f"p99 {stats['reply_ms']['p99']}  (no reply: {stats['stalled']})"
+    )
+    print(f"API calls:        {dict(sorted(stats['calls'].items()))}")
+    print(f"send* calls:      {sends}, injected {stats['injected']}, bot retries {retries}")
+    print(f"peak send rate:   {stats['peak_sends_per_s']}/s total, {stats['peak_chat_sends_per_s']}/s per chat")
+    print(f"handler errors:   {errors}")
+
+
+# -------------------- lanes --------------------
+
+def bursty_user(f: UpdateFactory, uid: int, rnd: random.Random, expected: Dict[tuple, tuple]) -> List[List[Update]]:
+    """Free-тест пачками: апдейты внутри пачки приходят без ожидания ответа бота."""
+    bursts = [
+        [f.message(uid, "/start")],
+        [
+            f.callback(uid, "free:start"),
+            f.callback(uid, "free:begin"),
+            f.callback(uid, "free:niche:Эксперт"),
+            f.message(uid, f"https://tiktok.com/@u{uid}"),
+            f.callback(uid, "free:goal:Просмотры"),
+        ],
+    ]
+    for day in (1, 2, 3):
+        numbers = (rnd.randint(100, 50000), rnd.randint(0, 5000), rnd.randint(0, 500), rnd.randint(0, 100))
+        expected[(uid, day)] = numbers
+        bursts.append([
+            f.message(uid, video=True),
+            f.message(uid, f"описание ролика, день {day}"),
+            f.callback(uid, "free:posted"),
+            f.callback(uid, "free:posted"),
+            f.message(uid, f"https://tiktok.com/@u{uid}/video/{day}"),
+            f.callback(uid, "free:stats"),
+            *(f.message(uid, str(n)) for n in numbers),
+        ])
+    return bursts
+
+
+async def _bench_lanes(args: argparse.Namespace) -> bool:
+    import bot as app
+    import db_async as adb
+    import metrics
+    from config import Config
+
+    workdir = tempfile.mkdtemp(prefix="neurolux-bench-")
+    db.DEFAULT_DB_PATH = os.path.join(workdir, "bench.db")
+
+    cfg = Config(
+        bot_token="42:TEST",
+        admin_chat_id=ADMIN_ID,
+        manager_username=MANAGER,
+        db_write_behind=args.write_behind,
+        out_global_rate=1e9,
+        out_chat_rate=1e9,
+        out_chat_burst=1e9,
+        metrics_port=0,
+        throttle="off",
+        lane_max_pending=0 if args.no_lanes else args.max_pending,
+    )
+    app.init_database()
+    adb.start(readers=cfg.db_readers, write_behind=cfg.db_write_behind)
+    bot = app.create_bot(cfg, session=FakeSession(api_ms=args.api_ms))
+    dp = app.build_dispatcher(cfg, bot)
+    await dp.emit_startup(bot=bot)
+
+    rnd = random.Random(args.seed)
+    factory = UpdateFactory()
+    expected: Dict[tuple, tuple] = {}
+    scripts = [bursty_user(factory, FIRST_USER_ID + i, rnd, expected) for i in range(args.users)]
+    total = sum(len(burst) for s in scripts for burst in s)
+
+    async def walk(bursts: List[List[Update]]) -> None:
+        for burst in bursts:
+            # как polling: задача на апдейт, в порядке поступления
+            await asyncio.gather(*(asyncio.create_task(dp.feed_update(bot, u)) for u in burst))
+            if args.replay:
+                await asyncio.gather(*(asyncio.create_task(dp.feed_update(bot, u)) for u in burst))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(walk(s) for s in scripts))
+    await adb.barrier()
+    elapsed = time.perf_counter() - started
+
+    rows = db.connect().execute("SELECT user_id, day, views, likes, comments, follows FROM stats").fetchall()
+    done = db.connect().execute("SELECT COUNT(*) FROM free_tests WHERE is_done=1").fetchone()[0]
+    await dp.emit_shutdown(bot=bot)
+    await adb.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    seen: Dict[tuple, int] = {}
+    wrong = 0
+    for user_id, day, *numbers in rows:
+        seen[(user_id, day)] = seen.get((user_id, day), 0) + 1
+        if tuple(numbers) != expected.get((user_id, day)):
+            wrong += 1
+    lost = sum(1 for key in expected if key not in seen)
+    duplicated = sum(n - 1 for n in seen.values() if n > 1)
+    unexpected = sum(1 for key in seen if key not in expected)
+
+    errors = sum(metrics.handler_errors.values.values())
+    print(f"users={args.users} api={args.api_ms}ms lanes={'off' if args.no_lanes else args.max_pending}")
+    print(f"updates:          {total} in {elapsed:.2f} s -> {total / elapsed:.0f} updates/s")
+    print(
+        f"lane wait ms:     p50 {metrics.lane_wait_seconds.quantile(0.5) * 1000:.2f}  "
+        f"p95 {metrics.lane_wait_seconds.quantile(0.95) * 1000:.2f}, dropped {metrics.lane_dropped.values.get((), 0):g}"
+    )
+    if args.replay:
+        print(f"replays skipped:  {metrics.updates_duplicate.values.get((), 0):g} of {total}")
+    print(f"stats rows:       {len(rows)} of {len(expected)} expected")
+    print(f"lost/dup/wrong:   {lost}/{duplicated}/{wrong + unexpected}")
+    print(f"tests finished:   {done} of {args.users}")
+    print(f"handler errors:   {errors}")
+    ok = not (lost or duplicated or wrong or unexpected or errors) and done == args.users
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+# -------------------- flood --------------------
+
+async def _bench_flood(args: argparse.Namespace) -> None:
+    import bot as app
+    import db_async as adb
+    import metrics
+    from config import Config
+
+    workdir = tempfile.mkdtemp(prefix="neurolux-bench-")
+    db.DEFAULT_DB_PATH = os.path.join(workdir, "bench.db")
+
+    cfg = Config(
+        bot_token="42:TEST",
+        admin_chat_id=ADMIN_ID,
+        manager_username=MANAGER,
+        out_global_rate=1e9,
+        out_chat_rate=1e9,
+        out_chat_burst=1e9,
+        metrics_port=0,
+        **({"throttle": "off"} if args.no_throttle else {}),
+    )
+    app.init_database()
+    adb.start(readers=cfg.db_readers)
+    session = FakeSession()
+    bot = app.create_bot(cfg, session=session)
+    dp = app.build_dispatcher(cfg, bot)
+    await dp.emit_startup(bot=bot)
+
+    rnd = random.Random(args.seed)
+    factory = UpdateFactory()
+    users = [synthetic_user(factory, FIRST_USER_ID + i, rnd) for i in range(args.users)]
+    spammer_ids = [FIRST_USER_ID + args.users + i for i in range(args.spammers)]
+    think = args.think_ms / 1000
+
+    async def walk(updates: List[Update]) -> None:
+        for update in updates:
+            await dp.feed_update(bot, update)
+            await asyncio.sleep(think)
+
+    async def spam(uid: int) -> int:
+        # дошли до шага материала в человеческом темпе, дальше — поток сообщений без ожидания ответа
+        await walk(synthetic_user(factory, uid, rnd)[:6])
+        calls_before = session.chat_calls.get(uid, 0)
+        tasks = []
+        for n in range(args.spam):
+            tasks.append(asyncio.create_task(dp.feed_update(bot, factory.message(uid, f"спам {n}"))))
+            await asyncio.sleep(1 / args.spam_rate)
+        await asyncio.gather(*tasks)
+        return session.chat_calls.get(uid, 0) - calls_before
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(walk(u) for u in users), *(spam(uid) for uid in spammer_ids))
+    await adb.barrier()
+    elapsed = time.perf_counter() - started
+    spam_calls = sum(results[args.users:])
+
+    finished = db.connect().execute(
+        "SELECT COUNT(*) FROM free_tests WHERE is_done=1 AND user_id < ?", (spammer_ids[0] if spammer_ids else 1 << 62,)
+    ).fetchone()[0]
+    await dp.emit_shutdown(bot=bot)
+    await adb.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    spam_total = args.spammers * args.spam
+    dropped = sum(metrics.throttled.values.values()) + metrics.lane_dropped.values.get((), 0)
+    print(f"users={args.users} (think {args.think_ms}ms) spammers={args.spammers} x {args.spam} msgs at {args.spam_rate}/s")
+    print(f"elapsed:          {elapsed:.2f} s")
+    print(f"throttled:        {dict(sorted((g, int(n)) for (g,), n in metrics.throttled.values.items()))}")
+    print(f"spam dropped:     {dropped:g} of {spam_total}")
+    print(f"spam cost:        {spam_calls / max(spam_total, 1):.3f} API calls/msg")
+    print(f"normal users:     {finished} of {args.users} finished the test")
+    print(f"handler errors:   {sum(metrics.handler_errors.values.values())}")
+
+
+def bench_flood(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_bench_flood(args))
+
+
+def bench_lanes(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    # код выхода — чтобы сценарий можно было гонять как проверку
+    if not asyncio.run(_bench_lanes(args)):
+        sys.exit(1)
+
+
+def bench_polling(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_bench_polling(args))
+
+
+def bench_e2e(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    if not asyncio.run(_bench_e2e(args)):
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="NeuroLux benchmarks")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    p_kb = sub.add_parser("keyboards", help="keyboard building/serialization cost before vs after caching")
+    p_kb.add_argument("--n", type=int, default=20000)
+
+    p_e2e = sub.add_parser("e2e", help="synthetic users through the full Dispatcher, no network")
+    p_e2e.add_argument("--users", type=int, default=1000)
+    p_e2e.add_argument("--concurrency", type=int, default=100, help="users walking the flow at the same time")
+    p_e2e.add_argument("--api-ms", type=float, default=0.0, help="simulated Telegram API latency")
+    p_e2e.add_argument("--readers", type=int, default=4)
+    p_e2e.add_argument("--write-behind", action="store_true")
+    p_e2e.add_argument("--seed", type=int, default=42)
+    p_e2e.add_argument("--routes", action="store_true", help="also print per-route latency from metrics")
+    p_e2e.add_argument("--fast-stats", action="store_true", help="enter each day's stats in one message")
+
+    p_poll = sub.add_parser("polling", help="synthetic users via long polling against a local fake Bot API")
+    fakeapi.add_arguments(p_poll)
+    p_poll.set_defaults(users=50)
+    p_poll.add_argument("--port", type=int, default=8081)
+    p_poll.add_argument("--readers", type=int, default=4)
+    p_poll.add_argument("--write-behind", action="store_true")
+    p_poll.add_argument("--real-limits", action="store_true", help="keep OUT_* rate limits (30/s, 1/s per chat)")
+    p_poll.add_argument("--deadline", type=float, default=600)
+
+    p_lanes = sub.add_parser("lanes", help="bursts of updates per user: no lost or duplicated stats")
+    p_lanes.add_argument("--users", type=int, default=300)
+    p_lanes.add_argument("--api-ms", type=float, default=2.0, help="simulated Telegram API latency")
+    p_lanes.add_argument("--max-pending", type=int, default=20, help="LANE_MAX_PENDING")
+    p_lanes.add_argument("--no-lanes", action="store_true", help="disable per-user lanes to reproduce the race")
+    p_lanes.add_argument("--replay", action="store_true", help="deliver every update twice")
+    p_lanes.add_argument("--write-behind", action="store_true")
+    p_lanes.add_argument("--seed", type=int, default=42)
+
+    p_flood = sub.add_parser("flood", help="spammers flooding a step next to normal users")
+    p_flood.add_argument("--users", type=int, default=50)
+    p_flood.add_argument("--think-ms", type=float, default=600, help="pause of a normal user between updates")
+    p_flood.add_argument("--spammers", type=int, default=5)
+    p_flood.add_argument("--spam", type=int, default=300, help="messages per spammer")
+    p_flood.add_argument("--spam-rate", type=float, default=30, help="messages per second per spammer")
+    p_flood.add_argument("--no-throttle", action="store_true")
+    p_flood.add_argument("--seed", type=int, default=42)
+
+    args = parser.parse_args()
+    if args.scenario == "keyboards":
+        bench_keyboards(args.n)
+    elif args.scenario == "e2e":
+        bench_e2e(args)
+    elif args.scenario == "polling":
+        bench_polling(args)
+    elif args.scenario == "lanes":
+        bench_lanes(args)
+    elif args.scenario == "flood":
+        bench_flood(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,40 @@
+import argparse
 import asyncio
 import logging
+import os
 import re
-from typing import Optional, Tuple
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.types import CallbackQuery, ErrorEvent, FSInputFile, Message
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart, StateFilter, Command
+from aiogram.filters import CommandStart, StateFilter, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 
-from config import load_config
+from config import Config, load_config
 import texts
 import keyboards as kb
 import db
+import db_async as adb
 from states import FreeTestFlow, LuxFlow
-from services import make_test_report
+from broadcast import Broadcaster, SEGMENT_TITLES, send_payload
+from dedup import UpdateDedup
+from export import EXPORT_FORMATS, MAX_DOCUMENT_BYTES, export_to_file
+from jobs import JOB_CLAIMED, JOB_DELIVERED, JobQueue, job_caption, job_ref
+from lanes import LaneMiddleware
+import metrics
+from media import ALIAS_RE, KIND_TITLES, MediaCatalog, MediaItem, message_media
+from metrics import ApiTimingMiddleware, MetricsMiddleware, MetricsServer, RouteMiddleware, material_duplicate
+from outbox import Outbox, OutboundMiddleware, RateLimiter
+from session import PreparedMarkupSession
+from storage import SQLiteStorage
+from supervisor import run_supervisor
+from throttle import ThrottleMiddleware, parse_rates
+from webhook import run_webhook
+from services import CohortIndex, make_test_report, metrics_from_rows
 
 
 # -------------------- helpers --------------------
@@ -44,20 +64,77 @@ def norm_text(s: str) -> str:
     return re.sub(r"[\u200b-\u200f\u2060\uFEFF]", "", s or "").strip()
 
 
-def parse_user_and_file(text: str) -> Tuple[Optional[int], Optional[str]]:
+# статистика: 12500, 12.5k, 1,2К; дробная часть — только с суффиксом (12,500 — это два числа)
+_COUNT_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*([kкmм])(?![^\W\d_])|(\d+)", re.IGNORECASE)
+_COUNT_SUFFIX = {"k": 1_000, "к": 1_000, "m": 1_000_000, "м": 1_000_000}
+_COUNT_MAX = 10 ** 12
+# "-" не разделитель: "-830" — отрицательное число, а не 830
+_STATS_SEPARATORS_RE = re.compile(r"^[\s,;:|/.]*$")
+# "12 500" — одно число, только если пробелы делят его на группы по три цифры
+_THOUSANDS_RE = re.compile(r"\d{1,3}(?:\s\d{3})+")
+
+
+def _count(match: re.Match) -> int:
+    if match.group(3) is not None:
+        return int(match.group(3))
+    return round(float(match.group(1).replace(",", ".")) * _COUNT_SUFFIX[match.group(2).lower()])
+
+
+def parse_count(s: str) -> Optional[int]:
+    """Одно неотрицательное число: 12500, 12 500, 12.5k, 1,2К. Иначе None."""
+    s = norm_text(s)
+    if _THOUSANDS_RE.fullmatch(s):
+        s = re.sub(r"\s", "", s)
+    match = _COUNT_RE.fullmatch(s)
+    if not match:
+        return None
+    n = _count(match)
+    return n if n <= _COUNT_MAX else None
+
+
+def parse_stats(s: str) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Просмотры, лайки, комментарии и подписки одним сообщением:
+    "12500 830 41 12", "12.5k/830/41/12", "1,2К; 90; 4; 0". Ровно четыре числа
+    и между ними только разделители — иначе None.
+    """
+    s = norm_text(s)
+    matches = list(_COUNT_RE.finditer(s))
+    if len(matches) != 4 or not _STATS_SEPARATORS_RE.match(_COUNT_RE.sub(" ", s)):
+        return None
+    counts = tuple(_count(match) for match in matches)
+    return counts if max(counts) <= _COUNT_MAX else None
+
+
+# адресная отправка админа: больше — через /broadcast
+BATCH_MAX = 500
+
+_USER_IDS_RE = re.compile(r"^\d+(?:-\d+)?(?:,\d+(?:-\d+)?)*$")
+
+
+def parse_recipients(text: str) -> Tuple[Optional[str], Optional[str]]:
+    """'/cmd получатели [остальное]' -> (получатели, остальное или None)."""
     t = norm_text(text)
-    if not t:
-        return None, None
     t = re.sub(r"^/\w+(?:@\w+)?\s*", "", t).strip()
     if not t:
         return None, None
-    m = re.match(r"^(\d+)\s*(.*)$", t)
-    if not m:
-        return None, None
-    user_id = int(m.group(1))
-    rest = m.group(2).strip()
-    file_id = rest if rest else None
-    return user_id, file_id
+    token, *rest = t.split(None, 1)
+    return token, rest[0].strip() if rest else None
+
+
+def parse_user_ids(token: str) -> Optional[List[int]]:
+    """'5' / '5,7,9' / '100-120' / '5,100-120' -> user_id по порядку без повторов; None — не список."""
+    if not _USER_IDS_RE.match(token):
+        return None
+    user_ids: List[int] = []
+    for part in token.split(","):
+        low, _, high = part.partition("-")
+        first, last = int(low), int(high or low)
+        if last < first:
+            return None
+        # огромный диапазон не разворачиваем: хватит знать, что он больше лимита
+        user_ids.extend(range(first, min(last, first + BATCH_MAX) + 1))
+    return list(dict.fromkeys(user_ids))
 
 
 async def send_err(m: Message, where: str, e: Exception):
@@ -69,20 +146,170 @@ def truncate(s: str, n: int = 3500) -> str:
     return s if len(s) <= n else (s[: n - 3] + "...")
 
 
+def parse_window(args: list) -> Optional[Tuple[Optional[str], Optional[str], str]]:
+    """
+    Период для /funnel: [] / 7 / 30 — последние N дней, today, all,
+    YYYY-MM-DD [YYYY-MM-DD]. Дни — UTC, как date('now') в SQLite.
+    Возвращает (since, until, подпись) или None при неверном формате.
+    """
+    today = datetime.now(timezone.utc).date()
+    arg = args[0].lower() if args else "7"
+    if arg == "all" and len(args) <= 1:
+        return None, None, "за всё время"
+    if arg == "today" and len(args) <= 1:
+        return today.isoformat(), today.isoformat(), f"сегодня ({today})"
+    if is_int(arg) and len(args) <= 1 and int(arg) > 0:
+        since = today - timedelta(days=int(arg) - 1)
+        return since.isoformat(), today.isoformat(), f"последние {arg} дн. ({since} — {today})"
+    try:
+        bounds = [date.fromisoformat(a) for a in args[:2]]
+    except ValueError:
+        return None
+    if len(args) > 2:
+        return None
+    since, until = bounds[0], bounds[-1] if len(bounds) > 1 else today
+    return since.isoformat(), until.isoformat(), f"{since} — {until}"
+
+
 # -------------------- main --------------------
 
-async def main():
-    logging.basicConfig(level=logging.INFO)
+def init_database() -> None:
+    t0 = time.perf_counter()
+    old_version, new_version = db.init_db()
+    for name, plan in db.check_query_plans().items():
+        logging.error(f"Hot query '{name}' is not using an index: {plan}")
+    took_ms = (time.perf_counter() - t0) * 1000
+
+    if old_version != new_version:
+        logging.info(f"DB migrated v{old_version} -> v{new_version} in {took_ms:.1f} ms")
+    else:
+        logging.info(f"DB schema v{new_version} is current, startup took {took_ms:.1f} ms")
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="NeuroLux Telegram bot")
+    parser.add_argument(
+        "--migrate-only",
+        action="store_true",
+        help="apply pending DB migrations and exit (no BOT_TOKEN needed)",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--webhook",
+        dest="mode",
+        action="store_const",
+        const="webhook",
+        help="serve updates from an aiohttp webhook server (overrides BOT_MODE)",
+    )
+    mode.add_argument(
+        "--polling",
+        dest="mode",
+        action="store_const",
+        const="polling",
+        help="use long polling (overrides BOT_MODE)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="run N worker processes behind a supervisor (overrides WORKERS)",
+    )
+    return parser.parse_args(argv)
+
+
+def create_bot(cfg: Config, session: Optional[PreparedMarkupSession] = None) -> Bot:
+    """session — подмена HTTP-сессии (bench.py гоняет бота без сети)."""
+    if session is None:
+        api = PRODUCTION
+        if cfg.api_base_url:
+            api = TelegramAPIServer.from_base(cfg.api_base_url)
+            logging.warning(f"Bot API base URL overridden: {cfg.api_base_url}")
+        session = PreparedMarkupSession(api=api)
+    bot = Bot(token=cfg.bot_token, session=session, parse_mode=ParseMode.MARKDOWN)
+    # лимиты Telegram — на токен, а не на процесс: воркер супервизора берёт свою долю.
+    # Чаты пользователей поделены между воркерами, а в чат админа пишут все.
+    share = cfg.workers if cfg.worker_id is not None else 1
+    limiter = RateLimiter(
+        global_rate=cfg.out_global_rate / share,
+        chat_rate=cfg.out_chat_rate,
+        chat_burst=cfg.out_chat_burst,
+        chat_limits={
+            int(cfg.admin_chat_id): (cfg.out_chat_rate / share, max(1.0, cfg.out_chat_burst / share)),
+        },
+    )
+    outbound = OutboundMiddleware(limiter, max_retries=cfg.out_max_retries)
+    bot.session.middleware(outbound)
+    # после лимитера: меряем сам запрос к API, а не ожидание токенов
+    bot.session.middleware(ApiTimingMiddleware())
+
+    metrics.gauge("bot_outbound_waiting", "Outbound calls waiting for the global rate limit", limiter.waiting)
+    metrics.gauge("bot_outbound_retries", "Outbound retries on 429/5xx", lambda: outbound.retries)
+    return bot
 
-    cfg = load_config()
-    db.init_db()
 
-    bot = Bot(token=cfg.bot_token, parse_mode=ParseMode.MARKDOWN)
-    dp = Dispatcher()
+def build_dispatcher(cfg: Config, bot: Bot) -> Dispatcher:
+    """Dispatcher со всеми хендлерами. БД (init_db + db_async.start) должна быть готова."""
+    kb.warm(cfg.manager_username)
+
+    storage = SQLiteStorage(
+        cache_size=cfg.fsm_cache_size,
+        cache_ttl=cfg.fsm_cache_ttl,
+        session_ttl=cfg.fsm_session_ttl,
+    )
+    # FSM-middleware подключаем сами: сначала очередь пользователя, потом чтение состояния
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.startup.register(storage.start)
+    # повторно доставленные апдейты отсеиваются до очереди пользователя
+    dedup = UpdateDedup(size=cfg.dedup_size, worker=cfg.worker_id or 0)
+    dp.update.outer_middleware(dedup)
+    dp.startup.register(dedup.start)
+    dp.shutdown.register(dedup.close)
+    lanes = LaneMiddleware(max_pending=cfg.lane_max_pending)
+    dp.update.outer_middleware(lanes)
+    dp.update.outer_middleware(dp.fsm)
+
+    dp.update.outer_middleware(MetricsMiddleware())
+    dp.message.middleware(RouteMiddleware())
+    dp.callback_query.middleware(RouteMiddleware())
+    # анти-флуд: хендлер уже выбран, но в БД и API ещё ничего не ушло
+    throttle = ThrottleMiddleware(
+        parse_rates(cfg.throttle),
+        max_buckets=cfg.throttle_max_buckets,
+        exempt=(cfg.admin_chat_id,),
+    )
+    dp.message.middleware(throttle)
+    dp.callback_query.middleware(throttle)
+
+    # воркер супервизора владеет своими строками outbox и своими рассылками
+    owner = cfg.worker_id or 0
+    outbox = Outbox(bot, owner=owner, owners=cfg.workers)
+    dp["outbox"] = outbox
+    dp.startup.register(outbox.start)
+    dp.shutdown.register(outbox.close)
+
+    # распределения результатов завершённых тестов для сравнения в отчёте
+    cohorts = CohortIndex()
+    dp["cohorts"] = cohorts
+
+    async def load_cohorts():
+        started = time.perf_counter()
+        totals = await adb.completed_test_totals()
+        # сортировка сотен тысяч значений — не в event loop
+        count = await asyncio.to_thread(cohorts.rebuild, totals)
+        logging.info(f"Cohorts: {count} completed tests loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    dp.startup.register(load_cohorts)
 
     ADMIN_ID = int(cfg.admin_chat_id)
 
-    last_media = {"video": None, "document": None, "photo": None}
+    # медиа админа: LAST VIDEO/PHOTO/DOC и алиасы переживают рестарт
+    media = MediaCatalog()
+    dp.startup.register(media.load)
+
+    # исходники free-теста ждут готового видео в очереди заданий
+    jobs = JobQueue()
+    dp.startup.register(jobs.start)
+    dp.shutdown.register(jobs.close)
 
     FREE_RULES_NEW_TEXT = (
         "⏰ Время публикации:\n"
@@ -107,9 +334,10 @@ async def main():
             "Можно прислать в любом порядке — я подскажу, чего не хватает."
         )
 
+    # уведомления админу — через фоновую очередь: пользователь не ждёт лишние вызовы API
     async def notify_admin(text: str):
         try:
-            await bot.send_message(
+            await outbox.send_message(
                 ADMIN_ID,
                 text,
                 parse_mode=None,
@@ -118,62 +346,161 @@ async def main():
         except Exception as e:
             logging.exception(f"Admin notify error: {e}")
 
-    async def forward_free_material_to_admin(day: int, user_id: int, username: str | None, video_id: str, desc: str):
+    async def forward_free_material_to_admin(
+        job_id: Optional[int], day: int, user_id: int, username: str | None, video_id: str, desc: str
+    ):
+        title = f"{job_caption(job_id)} — Free тест" if job_id else "Free тест"
         header = (
-            f"📦 Free тест — День {day} — исходник + описание\n"
+            f"📦 {title}, День {day} — исходник + описание\n"
             f"User: {safe_username(username)} | id={user_id}\n\n"
             "📝 Описание:\n"
             f"{truncate(desc, 3500)}"
         )
-        await bot.send_message(ADMIN_ID, header, parse_mode=None, disable_web_page_preview=True)
-        await bot.send_video(ADMIN_ID, video_id)
+        await outbox.send_message(ADMIN_ID, header, parse_mode=None, disable_web_page_preview=True)
+        if job_id:
+            await outbox.send_video(ADMIN_ID, video_id, caption=f"{job_caption(job_id)}: ответь на это видео готовым роликом")
+        else:
+            await outbox.send_video(ADMIN_ID, video_id)
+
+    broadcaster = Broadcaster(
+        bot,
+        on_report=notify_admin,
+        concurrency=cfg.broadcast_concurrency,
+        chunk_size=cfg.broadcast_chunk,
+        owner=owner,
+        owners=cfg.workers,
+    )
+    dp["broadcaster"] = broadcaster
+    dp.startup.register(broadcaster.start)
+    dp.shutdown.register(broadcaster.close)
+
+    metrics.gauge("bot_outbox_queue", "Admin notifications waiting in the outbox", outbox.qsize)
+    metrics.gauge("bot_outbox_failed", "Outbox messages dropped", lambda: outbox.failed)
+    metrics.gauge("bot_broadcasts_running", "Broadcasts in progress", broadcaster.running)
+    metrics.gauge("bot_admin_batches_running", "Multi-recipient admin sends in progress", broadcaster.batches)
+    metrics.gauge("bot_db_pending_writes", "Writes queued but not committed", lambda: adb.writer_stats()["pending"])
+    metrics.gauge("bot_db_commits", "DB commits", lambda: adb.writer_stats()["commits"])
+    metrics.gauge("bot_db_snapshot_cache_size", "Test snapshots cached", lambda: db.cache_stats()["size"])
+    metrics.gauge("bot_db_snapshot_cache_hit_rate", "Test snapshot cache hit rate", lambda: db.cache_stats()["hit_rate"])
+    metrics.gauge("bot_fsm_cache_size", "FSM sessions cached in memory", lambda: storage.stats()["size"])
+    metrics.gauge("bot_fsm_cache_hit_rate", "FSM memory tier hit rate", lambda: storage.stats()["hit_rate"])
+    metrics.gauge("bot_media_items", "Files in the admin media catalog", lambda: len(media))
+    metrics.gauge("bot_lanes_active", "Users with updates in progress", lambda: lanes.stats()["lanes"])
+    metrics.gauge("bot_lanes_waiting", "Updates waiting for an earlier update of the same user", lambda: lanes.stats()["waiting"])
+    metrics.gauge("bot_jobs_queued", "Free test jobs waiting for the admin", jobs.depth)
+    metrics.gauge("bot_jobs_claimed", "Free test jobs taken by the admin and not delivered", lambda: jobs.depth(JOB_CLAIMED))
+    metrics.gauge("bot_jobs_oldest_age_seconds", "Age of the oldest undelivered free test job", jobs.oldest_age)
+    metrics.gauge("bot_throttle_buckets", "Per-user flood limit buckets in memory", lambda: throttle.stats()["buckets"])
+
+    metrics_server = MetricsServer(cfg.metrics_host, cfg.metrics_port)
+    dp.startup.register(metrics_server.start)
+    dp.shutdown.register(metrics_server.close)
 
     @dp.error()
-    async def on_error(event, exception: Exception):
-        logging.exception(f"Unhandled error: {exception}")
+    async def on_error(event: ErrorEvent):
+        logging.exception(f"Unhandled error: {event.exception}", exc_info=event.exception)
         return True
 
     # ========================= ADMIN: CAPTURE FILE_ID (ТОЛЬКО ДЛЯ АДМИНА) =========================
 
-    @dp.message(StateFilter(None), F.from_user.id == ADMIN_ID, F.video)
-    async def admin_capture_video_id(m: Message):
-        v = m.video
-        last_media["video"] = v.file_id
-        await m.answer(
-            "🎥 VIDEO FILE_ID:\n"
-            f"{v.file_id}\n\n"
+    def captured_text(item: MediaItem) -> str:
+        title, command = {
+            "video": ("VIDEO", "/video"),
+            "document": ("DOC", "/doc"),
+            "photo": ("PHOTO", "/photo"),
+        }[item.kind]
+        alias = f"Алиас: {item.alias}\n" if item.alias else f"Дай имя: /alias имя {item.file_unique_id}\n"
+        return (
+            f"{KIND_TITLES[item.kind]} {title} FILE_ID:\n"
+            f"{item.file_id}\n\n"
             "🧷 FILE_UNIQUE_ID:\n"
-            f"{v.file_unique_id}\n\n"
-            "✅ Сохранено как LAST VIDEO.\n"
-            "`/video <user_id>` (без file_id)"
+            f"{item.file_unique_id}\n\n"
+            f"✅ Сохранено в каталог как LAST {title}.\n"
+            f"{alias}"
+            f"{command} <user_id> (без file_id) или {command} <user_id> <алиас>"
         )
 
-    @dp.message(StateFilter(None), F.from_user.id == ADMIN_ID, F.document)
-    async def admin_capture_document_id(m: Message):
-        d = m.document
-        last_media["document"] = d.file_id
+    # ========================= ADMIN: FREE TEST JOBS =========================
+
+    def job_reply(m: Message):
+        """Фильтр: ответ на сообщение бота с «Задание #N» — отдаёт job_id хендлеру."""
+        r = m.reply_to_message
+        job_id = job_ref(r.caption or r.text) if r else None
+        return {"job_id": job_id} if job_id else False
+
+    @dp.message(Command("next"))
+    async def admin_job_next(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
+
+        job = await jobs.claim()
+        if job is None:
+            return await m.answer("✅ Очередь пуста: новых исходников нет.")
         await m.answer(
-            "📄 DOCUMENT FILE_ID:\n"
-            f"{d.file_id}\n\n"
-            "🧷 FILE_UNIQUE_ID:\n"
-            f"{d.file_unique_id}\n\n"
-            "✅ Сохранено как LAST DOC.\n"
-            "`/doc <user_id>` (без file_id)"
+            f"🛠 {job_caption(job['id'])} — День {job['day']} | user id={job['user_id']}\n"
+            f"В очереди ещё: {jobs.depth()}\n\n"
+            "📝 Описание:\n"
+            f"{truncate(job['description'] or '—', 3500)}",
+            parse_mode=None,
+        )
+        await m.answer_video(
+            job["source_file_id"],
+            caption=f"{job_caption(job['id'])}: ответь на это видео готовым роликом",
+            parse_mode=None,
         )
 
-    @dp.message(StateFilter(None), F.from_user.id == ADMIN_ID, F.photo)
-    async def admin_capture_photo_id(m: Message):
-        p = m.photo[-1]
-        last_media["photo"] = p.file_id
+    @dp.message(Command("jobs"))
+    async def admin_jobs(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
+
+        await jobs.refresh()
+        lines = [
+            (
+                f"🛠 Задания: в очереди {jobs.depth()}, в работе {jobs.depth(JOB_CLAIMED)}, "
+                f"самое старое ждёт {jobs.oldest_age() / 60:.0f} мин"
+            ),
+        ]
+        now = time.time()
+        for job in await jobs.open():
+            status = "в работе" if job["status"] == JOB_CLAIMED else "в очереди"
+            lines.append(
+                f"#{job['id']} День {job['day']} | id={job['user_id']} | {status} | "
+                f"{(now - job['created_at']) / 60:.0f} мин"
+            )
+        lines += ["", "/next — взять следующее, reply готовым видео — доставить"]
+        await m.answer("\n".join(lines), parse_mode=None)
+
+    @dp.message(StateFilter(None), F.from_user.id == ADMIN_ID, F.video, job_reply)
+    async def admin_job_deliver(m: Message, job_id: int):
+        job = await jobs.get(job_id)
+        if job is None:
+            return await m.answer(f"{job_caption(job_id)} не найдено.")
+        if job["status"] == JOB_DELIVERED:
+            return await m.answer(f"{job_caption(job_id)} уже доставлено.")
+
+        try:
+            await bot.send_video(
+                job["user_id"],
+                m.video.file_id,
+                caption=texts.JOB_READY.format(day=job["day"]),
+                reply_markup=kb.day_actions_kb(),
+            )
+        except Exception as e:
+            return await send_err(m, f"{job_caption(job_id)} -> {job['user_id']}", e)
+        await jobs.deliver(job, m.video.file_id)
+        await media.add(message_media(m))
         await m.answer(
-            "🖼 PHOTO FILE_ID:\n"
-            f"{p.file_id}\n\n"
-            "🧷 FILE_UNIQUE_ID:\n"
-            f"{p.file_unique_id}\n\n"
-            "✅ Сохранено как LAST PHOTO.\n"
-            "`/photo <user_id>` (без file_id)"
+            f"✅ {job_caption(job_id)} доставлено: id={job['user_id']}, День {job['day']}.\n"
+            f"В очереди: {jobs.depth()}",
+            parse_mode=None,
         )
 
+    @dp.message(StateFilter(None), F.from_user.id == ADMIN_ID, F.video | F.document | F.photo)
+    async def admin_capture_media(m: Message):
+        item = await media.add(message_media(m))
+        await m.answer(captured_text(item), parse_mode=None)
+
     @dp.message(Command("getid"))
     async def admin_getid_reply(m: Message):
         if m.from_user.id != ADMIN_ID:
@@ -183,22 +510,97 @@ async def main():
         if not r:
             return await m.answer("Формат: ответь командой /getid на сообщение с видео/фото/файлом.")
 
-        if r.video:
-            last_media["video"] = r.video.file_id
-            return await m.answer("✅ LAST VIDEO обновлён.")
+        item = message_media(r)
+        if item is None:
+            return await m.answer("В reply нет видео/фото/файла.")
+        item = await media.add(item)
+        return await m.answer(captured_text(item), parse_mode=None)
+
+    # ========================= ADMIN: MEDIA CATALOG =========================
 
-        if r.document:
-            last_media["document"] = r.document.file_id
-            return await m.answer("✅ LAST DOC обновлён.")
+    @dp.message(Command("media"))
+    async def admin_media(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
+
+        args = norm_text(m.text or "").split()[1:]
+        kind = {"video": "video", "photo": "photo", "doc": "document"}.get(args[0]) if args else None
+        if kind:
+            args = args[1:]
+        limit = int(args[0]) if args and is_int(args[0]) else 10
+        items = media.recent(kind, min(max(limit, 1), 50))
+        if not items:
+            return await m.answer("Каталог пуст: пришли боту видео/фото/файл.")
+        lines = [f"🗂 Медиа ({len(media)} в каталоге), свежие первыми:"]
+        lines += [item.title() for item in items]
+        lines += ["", "/media video|photo|doc [N], /media_find текст, /alias имя [file_unique_id]"]
+        await m.answer("\n".join(lines), parse_mode=None)
+
+    @dp.message(Command("media_find"))
+    async def admin_media_find(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
 
-        if r.photo:
-            last_media["photo"] = r.photo[-1].file_id
-            return await m.answer("✅ LAST PHOTO обновлён.")
+        parts = norm_text(m.text or "").split(maxsplit=1)
+        if len(parts) < 2:
+            return await m.answer("Формат: /media_find текст (ищет в алиасе, подписи и #тегах)", parse_mode=None)
+        items = media.search(parts[1])
+        if not items:
+            return await m.answer("Ничего не нашлось.")
+        await m.answer("\n".join(item.title() for item in items), parse_mode=None)
+
+    @dp.message(Command("alias"))
+    async def admin_alias(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
+
+        args = norm_text(m.text or "").split()[1:]
+        if not args or not ALIAS_RE.match(args[0]):
+            return await m.answer(
+                "Формат: /alias имя [file_unique_id|алиас] или reply /alias имя на медиа.\n"
+                "Без файла — последнее присланное. Имя: буквы, цифры, _ и -, не только цифры.",
+                parse_mode=None,
+            )
+
+        alias = args[0]
+        if len(args) > 1:
+            item = media.get(args[1])
+        elif m.reply_to_message and message_media(m.reply_to_message):
+            item = await media.add(message_media(m.reply_to_message))
+        else:
+            item = media.latest()
+        if item is None:
+            return await m.answer("Файл не найден в каталоге.")
 
-        return await m.answer("В reply нет видео/фото/файла.")
+        await media.set_alias(item, alias)
+        await m.answer(f"✅ {item.title()}", parse_mode=None)
 
     # ========================= ADMIN SEND =========================
 
+    RECIPIENTS_HELP = (
+        "Получатели: user_id, список 1,2,3, диапазон 100-120 (можно вместе: 1,5-9) "
+        f"или сегмент ({', '.join(SEGMENT_TITLES)}), до {BATCH_MAX} за раз."
+    )
+
+    async def resolve_recipients(token: str) -> Optional[List[int]]:
+        if token in SEGMENT_TITLES:
+            return await adb.segment_user_ids(token, BATCH_MAX + 1)
+        return parse_user_ids(token)
+
+    async def admin_deliver(m: Message, user_ids: List[int], kind: str, payload: dict, done: str, where: str):
+        """
+        Один получатель — как раньше; несколько — в фоне (пачка под лимитами идёт
+        секунды, а очередь апдейтов админа ждать не должна), итог придёт отдельным сообщением.
+        """
+        if len(user_ids) == 1:
+            try:
+                await send_payload(bot, user_ids[0], kind, payload)
+                return await m.answer(done)
+            except Exception as e:
+                return await send_err(m, where, e)
+        broadcaster.batch(user_ids, kind, payload, done.rstrip("."))
+        await m.answer(f"⏳ Отправляю {len(user_ids)} получателям, итог пришлю отдельным сообщением.")
+
     @dp.message(Command("say"))
     async def admin_say(m: Message):
         if m.from_user.id != ADMIN_ID:
@@ -206,125 +608,251 @@ async def main():
 
         parts = (m.text or "").split(maxsplit=2)
         if len(parts) < 3:
-            return await m.answer("Формат: /say user_id текст")
-
-        try:
-            user_id = int(parts[1])
-        except ValueError:
-            return await m.answer("user_id должен быть числом.")
+            return await m.answer(f"Формат: /say получатели текст\n{RECIPIENTS_HELP}", parse_mode=None)
+
+        user_ids = await resolve_recipients(parts[1])
+        if user_ids is None:
+            return await m.answer(f"Не понял получателей: {parts[1]}\n{RECIPIENTS_HELP}", parse_mode=None)
+        if not user_ids:
+            return await m.answer("В сегменте нет получателей.")
+        if len(user_ids) > BATCH_MAX:
+            return await m.answer(f"Больше {BATCH_MAX} получателей — используй /broadcast.")
+
+        await admin_deliver(m, user_ids, "text", {"text": parts[2]}, "✅ Сообщение отправлено.", "send_message")
+
+    # команда -> (kind, LAST-метка, метод для ошибок, ответ при успехе)
+    ADMIN_MEDIA = {
+        "video": ("video", "VIDEO", "send_video", "🎬 Видео отправлено"),
+        "photo": ("photo", "PHOTO", "send_photo", "🖼 Фото отправлено"),
+        "doc": ("document", "DOC", "send_document", "📄 Файл отправлен"),
+    }
+
+    @dp.message(Command("video", "photo", "doc"))
+    async def admin_send_media(m: Message, command: CommandObject):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
 
-        text = parts[2]
-        try:
-            await bot.send_message(user_id, text)
-            await m.answer("✅ Сообщение отправлено.")
-        except Exception as e:
-            await send_err(m, "send_message", e)
+        name = command.command.lower()
+        kind, label, method, done = ADMIN_MEDIA[name]
+        token, ref = parse_recipients(m.text or "")
+        if token is None:
+            return await m.answer(
+                f"Формат: /{name} получатели file_id|алиас | reply /{name} получатели | /{name} получатели (LAST {label})\n"
+                f"{RECIPIENTS_HELP}",
+                parse_mode=None,
+            )
+        user_ids = await resolve_recipients(token)
+        if user_ids is None:
+            return await m.answer(f"Не понял получателей: {token}\n{RECIPIENTS_HELP}", parse_mode=None)
+        if not user_ids:
+            return await m.answer("В сегменте нет получателей.")
+        if len(user_ids) > BATCH_MAX:
+            return await m.answer(f"Больше {BATCH_MAX} получателей — используй /broadcast.")
+
+        reply = message_media(m.reply_to_message) if m.reply_to_message else None
+        if ref:
+            fid = media.resolve(ref, kind)
+            if fid is None:
+                return await m.answer(f"{ref} в каталоге — не {label}.", parse_mode=None)
+            source, where = "", method
+        elif reply is not None and reply.kind == kind:
+            fid, source, where = reply.file_id, " (reply)", f"{method}(reply)"
+        else:
+            last = media.last(kind)
+            if last is None:
+                return await m.answer(f"Нет LAST {label}.")
+            fid, source, where = last.file_id, " (LAST)", f"{method}(LAST)"
+
+        await admin_deliver(m, user_ids, kind, {"file_id": fid}, f"{done}{source}.", where)
+
+    # ========================= ADMIN: BROADCAST =========================
+
+    BROADCAST_HELP = (
+        "Формат:\n"
+        "/broadcast [сегмент] текст\n"
+        "/broadcast [сегмент] video|photo|doc [подпись] — LAST VIDEO/PHOTO/DOC\n\n"
+        "Сегменты (по умолчанию all):\n"
+        + "\n".join(f"• {name} — {title}" for name, title in SEGMENT_TITLES.items())
+        + "\n\n/broadcast_status — прогресс, /broadcast_stop id — остановить"
+    )
 
-    @dp.message(Command("photo"))
-    async def admin_photo(m: Message):
+    @dp.message(Command("broadcast"))
+    async def admin_broadcast(m: Message):
         if m.from_user.id != ADMIN_ID:
             return await m.answer("⛔ Нет доступа.")
 
-        user_id, file_id = parse_user_and_file(m.text or "")
-        if user_id is None:
-            return await m.answer("Формат: /photo user_id file_id | reply /photo user_id | /photo user_id (LAST PHOTO)")
-
-        if file_id:
-            try:
-                await bot.send_photo(chat_id=user_id, photo=file_id)
-                return await m.answer("🖼 Фото отправлено.")
-            except Exception as e:
-                return await send_err(m, "send_photo", e)
+        parts = (m.text or "").split(maxsplit=1)
+        rest = norm_text(parts[1]) if len(parts) > 1 else ""
+
+        segment = "all"
+        head, _, tail = rest.partition(" ")
+        if head in db.SEGMENTS:
+            segment, rest = head, tail.strip()
+
+        head, _, tail = rest.partition(" ")
+        media_key = {"video": "video", "photo": "photo", "doc": "document"}.get(head)
+        if media_key:
+            last = media.last(media_key)
+            if last is None:
+                return await m.answer(f"Нет LAST {head.upper()}.")
+            kind, payload = media_key, {"file_id": last.file_id, "caption": tail.strip() or None}
+        elif rest:
+            kind, payload = "text", {"text": rest}
+        else:
+            return await m.answer(BROADCAST_HELP, parse_mode=None)
 
-        if m.reply_to_message and m.reply_to_message.photo:
-            fid = m.reply_to_message.photo[-1].file_id
-            try:
-                await bot.send_photo(chat_id=user_id, photo=fid)
-                return await m.answer("🖼 Фото отправлено (reply).")
-            except Exception as e:
-                return await send_err(m, "send_photo(reply)", e)
+        broadcast_id, total = await broadcaster.create(kind, payload, segment)
+        await m.answer(
+            f"📣 Рассылка #{broadcast_id} запущена\n"
+            f"Сегмент: {segment} ({SEGMENT_TITLES.get(segment, '')})\n"
+            f"Получателей: {total}",
+            parse_mode=None,
+        )
 
-        fid = last_media.get("photo")
-        if not fid:
-            return await m.answer("Нет LAST PHOTO.")
-        try:
-            await bot.send_photo(chat_id=user_id, photo=fid)
-            return await m.answer("🖼 Фото отправлено (LAST).")
-        except Exception as e:
-            return await send_err(m, "send_photo(LAST)", e)
+    @dp.message(Command("broadcast_status"))
+    async def admin_broadcast_status(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
 
-    @dp.message(Command("video"))
-    async def admin_video(m: Message):
+        rows = await adb.broadcasts_recent(5)
+        if not rows:
+            return await m.answer("Рассылок ещё не было.")
+        lines = [
+            f"#{b['id']} [{b['status']}] {b['segment']}: "
+            f"{b['sent'] + b['blocked'] + b['failed']}/{b['total']} "
+            f"(✅{b['sent']} ⛔{b['blocked']} ❌{b['failed']})"
+            for b in rows
+        ]
+        await m.answer("\n".join(lines), parse_mode=None)
+
+    FUNNEL_TITLES = {
+        "start": "/start",
+        "free_begin": "Начали free тест",
+        "niche": "Выбрали нишу",
+        "material_1": "Материал, день 1",
+        "material_2": "Материал, день 2",
+        "material_3": "Материал, день 3",
+        "stats": "Прислали статистику",
+        "test_done": "Завершили тест",
+        "premium": "Premium: заявка",
+        "lux": "Lux: заявка",
+    }
+
+    @dp.message(Command("funnel"))
+    async def admin_funnel(m: Message):
         if m.from_user.id != ADMIN_ID:
             return await m.answer("⛔ Нет доступа.")
 
-        user_id, file_id = parse_user_and_file(m.text or "")
-        if user_id is None:
-            return await m.answer("Формат: /video user_id file_id | reply /video user_id | /video user_id (LAST VIDEO)")
+        window = parse_window(norm_text(m.text or "").split()[1:])
+        if window is None:
+            return await m.answer(
+                "Формат: /funnel [7|30|today|all|YYYY-MM-DD [YYYY-MM-DD]]\n"
+                "По умолчанию — последние 7 дней.",
+                parse_mode=None,
+            )
+        since, until, title = window
+
+        counts = await adb.funnel_counts(since, until)
+        first = counts["start"]
+        lines = [f"📈 Воронка: {title}", "(пользователи, впервые дошедшие до шага за период)", ""]
+        prev = None
+        for step in db.FUNNEL_STEPS:
+            n = counts[step]
+            line = f"{FUNNEL_TITLES[step]}: {n}"
+            if prev is not None:
+                conv = [f"{n * 100 / prev:.0f}% от пред." if prev else "—"]
+                if first:
+                    conv.append(f"{n * 100 / first:.0f}% от старта")
+                line += f" ({', '.join(conv)})"
+            lines.append(line)
+            # заявки Premium и Lux — параллельные ветки после теста
+            if step != "premium":
+                prev = n
+        await m.answer("\n".join(lines), parse_mode=None)
+
+    EXPORT_HELP = (
+        "Формат: /export таблица [csv|jsonl] [from=YYYY-MM-DD] [to=YYYY-MM-DD] [niche=Ниша]\n"
+        f"Таблицы: {', '.join(db.EXPORTS)}\n"
+        "По умолчанию csv, без фильтров. Файл сжат gzip."
+    )
 
-        if file_id:
-            try:
-                await bot.send_video(chat_id=user_id, video=file_id)
-                return await m.answer("🎬 Видео отправлено.")
-            except Exception as e:
-                return await send_err(m, "send_video", e)
+    @dp.message(Command("export"))
+    async def admin_export(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
 
-        if m.reply_to_message and m.reply_to_message.video:
-            fid = m.reply_to_message.video.file_id
-            try:
-                await bot.send_video(chat_id=user_id, video=fid)
-                return await m.answer("🎬 Видео отправлено (reply).")
-            except Exception as e:
-                return await send_err(m, "send_video(reply)", e)
+        args = norm_text(m.text or "").split()[1:]
+        if not args or args[0] not in db.EXPORTS:
+            return await m.answer(EXPORT_HELP, parse_mode=None)
+
+        table, fmt, filters = args[0], "csv", {}
+        for arg in args[1:]:
+            key, sep, value = arg.partition("=")
+            if not sep and arg in EXPORT_FORMATS:
+                fmt = arg
+            elif key in ("from", "to") and value:
+                try:
+                    filters[key] = date.fromisoformat(value).isoformat()
+                except ValueError:
+                    return await m.answer(f"Неверная дата: {value}", parse_mode=None)
+            elif key == "niche" and value:
+                filters[key] = value
+            else:
+                return await m.answer(EXPORT_HELP, parse_mode=None)
+
+        await m.answer("⏳ Готовлю выгрузку…", parse_mode=None)
+        started = time.perf_counter()
+        try:
+            path, count = await export_to_file(
+                table, fmt, since=filters.get("from"), until=filters.get("to"), niche=filters.get("niche"),
+            )
+        except Exception as e:
+            logging.exception(f"Export {table} failed: {e}")
+            return await send_err(m, "Ошибка выгрузки", e)
 
-        fid = last_media.get("video")
-        if not fid:
-            return await m.answer("Нет LAST VIDEO.")
         try:
-            await bot.send_video(chat_id=user_id, video=fid)
-            return await m.answer("🎬 Видео отправлено (LAST).")
+            size = os.path.getsize(path)
+            if size > MAX_DOCUMENT_BYTES:
+                return await m.answer(
+                    f"Файл {size // (1024 * 1024)} МБ больше лимита Telegram — сузь фильтры (from/to/niche).",
+                    parse_mode=None,
+                )
+            suffix = "_".join(f"{k}-{v}" for k, v in filters.items())
+            filename = f"{table}{'_' + suffix if suffix else ''}.{fmt}.gz"
+            await m.answer_document(
+                FSInputFile(path, filename=filename),
+                caption=f"📦 {table}: {count} строк, {time.perf_counter() - started:.1f} с",
+                parse_mode=None,
+            )
         except Exception as e:
-            return await send_err(m, "send_video(LAST)", e)
+            await send_err(m, "Ошибка отправки выгрузки", e)
+        finally:
+            os.remove(path)
 
-    @dp.message(Command("doc"))
-    async def admin_doc(m: Message):
+    @dp.message(Command("metrics"))
+    async def admin_metrics(m: Message):
         if m.from_user.id != ADMIN_ID:
             return await m.answer("⛔ Нет доступа.")
+        await m.answer(truncate(metrics.summary()), parse_mode=None)
 
-        user_id, file_id = parse_user_and_file(m.text or "")
-        if user_id is None:
-            return await m.answer("Формат: /doc user_id file_id | reply /doc user_id | /doc user_id (LAST DOC)")
-
-        if file_id:
-            try:
-                await bot.send_document(chat_id=user_id, document=file_id)
-                return await m.answer("📄 Файл отправлен.")
-            except Exception as e:
-                return await send_err(m, "send_document", e)
-
-        if m.reply_to_message and m.reply_to_message.document:
-            fid = m.reply_to_message.document.file_id
-            try:
-                await bot.send_document(chat_id=user_id, document=fid)
-                return await m.answer("📄 Файл отправлен (reply).")
-            except Exception as e:
-                return await send_err(m, "send_document(reply)", e)
+    @dp.message(Command("broadcast_stop"))
+    async def admin_broadcast_stop(m: Message):
+        if m.from_user.id != ADMIN_ID:
+            return await m.answer("⛔ Нет доступа.")
 
-        fid = last_media.get("document")
-        if not fid:
-            return await m.answer("Нет LAST DOC.")
-        try:
-            await bot.send_document(chat_id=user_id, document=fid)
-            return await m.answer("📄 Файл отправлен (LAST).")
-        except Exception as e:
-            return await send_err(m, "send_document(LAST)", e)
+        parts = (m.text or "").split()
+        if len(parts) < 2 or not is_int(parts[1]):
+            return await m.answer("Формат: /broadcast_stop id")
+        if await broadcaster.stop(int(parts[1])):
+            return await m.answer(f"⏹ Рассылка #{parts[1]} остановлена.")
+        return await m.answer("Такая рассылка сейчас не идёт.")
 
     # ========================= /start =========================
 
     @dp.message(CommandStart())
     async def start(m: Message, state: FSMContext):
         await state.clear()
-        db.upsert_user(m.from_user.id, m.from_user.username)
+        await adb.upsert_user(m.from_user.id, m.from_user.username)
         await m.answer(texts.START, reply_markup=kb.main_menu(cfg.manager_username))
 
     @dp.callback_query(F.data == "back:menu")
@@ -342,9 +870,11 @@ async def main():
 
     @dp.callback_query(F.data == "premium:buy")
     async def premium_buy(c: CallbackQuery):
-        db.set_subscription(c.from_user.id, plan="premium", status="pending")
+        await adb.set_subscription(c.from_user.id, plan="premium", status="pending")
+        # заявка должна быть на диске до того, как о ней узнает менеджер
+        await adb.barrier()
 
-        last = db.get_last_test_fields(c.from_user.id)
+        last = await adb.get_last_test_fields(c.from_user.id)
         await notify_admin(
             "🟦 Premium запрос\n"
             f"User: {safe_username(c.from_user.username)} | id={c.from_user.id}\n"
@@ -399,9 +929,10 @@ async def main():
         volume = data.get("volume")
 
         await state.clear()
-        db.set_subscription(m.from_user.id, plan="lux", status="pending")
+        await adb.set_subscription(m.from_user.id, plan="lux", status="pending")
+        await adb.barrier()
 
-        last = db.get_last_test_fields(m.from_user.id)
+        last = await adb.get_last_test_fields(m.from_user.id)
         await notify_admin(
             "👑 Lux запрос\n"
             f"User: {safe_username(m.from_user.username)} | id={m.from_user.id}\n"
@@ -425,7 +956,7 @@ async def main():
 
     @dp.callback_query(F.data == "free:begin")
     async def free_begin(c: CallbackQuery, state: FSMContext):
-        db.start_free_test(c.from_user.id)
+        await adb.start_free_test(c.from_user.id)
         await state.set_state(FreeTestFlow.niche)
         await c.message.answer("Выбери нишу:", reply_markup=kb.niche_kb())
         await c.answer()
@@ -433,7 +964,7 @@ async def main():
     @dp.callback_query(F.data.startswith("free:niche:"))
     async def free_niche(c: CallbackQuery, state: FSMContext):
         niche = c.data.split("free:niche:", 1)[1]
-        db.update_test_field(c.from_user.id, "niche", niche)
+        await adb.update_test_field(c.from_user.id, "niche", niche)
         await state.set_state(FreeTestFlow.tiktok_link)
         await c.message.answer("Ссылка на TikTok аккаунт (текстом):")
         await c.answer()
@@ -443,7 +974,7 @@ async def main():
         link = safe_text(m)
         if not link:
             return await m.answer("Пришли ссылку на TikTok *текстом* (не файлом/стикером/голосом).")
-        db.update_test_field(m.from_user.id, "tiktok_link", link)
+        await adb.update_test_field(m.from_user.id, "tiktok_link", link)
         await state.set_state(FreeTestFlow.goal)
         await m.answer(
             "Цель теста:\n"
@@ -454,9 +985,9 @@ async def main():
     @dp.callback_query(F.data.startswith("free:goal:"))
     async def free_goal_btn(c: CallbackQuery, state: FSMContext):
         goal = c.data.split("free:goal:", 1)[1]
-        db.update_test_field(c.from_user.id, "goal", goal)
+        await adb.update_test_field(c.from_user.id, "goal", goal)
         await state.set_state(FreeTestFlow.material)
-        day = db.get_test_day(c.from_user.id)
+        day = await adb.get_test_day(c.from_user.id)
         await c.message.answer(material_request_text(day))
         await c.answer()
 
@@ -465,16 +996,31 @@ async def main():
         txt = safe_text(m)
         if not txt:
             return await m.answer("Напиши цель теста *текстом* одним сообщением.")
-        db.update_test_field(m.from_user.id, "goal", txt)
+        await adb.update_test_field(m.from_user.id, "goal", txt)
         await state.set_state(FreeTestFlow.material)
-        day = db.get_test_day(m.from_user.id)
+        day = await adb.get_test_day(m.from_user.id)
         await m.answer(material_request_text(day))
 
     # MATERIAL: собираем И видео, И описание (любой порядок), затем пересылаем админу
-    @dp.message(FreeTestFlow.material)
+    @dp.message(FreeTestFlow.material, flags={"throttle": "material"})
     async def free_material(m: Message, state: FSMContext):
         if m.video:
-            await state.update_data(material_video_id=m.video.file_id)
+            # тот же файл уже был исходником — не пересылаем админу второй раз
+            seen = await jobs.seen(m.video.file_unique_id, m.from_user.id)
+            if seen is not None:
+                material_duplicate.inc("own" if seen["own"] else "other")
+                if seen["own"]:
+                    return await m.answer(
+                        f"🔁 Это видео ты уже присылал (День {seen['day']}).\n"
+                        "Пришли *новый* исходник для этого дня."
+                    )
+                return await m.answer("🔁 Это видео уже присылали раньше.\nПришли *свой* исходник.")
+            await state.update_data(
+                material_video_id=m.video.file_id,
+                material_video_unique_id=m.video.file_unique_id,
+                material_video_size=m.video.file_size,
+                material_video_duration=m.video.duration,
+            )
         elif m.text and m.text.strip():
             await state.update_data(material_description=m.text.strip())
         else:
@@ -498,19 +1044,32 @@ async def main():
                 missing.append("📝 подробное описание текстом")
             return await m.answer("Осталось прислать: " + " + ".join(missing))
 
-        day = db.get_test_day(m.from_user.id)
+        day = await adb.get_test_day(m.from_user.id)
 
         # сохраняем в БД (как и раньше: video file_id в material_value)
-        db.update_test_field(m.from_user.id, "material_type", "video+description")
-        db.update_test_field(m.from_user.id, "material_value", vid)
-
-        # пересылаем админу видео + описание
+        await adb.update_test_fields(m.from_user.id, {
+            "material_type": "video+description",
+            "material_value": vid,
+        })
+
+        # задание в очередь и исходник админу: готовое видео он вернёт reply на «Задание #N».
+        # Без задания исходник всё равно уходит админу — как раньше, для /video вручную.
+        job_id = None
+        try:
+            job_id = await jobs.create(
+                m.from_user.id, day, vid, desc,
+                data.get("material_video_unique_id"),
+                data.get("material_video_size"),
+                data.get("material_video_duration"),
+            )
+        except Exception as e:
+            logging.exception(f"Job create failed: {e}")
         try:
-            await forward_free_material_to_admin(day, m.from_user.id, m.from_user.username, vid, desc)
+            await forward_free_material_to_admin(job_id, day, m.from_user.id, m.from_user.username, vid, desc)
         except Exception as e:
             logging.exception(f"Forward to admin failed: {e}")
 
-        last = db.get_last_test_fields(m.from_user.id)
+        last = await adb.get_last_test_fields(m.from_user.id)
         await notify_admin(
             f"📥 Free тест: День {day} — исходник + описание приняты\n"
             f"User: {safe_username(m.from_user.username)} | id={m.from_user.id}\n"
@@ -537,7 +1096,7 @@ async def main():
 
     @dp.callback_query(F.data == "free:posted")
     async def free_posted(c: CallbackQuery, state: FSMContext):
-        day = db.get_test_day(c.from_user.id)
+        day = await adb.get_test_day(c.from_user.id)
         await state.set_state(FreeTestFlow.day_publish_link)
         await c.message.answer(f"Ок. Пришли ссылку на опубликованное видео (День {day}) *текстом*.")
         await c.answer()
@@ -550,7 +1109,7 @@ async def main():
 
         await state.update_data(post_link=link)
 
-        day = db.get_test_day(m.from_user.id)
+        day = await adb.get_test_day(m.from_user.id)
         await notify_admin(
             "🔗 Free тест: ссылка на пост\n"
             f"User: {safe_username(m.from_user.username)} | id={m.from_user.id}\n"
@@ -564,52 +1123,60 @@ async def main():
     @dp.callback_query(F.data == "free:stats")
     async def free_stats_start(c: CallbackQuery, state: FSMContext):
         await state.set_state(FreeTestFlow.stats_views)
-        await c.message.answer("Просмотры (числом):")
+        await c.message.answer(
+            "Просмотры (числом):\n\n"
+            "⚡ Или всё сразу одним сообщением — просмотры, лайки, комментарии, подписки:\n"
+            "`12500 830 41 12`"
+        )
         await c.answer()
 
+    # быстрый путь: все четыре числа одним сообщением — одна запись в БД вместо пяти шагов
     @dp.message(FreeTestFlow.stats_views)
     async def free_stats_views(m: Message, state: FSMContext):
-        txt = safe_text(m)
-        if not txt or not is_int(txt):
-            return await m.answer("Введи число просмотров.")
-        await state.update_data(views=int(txt))
+        txt = safe_text(m) or ""
+        stats = parse_stats(txt)
+        if stats is not None:
+            return await save_stats(m, state, *stats)
+        views = parse_count(txt)
+        if views is None:
+            return await m.answer("Введи число просмотров или все четыре числа сразу: `12500 830 41 12`.")
+        await state.update_data(views=views)
         await state.set_state(FreeTestFlow.stats_likes)
         await m.answer("Лайки (числом):")
 
     @dp.message(FreeTestFlow.stats_likes)
     async def free_stats_likes(m: Message, state: FSMContext):
-        txt = safe_text(m)
-        if not txt or not is_int(txt):
+        likes = parse_count(safe_text(m) or "")
+        if likes is None:
             return await m.answer("Введи число лайков.")
-        await state.update_data(likes=int(txt))
+        await state.update_data(likes=likes)
         await state.set_state(FreeTestFlow.stats_comments)
         await m.answer("Комментарии (числом):")
 
     @dp.message(FreeTestFlow.stats_comments)
     async def free_stats_comments(m: Message, state: FSMContext):
-        txt = safe_text(m)
-        if not txt or not is_int(txt):
+        comments = parse_count(safe_text(m) or "")
+        if comments is None:
             return await m.answer("Введи число комментариев.")
-        await state.update_data(comments=int(txt))
+        await state.update_data(comments=comments)
         await state.set_state(FreeTestFlow.stats_follows)
         await m.answer("Подписки/переходы (если нет — 0):")
 
     @dp.message(FreeTestFlow.stats_follows)
     async def free_stats_follows(m: Message, state: FSMContext):
-        txt = safe_text(m)
-        if not txt or not is_int(txt):
+        follows = parse_count(safe_text(m) or "")
+        if follows is None:
             return await m.answer("Введи число (можно 0).")
 
         data = await state.get_data()
-        day = db.get_test_day(m.from_user.id)
+        await save_stats(m, state, data.get("views", 0), data.get("likes", 0), data.get("comments", 0), follows)
 
+    async def save_stats(m: Message, state: FSMContext, views: int, likes: int, comments: int, follows: int):
+        data = await state.get_data()
+        day = await adb.get_test_day(m.from_user.id)
         post_link = data.get("post_link", "—")
-        views = data.get("views", 0)
-        likes = data.get("likes", 0)
-        comments = data.get("comments", 0)
-        follows = int(txt)
 
-        db.add_stats(m.from_user.id, day, post_link, views, likes, comments, follows)
+        await adb.add_stats(m.from_user.id, day, post_link, views, likes, comments, follows)
 
         await notify_admin(
             "📊 Free тест: статистика\n"
@@ -623,7 +1190,7 @@ async def main():
         if day < 3:
             # Переходим на следующий день и снова просим ИСХОДНИК+ОПИСАНИЕ
             next_day = day + 1
-            db.set_test_day(m.from_user.id, next_day)
+            await adb.set_test_day(m.from_user.id, next_day)
 
             await state.clear()
             await state.set_state(FreeTestFlow.material)
@@ -634,13 +1201,19 @@ async def main():
             )
             await m.answer(material_request_text(next_day))
         else:
-            db.finish_test(m.from_user.id)
+            await adb.finish_test(m.from_user.id)
             await state.clear()
 
-            rows = db.get_stats_for_last_test(m.from_user.id)
-            report = make_test_report(rows)
+            rows = await adb.get_stats_for_last_test(m.from_user.id)
+            last = await adb.get_last_test_fields(m.from_user.id)
+
+            # сравниваем с уже завершёнными тестами, затем добавляем этот в распределение
+            stat_metrics = metrics_from_rows(rows)
+            standing = cohorts.rank(last.get("niche"), last.get("goal"), stat_metrics) if rows else None
+            report = make_test_report(rows, standing)
+            if rows:
+                cohorts.observe(last.get("niche"), last.get("goal"), stat_metrics)
 
-            last = db.get_last_test_fields(m.from_user.id)
             await notify_admin(
                 "🟩 Free тест завершён\n"
                 f"User: {safe_username(m.from_user.username)} | id={m.from_user.id}\n"
@@ -653,14 +1226,55 @@ async def main():
             await m.answer(report)
             await m.answer(texts.AFTER_TEST_SUMMARY, reply_markup=kb.after_test_kb(cfg.manager_username))
 
-    @dp.message(StateFilter("*"))
-    async def fsm_fallback(m: Message, state: FSMContext):
-        if await state.get_state() is None:
-            return
+    # только внутри сценария: вне состояния сообщение молча игнорируется и не тратит анти-флуд
+    @dp.message(~StateFilter(None), flags={"throttle": "fallback"})
+    async def fsm_fallback(m: Message):
         await m.answer("Я жду ответ по текущему шагу. Если нужно — нажми /start.")
 
-    await dp.start_polling(bot)
+    return dp
+
+
+async def main(args: argparse.Namespace):
+    logging.basicConfig(level=logging.INFO)
+
+    cfg = load_config()
+    mode = args.mode or cfg.bot_mode
+    workers = args.workers or cfg.workers
+    if workers > 1 and cfg.worker_id is None:
+        # супервизор: миграции один раз, дальше только раздача апдейтов воркерам
+        init_database()
+        bot = create_bot(cfg)
+        allowed_updates = build_dispatcher(cfg, bot).resolve_used_update_types()
+        try:
+            await run_supervisor(cfg, bot, mode, workers, allowed_updates)
+        finally:
+            await bot.session.close()
+        return
+
+    init_database()
+    adb.start(
+        readers=cfg.db_readers,
+        write_behind=cfg.db_write_behind,
+        flush_ms=cfg.db_flush_ms,
+        flush_ops=cfg.db_flush_ops,
+    )
+
+    bot = create_bot(cfg)
+    dp = build_dispatcher(cfg, bot)
+
+    try:
+        if mode == "webhook":
+            await run_webhook(dp, bot, cfg)
+        else:
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await adb.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.migrate_only:
+        logging.basicConfig(level=logging.INFO)
+        init_database()
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,243 @@
+"""
+Массовые рассылки админа.
+
+- получатели выбираются сегментом (db.SEGMENTS) прямо в SQL и сохраняются
+  в broadcast_recipients — в память целиком не грузятся;
+- отправка идёт пачками (keyset по user_id) с ограниченной конкурентностью;
+  лимиты Telegram соблюдает OutboundMiddleware (приоритет BULK — ответы
+  пользователям и уведомления админу идут первыми);
+- статусы получателей пишутся в БД одной записью на пачку, сразу после её
+  отправки, поэтому упавшая/перезапущенная рассылка продолжается с места
+  остановки (повторно уйдёт только пачка, которая была в полёте).
+
+send_batch — адресная отправка списку получателей (/say, /video, /photo,
+/doc): тот же конвейер, но без записи в БД, с одним итоговым отчётом.
+Broadcaster.batch гоняет её фоновой задачей: хендлер админа не ждёт пачку.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+import db
+import db_async as adb
+from outbox import PRIORITY_ADMIN, PRIORITY_BULK, outbound_priority
+
+SEGMENT_TITLES = {
+    "all": "все пользователи",
+    "finished_no_sub": "прошли тест, без подписки",
+    "in_test": "сейчас в тесте",
+    "no_test": "не начинали тест",
+    "pending": "заявка Premium/Lux в ожидании",
+}
+
+# kind рассылки -> (метод Bot, имя параметра с file_id)
+MEDIA_KINDS = {
+    "video": ("send_video", "video"),
+    "photo": ("send_photo", "photo"),
+    "document": ("send_document", "document"),
+}
+
+
+async def send_payload(bot: Bot, user_id: int, kind: str, payload: Dict) -> None:
+    if kind == "text":
+        await bot.send_message(user_id, payload["text"])
+        return
+    method, param = MEDIA_KINDS[kind]
+    await getattr(bot, method)(user_id, **{param: payload["file_id"]}, caption=payload.get("caption"))
+
+
+def classify_error(e: Exception) -> Tuple[int, str]:
+    if isinstance(e, TelegramForbiddenError):
+        return db.RECIPIENT_BLOCKED, str(e)[:200]
+    return db.RECIPIENT_FAILED, f"{type(e).__name__}: {e}"[:200]
+
+
+async def send_batch(
+    bot: Bot, user_ids: List[int], kind: str, payload: Dict, concurrency: int = 20,
+) -> List[Tuple[int, int, Optional[str]]]:
+    """
+    Отправляет всем user_ids параллельно (не больше concurrency сразу, лимиты —
+    OutboundMiddleware, приоритет ADMIN). (user_id, статус, ошибка) в порядке user_ids.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def send_one(user_id: int) -> Tuple[int, int, Optional[str]]:
+        async with sem:
+            try:
+                await send_payload(bot, user_id, kind, payload)
+                return user_id, db.RECIPIENT_SENT, None
+            except Exception as e:
+                return (user_id, *classify_error(e))
+
+    token = outbound_priority.set(PRIORITY_ADMIN)
+    try:
+        return list(await asyncio.gather(*(send_one(uid) for uid in user_ids)))
+    finally:
+        outbound_priority.reset(token)
+
+
+def batch_report(title: str, results: List[Tuple[int, int, Optional[str]]], limit: int = 20) -> str:
+    """Один ответ админу на всю пачку: итоги и кто не получил."""
+    blocked = [uid for uid, status, _ in results if status == db.RECIPIENT_BLOCKED]
+    failed = [(uid, error) for uid, status, error in results if status == db.RECIPIENT_FAILED]
+    sent = len(results) - len(blocked) - len(failed)
+    lines = [
+        f"{title}: {len(results)} получателей",
+        f"✅ Доставлено: {sent}",
+        f"⛔ Заблокировали бота: {len(blocked)}",
+        f"❌ Ошибки: {len(failed)}",
+    ]
+    if blocked:
+        shown = ", ".join(str(uid) for uid in blocked[:limit])
+        lines += ["", f"⛔ {shown}" + (f" и ещё {len(blocked) - limit}" if len(blocked) > limit else "")]
+    if failed:
+        lines.append("")
+        lines += [f"❌ {uid}: {error}" for uid, error in failed[:limit]]
+        if len(failed) > limit:
+            lines.append(f"… и ещё {len(failed) - limit}")
+    return "\n".join(lines)
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot: Bot,
+        on_report: Callable[[str], Awaitable[None]],
+        concurrency: int = 20,
+        chunk_size: int = 200,
+        owner: int = 0,
+        owners: int = 1,
+    ) -> None:
+        self.bot = bot
+        # рассылку продолжает после рестарта только воркер, который её запустил
+        self.owner = owner
+        self.owners = owners
+        self.on_report = on_report
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = max(1, chunk_size)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._batches: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """Продолжает рассылки, прерванные рестартом (dp.startup)."""
+        for b in await adb.broadcasts_by_status("running", self.owner, self.owners):
+            logging.info(f"Broadcast #{b['id']}: resuming")
+            self.launch(b["id"])
+
+    async def close(self) -> None:
+        """
+        Останавливает задачи; статус рассылок остаётся running — продолжим при
+        следующем старте. Адресные пачки не сохраняются: их отчёт не придёт.
+        """
+        tasks = list(self._tasks.values()) + list(self._batches)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._batches.clear()
+
+    async def create(self, kind: str, payload: Dict, segment: str) -> Tuple[int, int]:
+        broadcast_id, total = await adb.broadcast_create(
+            kind, json.dumps(payload, ensure_ascii=False), segment, self.owner,
+        )
+        self.launch(broadcast_id)
+        return broadcast_id, total
+
+    def launch(self, broadcast_id: int) -> None:
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def stop(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await adb.broadcast_finish(broadcast_id, "cancelled")
+        return True
+
+    def running(self) -> int:
+        return len(self._tasks)
+
+    def batch(self, user_ids: List[int], kind: str, payload: Dict, title: str) -> None:
+        """Адресная отправка в фоне; итог (batch_report) придёт через on_report."""
+        task = asyncio.create_task(self._run_batch(user_ids, kind, payload, title))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    def batches(self) -> int:
+        return len(self._batches)
+
+    async def _run_batch(self, user_ids: List[int], kind: str, payload: Dict, title: str) -> None:
+        try:
+            results = await send_batch(self.bot, user_ids, kind, payload, self.concurrency)
+        except Exception as e:
+            logging.exception(f"Batch '{title}' failed: {e}")
+            await self.on_report(f"❌ {title}: {type(e).__name__}: {e}")
+            return
+        await self.on_report(batch_report(title, results))
+
+    async def _send_one(
+        self, sem: asyncio.Semaphore, user_id: int, kind: str, payload: Dict,
+    ) -> Tuple[int, int, Optional[str]]:
+        async with sem:
+            try:
+                await send_payload(self.bot, user_id, kind, payload)
+                return user_id, db.RECIPIENT_SENT, None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return (user_id, *classify_error(e))
+
+    async def _run(self, broadcast_id: int) -> None:
+        outbound_priority.set(PRIORITY_BULK)
+        try:
+            await self._process(broadcast_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(f"Broadcast #{broadcast_id} crashed: {e}")
+            await self.on_report(f"❌ Рассылка #{broadcast_id} упала: {type(e).__name__}: {e}")
+
+    async def _process(self, broadcast_id: int) -> None:
+        b = await adb.broadcast_get(broadcast_id)
+        if b is None:
+            return
+        kind, payload = b["kind"], json.loads(b["payload"])
+        sem = asyncio.Semaphore(self.concurrency)
+
+        started = time.monotonic()
+        processed = 0
+        after = 0
+        while True:
+            chunk = await adb.broadcast_pending_chunk(broadcast_id, after, self.chunk_size)
+            if not chunk:
+                break
+            results = await asyncio.gather(*(self._send_one(sem, uid, kind, payload) for uid in chunk))
+            # один COMMIT на пачку, а не на сообщение: писатель не стоит на пути отправки
+            await adb.broadcast_record(broadcast_id, list(results))
+            processed += len(chunk)
+            after = chunk[-1]
+
+        await adb.broadcast_finish(broadcast_id, "done")
+        await adb.barrier()
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        b = await adb.broadcast_get(broadcast_id) or b
+        await self.on_report(
+            f"📣 Рассылка #{broadcast_id} завершена\n"
+            f"Сегмент: {b['segment']}\n"
+            f"Всего: {b['total']}\n"
+            f"✅ Доставлено: {b['sent']}\n"
+            f"⛔ Заблокировали бота: {b['blocked']}\n"
+            f"❌ Ошибки: {b['failed']}\n"
+            f"⏱ {elapsed:.1f} с, {processed / elapsed:.1f} msg/s (в этом запуске: {processed})"
+        )
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,35 @@ class Config:
     bot_token: str
     admin_chat_id: int
     manager_username: str
+    db_readers: int = 4
+    db_write_behind: bool = False
+    db_flush_ms: int = 50
+    db_flush_ops: int = 100
+    fsm_cache_size: int = 10000
+    fsm_cache_ttl: int = 1800
+    fsm_session_ttl: int = 7 * 24 * 3600
+    bot_mode: str = "polling"
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_secret: str = ""
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    out_global_rate: float = 30
+    out_chat_rate: float = 1
+    out_chat_burst: float = 3
+    out_max_retries: int = 5
+    broadcast_concurrency: int = 20
+    broadcast_chunk: int = 200
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108
+    api_base_url: str = ""
+    workers: int = 1
+    worker_id: Optional[int] = None
+    worker_base_port: int = 8100
+    lane_max_pending: int = 20
+    dedup_size: int = 10000
+    throttle: str = "default=2:20,material=1:10,fallback=0.2:3"
+    throttle_max_buckets: int = 100000
 
 def load_config() -> Config:
     token = os.getenv("BOT_TOKEN", "").strip()
@@ -23,8 +53,98 @@ def load_config() -> Config:
     if not manager_username:
         raise RuntimeError("MANAGER_USERNAME is empty. Set your Telegram username")
 
+    # Сколько read-only соединений держит пул читателей db_async
+    db_readers = int(os.getenv("DB_READERS", "4"))
+
+    # Write-behind: записи сбрасываются одной транзакцией раз в N мс / N операций
+    db_write_behind = os.getenv("DB_WRITE_BEHIND", "0").strip().lower() in {"1", "true", "yes", "on"}
+    db_flush_ms = int(os.getenv("DB_FLUSH_MS", "50"))
+    db_flush_ops = int(os.getenv("DB_FLUSH_OPS", "100"))
+
+    # FSM: горячие сессии в памяти (LRU + TTL), брошенные удаляются из БД через FSM_SESSION_TTL секунд
+    fsm_cache_size = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+    fsm_cache_ttl = int(os.getenv("FSM_CACHE_TTL", "1800"))
+    fsm_session_ttl = int(os.getenv("FSM_SESSION_TTL", str(7 * 24 * 3600)))
+
+    # Режим получения апдейтов: polling (по умолчанию) или webhook
+    bot_mode = os.getenv("BOT_MODE", "polling").strip().lower()
+    if bot_mode not in {"polling", "webhook"}:
+        raise RuntimeError("BOT_MODE must be 'polling' or 'webhook'")
+
+    # WEBHOOK_URL — публичный https-адрес (без пути). Пусто = не регистрировать вебхук
+    # в Telegram (локальная проверка: POST апдейтов прямо на сервер).
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+    webhook_path = "/" + os.getenv("WEBHOOK_PATH", "/webhook").strip().lstrip("/")
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "").strip()
+    webhook_host = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()
+    webhook_port = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+
+    # Исходящие: лимиты Telegram (сообщений/сек) и число ретраев на 429/5xx
+    out_global_rate = float(os.getenv("OUT_GLOBAL_RATE", "30"))
+    out_chat_rate = float(os.getenv("OUT_CHAT_RATE", "1"))
+    out_chat_burst = float(os.getenv("OUT_CHAT_BURST", "3"))
+    out_max_retries = int(os.getenv("OUT_MAX_RETRIES", "5"))
+
+    # Рассылки: сколько отправок одновременно и размер пачки получателей из БД
+    broadcast_concurrency = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+    broadcast_chunk = int(os.getenv("BROADCAST_CHUNK", "200"))
+
+    # Метрики Prometheus: METRICS_HOST:METRICS_PORT/metrics, порт 0 — не поднимать сервер
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+    metrics_port = int(os.getenv("METRICS_PORT", "9108"))
+
+    # Адрес Bot API: пусто — api.telegram.org; для нагрузочных тестов — fakeapi.py
+    api_base_url = os.getenv("TELEGRAM_API_URL", "").strip().rstrip("/")
+
+    # Несколько процессов: WORKERS>1 — этот процесс становится супервизором и
+    # запускает воркеров; у воркеров WORKER_ID задан (0..WORKERS-1), у одиночного бота — нет
+    workers = max(1, int(os.getenv("WORKERS", "1")))
+    worker_id_env = os.getenv("WORKER_ID", "").strip()
+    worker_id = int(worker_id_env) if worker_id_env else None
+    worker_base_port = int(os.getenv("WORKER_BASE_PORT", "8100"))
+
+    # Апдейты одного пользователя обрабатываются по очереди; сколько их может
+    # ждать в очереди пользователя, лишние отбрасываются. 0 — без очередей
+    lane_max_pending = int(os.getenv("LANE_MAX_PENDING", "20"))
+
+    # Сколько последних update_id помнить для отсева повторной доставки
+    dedup_size = int(os.getenv("DEDUP_SIZE", "10000"))
+
+    # Анти-флуд: группа=токенов в секунду:ёмкость через запятую, off — выключить
+    throttle = os.getenv("THROTTLE", "default=2:20,material=1:10,fallback=0.2:3").strip()
+    throttle_max_buckets = int(os.getenv("THROTTLE_MAX_BUCKETS", "100000"))
+
     return Config(
         bot_token=token,
         admin_chat_id=admin_chat_id,
-        manager_username=manager_username
+        manager_username=manager_username,
+        db_readers=db_readers,
+        db_write_behind=db_write_behind,
+        db_flush_ms=db_flush_ms,
+        db_flush_ops=db_flush_ops,
+        fsm_cache_size=fsm_cache_size,
+        fsm_cache_ttl=fsm_cache_ttl,
+        fsm_session_ttl=fsm_session_ttl,
+        bot_mode=bot_mode,
+        webhook_url=webhook_url,
+        webhook_path=webhook_path,
+        webhook_secret=webhook_secret,
+        webhook_host=webhook_host,
+        webhook_port=webhook_port,
+        out_global_rate=out_global_rate,
+        out_chat_rate=out_chat_rate,
+        out_chat_burst=out_chat_burst,
+        out_max_retries=out_max_retries,
+        broadcast_concurrency=broadcast_concurrency,
+        broadcast_chunk=broadcast_chunk,
+        metrics_host=metrics_host,
+        metrics_port=metrics_port,
+        api_base_url=api_base_url,
+        workers=workers,
+        worker_id=worker_id,
+        worker_base_port=worker_base_port,
+        lane_max_pending=lane_max_pending,
+        dedup_size=dedup_size,
+        throttle=throttle,
+        throttle_max_buckets=throttle_max_buckets,
     )
@@ -1,11 +1,16 @@
 import os
 import sqlite3
-from typing import Optional, Any, List, Tuple
+import threading
+from collections import OrderedDict
+from typing import Optional, Any, Callable, Iterator, List, Tuple
 
 # Must-have: persistent DB path for Railway Volume
 DEFAULT_DB_PATH = os.getenv("DB_PATH", "/data/neurolux.db")
 FALLBACK_DB_PATH = "neurolux.db"
 
+# Сколько ждать чужую блокировку записи (несколько процессов-воркеров на одной БД)
+BUSY_TIMEOUT_S = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")) / 1000
+
 # Разрешенные поля для безопасного update_test_field
 # ✅ ДОБАВЛЕНО: material_video_id, material_description
 ALLOWED_TEST_FIELDS = {
@@ -20,7 +25,70 @@ ALLOWED_TEST_FIELDS = {
     "is_done",
 }
 
+# -------------------- hot queries --------------------
+# Все горячие запросы собраны здесь: их же прогоняет check_query_plans().
+
+_SQL_LAST_TEST = """
+    SELECT id, day, is_done, niche, tiktok_link, goal,
+           material_type, material_value, material_video_id, material_description
+    FROM free_tests
+    WHERE user_id=?
+    ORDER BY id DESC
+    LIMIT 1
+"""
+
+_SQL_CLOSE_ACTIVE_TESTS = "UPDATE free_tests SET is_done=1 WHERE user_id=? AND is_done=0"
+
+# (test_id, day) уникален: повтор того же апдейта не добавит вторую строку
+_SQL_INSERT_STATS = """
+    INSERT OR IGNORE INTO stats(user_id, test_id, day, post_link, views, likes, comments, follows)
+    VALUES (?,?,?,?,?,?,?,?)
+"""
+
+# последний тест пользователя ищется прямо в INSERT — один индексный statement
+_SQL_INSERT_STATS_LAST_TEST = """
+    INSERT OR IGNORE INTO stats(user_id, test_id, day, post_link, views, likes, comments, follows)
+    VALUES (?, (SELECT id FROM free_tests WHERE user_id=? ORDER BY id DESC LIMIT 1), ?,?,?,?,?,?)
+"""
+
+_SQL_STATS_FOR_LAST_TEST = """
+    SELECT day, post_link, views, likes, comments, follows
+    FROM stats
+    WHERE user_id=?
+      AND test_id=(SELECT id FROM free_tests WHERE user_id=? ORDER BY id DESC LIMIT 1)
+    ORDER BY day ASC
+"""
+
+# исходник free-теста уже присылали: этот же пользователь / кто угодно
+_SQL_SOURCE_SEEN_BY_USER = """
+    SELECT id, user_id, day FROM jobs WHERE source_unique_id=? AND user_id=? LIMIT 1
+"""
+_SQL_SOURCE_SEEN = "SELECT id, user_id, day FROM jobs WHERE source_unique_id=? LIMIT 1"
+
+# воронка: первое достижение шага пользователем (+1 к счётчику дня)
+_SQL_FUNNEL_SEEN = "INSERT OR IGNORE INTO funnel_seen(user_id, step) VALUES (?,?)"
+_SQL_FUNNEL_BUMP = """
+    INSERT INTO funnel_daily(day, step, users) VALUES (date('now'), ?, 1)
+    ON CONFLICT(day, step) DO UPDATE SET users = users + 1
+"""
+
+HOT_QUERIES = {
+    "last_test": (_SQL_LAST_TEST, (0,)),
+    "close_active_tests": (_SQL_CLOSE_ACTIVE_TESTS, (0,)),
+    "insert_stats_last_test": (_SQL_INSERT_STATS_LAST_TEST, (0, 0, 1, "", 0, 0, 0, 0)),
+    "stats_for_last_test": (_SQL_STATS_FOR_LAST_TEST, (0, 0)),
+    "source_seen_by_user": (_SQL_SOURCE_SEEN_BY_USER, ("", 0)),
+    "source_seen": (_SQL_SOURCE_SEEN, ("",)),
+}
+
 _conn: Optional[sqlite3.Connection] = None
+_db_path: Optional[str] = None
+
+# Поточно-локальное соединение: читающие потоки db_async подменяют им общее _conn
+_local = threading.local()
+
+# sqlite3 trace callback для всех соединений модуля (bench: счёт SQL-операторов)
+_trace: Optional[Callable[[str], None]] = None
 
 
 def _ensure_dir_for(path: str) -> None:
@@ -31,17 +99,24 @@ def _ensure_dir_for(path: str) -> None:
 
 
 def connect() -> sqlite3.Connection:
-    global _conn
+    global _conn, _db_path
+    local_conn = getattr(_local, "conn", None)
+    if local_conn is not None:
+        return local_conn
+
     if _conn is not None:
         return _conn
 
     try:
         _ensure_dir_for(DEFAULT_DB_PATH)
-        _conn = sqlite3.connect(DEFAULT_DB_PATH, check_same_thread=False)
+        _conn = sqlite3.connect(DEFAULT_DB_PATH, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+        _db_path = DEFAULT_DB_PATH
     except Exception:
-        _conn = sqlite3.connect(FALLBACK_DB_PATH, check_same_thread=False)
+        _conn = sqlite3.connect(FALLBACK_DB_PATH, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+        _db_path = FALLBACK_DB_PATH
 
     _conn.row_factory = sqlite3.Row
+    _conn.set_trace_callback(_trace)
 
     try:
         _conn.execute("PRAGMA journal_mode=WAL;")
@@ -52,40 +127,68 @@ def connect() -> sqlite3.Connection:
     return _conn
 
 
-def _column_exists(con: sqlite3.Connection, table: str, column: str) -> bool:
-    rows = con.execute(f"PRAGMA table_info({table})").fetchall()
-    return any(r["name"] == column for r in rows)
-
-
-def _ensure_free_tests_columns(con: sqlite3.Connection) -> None:
+def connect_readonly() -> sqlite3.Connection:
     """
-    ✅ Мягкая миграция: добавляет недостающие колонки в free_tests,
-    чтобы не ломать уже существующую БД.
+    Отдельное read-only соединение для пула читателей.
+    В WAL-режиме читатели не блокируют писателя и друг друга.
     """
+    connect()
+    path = os.path.abspath(_db_path or FALLBACK_DB_PATH)
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+    con.set_trace_callback(_trace)
     try:
-        if not _column_exists(con, "free_tests", "material_video_id"):
-            con.execute("ALTER TABLE free_tests ADD COLUMN material_video_id TEXT;")
-        if not _column_exists(con, "free_tests", "material_description"):
-            con.execute("ALTER TABLE free_tests ADD COLUMN material_description TEXT;")
-        con.commit()
+        con.execute("PRAGMA query_only=ON;")
     except Exception:
-        # если таблицы ещё нет или ALTER не прошёл — просто пропускаем
         pass
+    return con
 
 
-def init_db() -> None:
-    con = connect()
-    cur = con.cursor()
+def set_trace(callback: Optional[Callable[[str], None]]) -> None:
+    """Вызывать callback(sql) на каждый оператор: общее соединение и все, открытые позже."""
+    global _trace
+    _trace = callback
+    if _conn is not None:
+        _conn.set_trace_callback(callback)
+
 
-    cur.execute("""
+def bind_thread_connection(con: Optional[sqlite3.Connection]) -> None:
+    """Все функции модуля в текущем потоке будут работать через con."""
+    _local.conn = con
+
+
+def set_batch_mode(enabled: bool) -> None:
+    """
+    Group-commit: в batch-режиме функции записи не коммитят сами,
+    транзакцию закрывает вызывающий (поток-писатель db_async).
+    """
+    _local.batch = enabled
+
+
+def _commit(con: sqlite3.Connection) -> None:
+    if getattr(_local, "batch", False):
+        return
+    con.commit()
+
+
+def _column_exists(con: sqlite3.Connection, table: str, column: str) -> bool:
+    rows = con.execute(f"PRAGMA table_info({table})").fetchall()
+    return any(r["name"] == column for r in rows)
+
+
+# -------------------- migrations --------------------
+# Версия схемы хранится в PRAGMA user_version: N = сколько шагов MIGRATIONS применено.
+# Новые шаги — только дописывать в конец, уже выпущенные не менять.
+
+def _m001_base_schema(con: sqlite3.Connection) -> None:
+    con.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY,
         username TEXT,
         created_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
 
-    # ✅ ДОБАВЛЕНО в схему: material_video_id, material_description
-    cur.execute("""
+    con.execute("""
     CREATE TABLE IF NOT EXISTS free_tests (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER,
@@ -101,7 +204,7 @@ def init_db() -> None:
         created_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
 
-    cur.execute("""
+    con.execute("""
     CREATE TABLE IF NOT EXISTS stats (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER,
@@ -115,7 +218,7 @@ def init_db() -> None:
         created_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
 
-    cur.execute("""
+    con.execute("""
     CREATE TABLE IF NOT EXISTS subscriptions (
         user_id INTEGER PRIMARY KEY,
         plan TEXT,
@@ -123,10 +226,451 @@ def init_db() -> None:
         updated_at TEXT DEFAULT CURRENT_TIMESTAMP
     )""")
 
-    con.commit()
 
-    # ✅ Миграция для старых БД
-    _ensure_free_tests_columns(con)
+def _m002_free_tests_material_columns(con: sqlite3.Connection) -> None:
+    """Старые БД (до user_version) создавались без material_video_id / material_description."""
+    for column in ("material_video_id", "material_description"):
+        if not _column_exists(con, "free_tests", column):
+            con.execute(f"ALTER TABLE free_tests ADD COLUMN {column} TEXT")
+
+
+def _m003_hot_query_indexes(con: sqlite3.Connection) -> None:
+    """
+    Индексы под горячие запросы (см. HOT_QUERIES):
+    - последний тест пользователя: (user_id) + rowid => ORDER BY id DESC без сортировки;
+    - активный тест: частичный индекс только по is_done=0;
+    - статистика теста по дням: (test_id, day) => без сортировки.
+    """
+    con.execute("CREATE INDEX IF NOT EXISTS idx_free_tests_user ON free_tests(user_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_free_tests_user_active ON free_tests(user_id) WHERE is_done=0")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_stats_test_day ON stats(test_id, day)")
+
+
+def _m004_fsm_states(con: sqlite3.Connection) -> None:
+    """FSM-состояния aiogram (storage.SQLiteStorage): переживают рестарты."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at INTEGER NOT NULL
+    )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)")
+
+
+def _m005_outbox(con: sqlite3.Connection) -> None:
+    """Очередь исходящих уведомлений (outbox.Outbox): доставляется после рестарта."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        key TEXT PRIMARY KEY,
+        method TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+
+def _m006_broadcasts(con: sqlite3.Connection) -> None:
+    """Рассылки (broadcast.Broadcaster) и статус доставки по каждому получателю."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        segment TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        blocked INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT
+    )""")
+    # status: 0 — ждёт, 1 — доставлено, 2 — бот заблокирован, 3 — ошибка
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID""")
+
+
+def _m007_funnel(con: sqlite3.Connection) -> None:
+    """
+    Счётчики воронки (/funnel): funnel_seen — какие шаги пользователь уже прошёл,
+    funnel_daily — сколько пользователей впервые дошли до шага в этот день.
+    Существующие данные переносятся один раз по датам создания строк.
+
+    Перенос приблизительный: живой счётчик material_N срабатывает, когда
+    исходник дня N принят, а истории исходников нет — material_N берётся по
+    статистике дня N (пользователь, приславший исходник, но не введший
+    статистику, не учтётся; дата — день статистики, а не исходника).
+    test_done так же берётся по статистике 3-го дня. Поэтому исторические
+    счётчики этих шагов ниже и позже живых.
+    """
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS funnel_seen (
+        user_id INTEGER NOT NULL,
+        step TEXT NOT NULL,
+        PRIMARY KEY (user_id, step)
+    ) WITHOUT ROWID""")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS funnel_daily (
+        day TEXT NOT NULL,
+        step TEXT NOT NULL,
+        users INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, step)
+    ) WITHOUT ROWID""")
+
+    # (шаг, запрос "user_id, день первого достижения") — одна строка на пользователя
+    stats_day = "SELECT user_id, date(MIN(created_at)) FROM stats WHERE day={} GROUP BY user_id"
+    backfill = [
+        ("start", "SELECT user_id, date(created_at) FROM users"),
+        ("free_begin", "SELECT user_id, date(MIN(created_at)) FROM free_tests GROUP BY user_id"),
+        ("niche", "SELECT user_id, date(MIN(created_at)) FROM free_tests WHERE niche IS NOT NULL GROUP BY user_id"),
+        ("material_1", stats_day.format(1)),
+        ("material_2", stats_day.format(2)),
+        ("material_3", stats_day.format(3)),
+        ("stats", "SELECT user_id, date(MIN(created_at)) FROM stats GROUP BY user_id"),
+        ("test_done", stats_day.format(3)),
+        ("premium", "SELECT user_id, date(updated_at) FROM subscriptions WHERE plan='premium'"),
+        ("lux", "SELECT user_id, date(updated_at) FROM subscriptions WHERE plan='lux'"),
+    ]
+    for step, source in backfill:
+        con.execute(
+            f"WITH src(user_id, d) AS ({source}) "
+            "INSERT OR IGNORE INTO funnel_seen(user_id, step) SELECT user_id, ? FROM src",
+            (step,),
+        )
+        con.execute(
+            f"WITH src(user_id, d) AS ({source}) "
+            "INSERT INTO funnel_daily(day, step, users) "
+            "SELECT COALESCE(d, date('now')), ?, COUNT(*) FROM src GROUP BY 1",
+            (step,),
+        )
+
+
+def _m008_worker_owner(con: sqlite3.Connection) -> None:
+    """
+    Несколько процессов-воркеров (supervisor.py): outbox и рассылки
+    принадлежат воркеру, который их создал, — после рестарта их поднимает
+    только он, без дублей.
+    """
+    for table in ("outbox", "broadcasts"):
+        if not _column_exists(con, table, "owner"):
+            con.execute(f"ALTER TABLE {table} ADD COLUMN owner INTEGER NOT NULL DEFAULT 0")
+
+
+def _m009_idempotency(con: sqlite3.Connection) -> None:
+    """
+    Идемпотентность (dedup.UpdateDedup):
+    - update_marks — до какого update_id апдейты воркера уже обработаны;
+    - статистика дня теста одна: (test_id, day) уникален, дубли от повторных
+      апдейтов удаляются (остаётся первая строка).
+    """
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS update_marks (
+        worker INTEGER PRIMARY KEY,
+        update_id INTEGER NOT NULL
+    )""")
+    con.execute("""
+    DELETE FROM stats WHERE test_id IS NOT NULL AND id NOT IN (
+        SELECT MIN(id) FROM stats WHERE test_id IS NOT NULL GROUP BY test_id, day
+    )""")
+    con.execute("DROP INDEX IF EXISTS idx_stats_test_day")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_stats_test_day ON stats(test_id, day)")
+
+
+def _m010_media(con: sqlite3.Connection) -> None:
+    """Каталог медиа админа (media.MediaCatalog): file_id переживают рестарт, у файла может быть алиас."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS media (
+        file_unique_id TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        file_size INTEGER,
+        caption TEXT,
+        tags TEXT NOT NULL DEFAULT '',
+        alias TEXT,
+        updated_at INTEGER NOT NULL
+    )""")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_media_alias ON media(alias) WHERE alias IS NOT NULL")
+
+
+def _m011_jobs(con: sqlite3.Connection) -> None:
+    """Очередь заданий free-теста (jobs.JobQueue): исходник пользователя -> готовое видео от админа."""
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        test_id INTEGER,
+        day INTEGER NOT NULL,
+        source_file_id TEXT NOT NULL,
+        description TEXT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        result_file_id TEXT,
+        created_at INTEGER NOT NULL,
+        claimed_at INTEGER,
+        delivered_at INTEGER
+    )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+
+
+def _m012_job_sources(con: sqlite3.Connection) -> None:
+    """
+    Повторно присланные исходники: file_unique_id (одинаков для одного и того же
+    файла у всех пользователей), размер и длительность каждого исходника.
+    Индекс (source_unique_id, user_id) отвечает и «присылал ли он», и «присылал ли кто-то».
+    """
+    for column, kind in (("source_unique_id", "TEXT"), ("source_size", "INTEGER"), ("source_duration", "INTEGER")):
+        if not _column_exists(con, "jobs", column):
+            con.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_source ON jobs(source_unique_id, user_id) "
+        "WHERE source_unique_id IS NOT NULL"
+    )
+
+
+MIGRATIONS = [
+    _m001_base_schema,
+    _m002_free_tests_material_columns,
+    _m003_hot_query_indexes,
+    _m004_fsm_states,
+    _m005_outbox,
+    _m006_broadcasts,
+    _m007_funnel,
+    _m008_worker_owner,
+    _m009_idempotency,
+    _m010_media,
+    _m011_jobs,
+    _m012_job_sources,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(con: Optional[sqlite3.Connection] = None) -> int:
+    con = con or connect()
+    return int(con.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(con: Optional[sqlite3.Connection] = None) -> Tuple[int, int]:
+    """
+    Применяет недостающие шаги MIGRATIONS, каждый в своей транзакции
+    вместе с повышением user_version. Актуальная БД — один PRAGMA.
+    Ошибка шага откатывает его и пробрасывается наружу.
+    Возвращает (версия до, версия после).
+    """
+    con = con or connect()
+    start = schema_version(con)
+    if start > SCHEMA_VERSION:
+        raise RuntimeError(f"DB schema v{start} is newer than this code (v{SCHEMA_VERSION})")
+
+    for version in range(start + 1, SCHEMA_VERSION + 1):
+        step = MIGRATIONS[version - 1]
+        con.execute("BEGIN")
+        try:
+            step(con)
+            con.execute(f"PRAGMA user_version = {version}")
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+    return start, SCHEMA_VERSION
+
+
+def init_db() -> Tuple[int, int]:
+    return migrate(connect())
+
+
+def check_query_plans(con: Optional[sqlite3.Connection] = None) -> dict:
+    """
+    EXPLAIN QUERY PLAN для каждого из HOT_QUERIES.
+    Возвращает {name: [шаги плана]} только для запросов, ушедших в полный SCAN
+    таблицы или во временную сортировку.
+    """
+    con = con or connect()
+    regressions = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        steps = [r[3] for r in con.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        if any(
+            (step.startswith("SCAN ") and "CONSTANT ROW" not in step) or "TEMP B-TREE" in step
+            for step in steps
+        ):
+            regressions[name] = steps
+    return regressions
+
+
+# -------------------- test snapshot cache --------------------
+# Снимок последнего теста пользователя (id, day, is_done + поля анкеты) в LRU.
+# Держится когерентным: каждая запись в free_tests обновляет снимок (write-through).
+# {} — закэшированное "у пользователя нет тестов".
+
+SNAPSHOT_FIELDS = (
+    "niche",
+    "tiktok_link",
+    "goal",
+    "material_type",
+    "material_value",
+    "material_video_id",
+    "material_description",
+)
+
+SNAPSHOT_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "50000"))
+
+_snapshots: "OrderedDict[int, dict]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+_snapshot_hits = 0
+_snapshot_misses = 0
+_snapshot_writes = 0
+
+
+def _load_snapshot(con: sqlite3.Connection, user_id: int) -> dict:
+    row = con.execute(_SQL_LAST_TEST, (user_id,)).fetchone()
+
+    if not row:
+        return {}
+
+    snap = {"test_id": int(row["id"]), "day": row["day"], "is_done": row["is_done"]}
+    snap.update({f: row[f] for f in SNAPSHOT_FIELDS})
+    return snap
+
+
+def _put_snapshot(user_id: int, snap: dict) -> None:
+    # вызывать под _snapshots_lock
+    _snapshots[user_id] = snap
+    _snapshots.move_to_end(user_id)
+    while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+        _snapshots.popitem(last=False)
+
+
+def _store_snapshot(user_id: int, snap: dict) -> None:
+    global _snapshot_writes
+    with _snapshots_lock:
+        _snapshot_writes += 1
+        _put_snapshot(user_id, snap)
+
+
+def _get_snapshot(user_id: int) -> dict:
+    global _snapshot_hits, _snapshot_misses
+    with _snapshots_lock:
+        snap = _snapshots.get(user_id)
+        if snap is not None:
+            _snapshots.move_to_end(user_id)
+            _snapshot_hits += 1
+            return snap
+        _snapshot_misses += 1
+        seen_writes = _snapshot_writes
+
+    snap = _load_snapshot(connect(), user_id)
+
+    # Соединение писателя видит всё, включая незакоммиченное, — его снимок авторитетен.
+    # Читатель кладёт снимок, только если за время SELECT никто ничего не записал.
+    authoritative = getattr(_local, "conn", None) is None
+    with _snapshots_lock:
+        if authoritative or (seen_writes == _snapshot_writes and user_id not in _snapshots):
+            _put_snapshot(user_id, snap)
+    return snap
+
+
+def cached_snapshot(user_id: int) -> Optional[dict]:
+    """Снимок из кэша без обращения к SQLite (None — промах)."""
+    global _snapshot_hits
+    with _snapshots_lock:
+        snap = _snapshots.get(user_id)
+        if snap is not None:
+            _snapshots.move_to_end(user_id)
+            _snapshot_hits += 1
+        return snap
+
+
+def clear_snapshot_cache() -> None:
+    """Сбросить кэш целиком (например, после неудачного COMMIT)."""
+    global _snapshot_writes
+    with _snapshots_lock:
+        _snapshot_writes += 1
+        _snapshots.clear()
+
+
+def cache_stats() -> dict:
+    with _snapshots_lock:
+        hits, misses = _snapshot_hits, _snapshot_misses
+        size = len(_snapshots)
+    total = hits + misses
+    return {
+        "size": size,
+        "capacity": SNAPSHOT_CACHE_SIZE,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+    }
+
+
+def snapshot_active_test_id(snap: dict) -> Optional[int]:
+    if not snap or snap.get("is_done"):
+        return None
+    return snap["test_id"]
+
+
+def snapshot_test_day(snap: dict) -> int:
+    if not snapshot_active_test_id(snap):
+        return 1
+    return int(snap["day"]) if snap.get("day") is not None else 1
+
+
+def snapshot_test_fields(snap: dict) -> dict:
+    if not snap:
+        return {}
+    # ✅ material_* полезны для админ-уведомлений/логов
+    return {"test_id": snap["test_id"], **{f: snap[f] for f in SNAPSHOT_FIELDS}}
+
+
+# -------------------- funnel --------------------
+
+# шаги воронки по порядку; счётчики обновляются теми же записями, что и данные
+FUNNEL_STEPS = (
+    "start",
+    "free_begin",
+    "niche",
+    "material_1",
+    "material_2",
+    "material_3",
+    "stats",
+    "test_done",
+    "premium",
+    "lux",
+)
+
+MATERIAL_FIELDS = {"material_type", "material_value", "material_video_id", "material_description"}
+
+
+def _track(con: sqlite3.Connection, user_id: int, step: str) -> None:
+    """Учитывает шаг в той же транзакции, что и вызывающая запись; повтор шага не считается."""
+    if con.execute(_SQL_FUNNEL_SEEN, (user_id, step)).rowcount:
+        con.execute(_SQL_FUNNEL_BUMP, (step,))
+
+
+def funnel_counts(since: Optional[str] = None, until: Optional[str] = None) -> dict:
+    """
+    {шаг: пользователей, впервые дошедших до шага за период}.
+    since/until — 'YYYY-MM-DD' включительно, None — без границы.
+    Читает только funnel_daily: дни × шаги, без обхода основных таблиц.
+    """
+    con = connect()
+    rows = con.execute(
+        """
+        SELECT step, SUM(users) FROM funnel_daily
+        WHERE day >= ? AND day <= ?
+        GROUP BY step
+        """,
+        (since or "0000-00-00", until or "9999-99-99"),
+    ).fetchall()
+    counts = {step: 0 for step in FUNNEL_STEPS}
+    counts.update({r[0]: int(r[1]) for r in rows})
+    return counts
 
 
 def upsert_user(user_id: int, username: Optional[str]) -> None:
@@ -134,46 +678,55 @@ def upsert_user(user_id: int, username: Optional[str]) -> None:
     con.execute("INSERT OR IGNORE INTO users(user_id, username) VALUES (?,?)", (user_id, username))
     if username:
         con.execute("UPDATE users SET username=? WHERE user_id=?", (username, user_id))
-    con.commit()
+    _track(con, user_id, "start")
+    _commit(con)
 
 
 def start_free_test(user_id: int) -> None:
     con = connect()
-    con.execute("UPDATE free_tests SET is_done=1 WHERE user_id=? AND is_done=0", (user_id,))
-    con.execute("INSERT INTO free_tests(user_id) VALUES (?)", (user_id,))
-    con.commit()
+    con.execute(_SQL_CLOSE_ACTIVE_TESTS, (user_id,))
+    cur = con.execute("INSERT INTO free_tests(user_id) VALUES (?)", (user_id,))
+    _track(con, user_id, "free_begin")
+    _commit(con)
+
+    snap = {"test_id": int(cur.lastrowid), "day": 1, "is_done": 0}
+    snap.update({f: None for f in SNAPSHOT_FIELDS})
+    _store_snapshot(user_id, snap)
 
 
 def get_active_test_id(user_id: int) -> Optional[int]:
-    con = connect()
-    row = con.execute(
-        "SELECT id FROM free_tests WHERE user_id=? AND is_done=0 ORDER BY id DESC LIMIT 1",
-        (user_id,),
-    ).fetchone()
-    return int(row["id"]) if row else None
+    return snapshot_active_test_id(_get_snapshot(user_id))
 
 
 def update_test_field(user_id: int, field: str, value: Any) -> None:
-    if field not in ALLOWED_TEST_FIELDS:
+    update_test_fields(user_id, {field: value})
+
+
+def update_test_fields(user_id: int, fields: dict) -> None:
+    """Несколько полей активного теста одним UPDATE (один lookup, один commit)."""
+    fields = {k: v for k, v in fields.items() if k in ALLOWED_TEST_FIELDS}
+    if not fields:
         return
 
-    test_id = get_active_test_id(user_id)
+    snap = _get_snapshot(user_id)
+    test_id = snapshot_active_test_id(snap)
     if not test_id:
         return
 
     con = connect()
-    con.execute(f"UPDATE free_tests SET {field}=? WHERE id=?", (value, test_id))
-    con.commit()
+    assignments = ", ".join(f"{k}=?" for k in fields)
+    con.execute(f"UPDATE free_tests SET {assignments} WHERE id=?", (*fields.values(), test_id))
+    if fields.get("niche"):
+        _track(con, user_id, "niche")
+    if MATERIAL_FIELDS.intersection(fields):
+        _track(con, user_id, f"material_{min(max(snapshot_test_day(snap), 1), 3)}")
+    _commit(con)
 
+    _store_snapshot(user_id, {**snap, **fields})
 
-def get_test_day(user_id: int) -> int:
-    test_id = get_active_test_id(user_id)
-    if not test_id:
-        return 1
 
-    con = connect()
-    row = con.execute("SELECT day FROM free_tests WHERE id=?", (test_id,)).fetchone()
-    return int(row["day"]) if row and row["day"] is not None else 1
+def get_test_day(user_id: int) -> int:
+    return snapshot_test_day(_get_snapshot(user_id))
 
 
 def set_test_day(user_id: int, day: int) -> None:
@@ -181,99 +734,506 @@ def set_test_day(user_id: int, day: int) -> None:
 
 
 def finish_test(user_id: int) -> None:
-    test_id = get_active_test_id(user_id)
+    snap = _get_snapshot(user_id)
+    test_id = snapshot_active_test_id(snap)
     if not test_id:
         return
     con = connect()
     con.execute("UPDATE free_tests SET is_done=1 WHERE id=?", (test_id,))
-    con.commit()
+    _track(con, user_id, "test_done")
+    _commit(con)
+
+    _store_snapshot(user_id, {**snap, "is_done": 1})
 
 
 def get_last_test_fields(user_id: int) -> dict:
+    return snapshot_test_fields(_get_snapshot(user_id))
+
+
+def add_stats(user_id: int, day: int, post_link: str, views: int, likes: int, comments: int, follows: int) -> None:
+    # тест — активный, а если его нет, последний (активный всегда последний)
     con = connect()
-    row = con.execute(
+    snap = cached_snapshot(user_id)
+    if snap is not None:
+        con.execute(
+            _SQL_INSERT_STATS,
+            (user_id, snap.get("test_id"), day, post_link, views, likes, comments, follows),
+        )
+    else:
+        con.execute(
+            _SQL_INSERT_STATS_LAST_TEST,
+            (user_id, user_id, day, post_link, views, likes, comments, follows),
+        )
+    _track(con, user_id, "stats")
+    _commit(con)
+
+
+def get_stats_for_last_test(user_id: int) -> List[Tuple]:
+    con = connect()
+    rows = con.execute(_SQL_STATS_FOR_LAST_TEST, (user_id, user_id)).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def set_subscription(user_id: int, plan: str, status: str) -> None:
+    con = connect()
+    con.execute(
         """
-        SELECT id, niche, tiktok_link, goal,
-               material_type, material_value, material_video_id, material_description
-        FROM free_tests
-        WHERE user_id=?
-        ORDER BY id DESC
-        LIMIT 1
+        INSERT INTO subscriptions(user_id, plan, status)
+        VALUES (?,?,?)
+        ON CONFLICT(user_id) DO UPDATE
+        SET plan=excluded.plan, status=excluded.status, updated_at=CURRENT_TIMESTAMP
         """,
-        (user_id,),
-    ).fetchone()
+        (user_id, plan, status),
+    )
+    if plan in FUNNEL_STEPS:
+        _track(con, user_id, plan)
+    _commit(con)
 
-    if not row:
-        return {}
 
-    return {
-        "test_id": int(row["id"]),
-        "niche": row["niche"],
-        "tiktok_link": row["tiktok_link"],
-        "goal": row["goal"],
-        # ✅ полезно для админ-уведомлений/логов
-        "material_type": row["material_type"],
-        "material_value": row["material_value"],
-        "material_video_id": row["material_video_id"],
-        "material_description": row["material_description"],
-    }
+# -------------------- FSM storage --------------------
 
+def fsm_load(key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """(state, data_json) или None, если записи нет."""
+    con = connect()
+    row = con.execute("SELECT state, data FROM fsm_states WHERE key=?", (key,)).fetchone()
+    return (row["state"], row["data"]) if row else None
 
-def add_stats(user_id: int, day: int, post_link: str, views: int, likes: int, comments: int, follows: int) -> None:
-    test_id = get_active_test_id(user_id)
 
-    if not test_id:
-        con = connect()
-        row = con.execute(
-            "SELECT id FROM free_tests WHERE user_id=? ORDER BY id DESC LIMIT 1",
-            (user_id,),
-        ).fetchone()
-        test_id = int(row["id"]) if row else None
+def fsm_save(key: str, state: Optional[str], data_json: Optional[str], updated_at: int) -> None:
+    con = connect()
+    if state is None and not data_json:
+        # пустая сессия (state.clear()) — строка не нужна
+        con.execute("DELETE FROM fsm_states WHERE key=?", (key,))
+    else:
+        con.execute(
+            """
+            INSERT INTO fsm_states(key, state, data, updated_at)
+            VALUES (?,?,?,?)
+            ON CONFLICT(key) DO UPDATE
+            SET state=excluded.state, data=excluded.data, updated_at=excluded.updated_at
+            """,
+            (key, state, data_json, updated_at),
+        )
+    _commit(con)
+
+
+def fsm_purge(older_than: int) -> int:
+    """Удаляет брошенные сессии, не менявшиеся с older_than (unix time)."""
+    con = connect()
+    cur = con.execute("DELETE FROM fsm_states WHERE updated_at < ?", (older_than,))
+    _commit(con)
+    return cur.rowcount
+
+
+# -------------------- update marks --------------------
 
+def update_mark_load(worker: int) -> int:
+    row = connect().execute("SELECT update_id FROM update_marks WHERE worker=?", (worker,)).fetchone()
+    return row[0] if row else 0
+
+
+def update_mark_save(worker: int, update_id: int) -> None:
     con = connect()
     con.execute(
-        """
-        INSERT INTO stats(user_id, test_id, day, post_link, views, likes, comments, follows)
-        VALUES (?,?,?,?,?,?,?,?)
-        """,
-        (user_id, test_id, day, post_link, views, likes, comments, follows),
+        "INSERT INTO update_marks(worker, update_id) VALUES (?,?) "
+        "ON CONFLICT(worker) DO UPDATE SET update_id=excluded.update_id",
+        (worker, update_id),
     )
-    con.commit()
+    _commit(con)
 
 
-def get_stats_for_last_test(user_id: int) -> List[Tuple]:
+# -------------------- outbox --------------------
+
+def outbox_add(key: str, method: str, priority: int, payload: str, owner: int = 0) -> None:
     con = connect()
-    row = con.execute(
-        "SELECT id FROM free_tests WHERE user_id=? ORDER BY id DESC LIMIT 1",
-        (user_id,),
-    ).fetchone()
+    con.execute(
+        "INSERT INTO outbox(key, method, priority, payload, owner) VALUES (?,?,?,?,?)",
+        (key, method, priority, payload, owner),
+    )
+    _commit(con)
 
-    if not row:
-        return []
 
-    test_id = int(row["id"])
+def outbox_done(key: str) -> None:
+    con = connect()
+    con.execute("DELETE FROM outbox WHERE key=?", (key,))
+    _commit(con)
+
+
+def outbox_pending(owner: int = 0, owners: int = 1) -> List[Tuple]:
+    """
+    (key, method, priority, payload) воркера owner в порядке постановки.
+    owner % owners: строки воркеров, которых после уменьшения их числа уже нет,
+    забирает ровно один из оставшихся.
+    """
+    con = connect()
+    rows = con.execute(
+        "SELECT key, method, priority, payload FROM outbox WHERE owner % ? = ? ORDER BY rowid",
+        (max(1, owners), owner),
+    ).fetchall()
+    return [tuple(r) for r in rows]
+
+
+# -------------------- broadcasts --------------------
+# Сегменты аудитории: имя -> SELECT user_id. Все ветки идут по индексам.
+
+SEGMENTS = {
+    "all": "SELECT user_id FROM users",
+    # прошли тест (есть статистика 3-го дня), но подписку не запрашивали
+    "finished_no_sub": """
+        SELECT u.user_id FROM users u
+        WHERE EXISTS (
+            SELECT 1 FROM free_tests t JOIN stats s ON s.test_id=t.id AND s.day=3
+            WHERE t.user_id=u.user_id
+        )
+        AND NOT EXISTS (SELECT 1 FROM subscriptions sub WHERE sub.user_id=u.user_id)
+    """,
+    # тест начат и не закончен
+    "in_test": "SELECT DISTINCT user_id FROM free_tests WHERE is_done=0",
+    # нажали /start, но тест не начинали
+    "no_test": """
+        SELECT u.user_id FROM users u
+        WHERE NOT EXISTS (SELECT 1 FROM free_tests t WHERE t.user_id=u.user_id)
+    """,
+    # заявка Premium/Lux ещё в статусе pending
+    "pending": "SELECT user_id FROM subscriptions WHERE status='pending'",
+}
+
+RECIPIENT_PENDING = 0
+RECIPIENT_SENT = 1
+RECIPIENT_BLOCKED = 2
+RECIPIENT_FAILED = 3
+
+
+def segment_user_ids(segment: str, limit: int) -> List[int]:
+    """Первые limit получателей сегмента по user_id (адресные отправки админа)."""
+    if segment not in SEGMENTS:
+        raise ValueError(f"Unknown segment: {segment}")
+    con = connect()
+    rows = con.execute(f"SELECT user_id FROM ({SEGMENTS[segment]}) ORDER BY user_id LIMIT ?", (limit,)).fetchall()
+    return [r[0] for r in rows]
+
+
+def broadcast_create(kind: str, payload: str, segment: str, owner: int = 0) -> Tuple[int, int]:
+    """Создаёт рассылку и список получателей прямо в SQL. Возвращает (id, total)."""
+    if segment not in SEGMENTS:
+        raise ValueError(f"Unknown segment: {segment}")
+
+    con = connect()
+    cur = con.execute(
+        "INSERT INTO broadcasts(kind, payload, segment, owner) VALUES (?,?,?,?)",
+        (kind, payload, segment, owner),
+    )
+    broadcast_id = int(cur.lastrowid)
+    cur = con.execute(
+        f"INSERT OR IGNORE INTO broadcast_recipients(broadcast_id, user_id) "
+        f"SELECT ?, user_id FROM ({SEGMENTS[segment]})",
+        (broadcast_id,),
+    )
+    total = cur.rowcount
+    con.execute("UPDATE broadcasts SET total=? WHERE id=?", (total, broadcast_id))
+    _commit(con)
+    return broadcast_id, total
+
+
+def broadcast_pending_chunk(broadcast_id: int, after_user_id: int, limit: int) -> List[int]:
+    """Следующая пачка ещё не обработанных получателей (keyset-пагинация по user_id)."""
+    con = connect()
     rows = con.execute(
         """
-        SELECT day, post_link, views, likes, comments, follows
-        FROM stats
-        WHERE user_id=? AND test_id=?
-        ORDER BY day ASC
+        SELECT user_id FROM broadcast_recipients
+        WHERE broadcast_id=? AND user_id>? AND status=0
+        ORDER BY user_id
+        LIMIT ?
         """,
-        (user_id, test_id),
+        (broadcast_id, after_user_id, limit),
     ).fetchall()
+    return [int(r["user_id"]) for r in rows]
 
-    return [tuple(r) for r in rows]
 
+def broadcast_record(broadcast_id: int, results: List[Tuple[int, int, Optional[str]]]) -> None:
+    """results: [(user_id, status, error)] — статусы и счётчики одной транзакцией."""
+    if not results:
+        return
+    con = connect()
+    con.executemany(
+        "UPDATE broadcast_recipients SET status=?, error=? WHERE broadcast_id=? AND user_id=?",
+        [(status, error, broadcast_id, user_id) for user_id, status, error in results],
+    )
+    sent = sum(1 for _, st, _ in results if st == RECIPIENT_SENT)
+    blocked = sum(1 for _, st, _ in results if st == RECIPIENT_BLOCKED)
+    failed = sum(1 for _, st, _ in results if st == RECIPIENT_FAILED)
+    con.execute(
+        "UPDATE broadcasts SET sent=sent+?, blocked=blocked+?, failed=failed+? WHERE id=?",
+        (sent, blocked, failed, broadcast_id),
+    )
+    _commit(con)
 
-def set_subscription(user_id: int, plan: str, status: str) -> None:
+
+def broadcast_finish(broadcast_id: int, status: str) -> None:
+    con = connect()
+    con.execute(
+        "UPDATE broadcasts SET status=?, finished_at=CURRENT_TIMESTAMP WHERE id=?",
+        (status, broadcast_id),
+    )
+    _commit(con)
+
+
+def _broadcast_row(row: sqlite3.Row) -> dict:
+    return {k: row[k] for k in row.keys()}
+
+
+def broadcast_get(broadcast_id: int) -> Optional[dict]:
+    con = connect()
+    row = con.execute("SELECT * FROM broadcasts WHERE id=?", (broadcast_id,)).fetchone()
+    return _broadcast_row(row) if row else None
+
+
+def broadcasts_by_status(status: str, owner: int = 0, owners: int = 1) -> List[dict]:
+    """Рассылки воркера owner (см. outbox_pending про owner % owners)."""
+    con = connect()
+    rows = con.execute(
+        "SELECT * FROM broadcasts WHERE status=? AND owner % ? = ? ORDER BY id",
+        (status, max(1, owners), owner),
+    ).fetchall()
+    return [_broadcast_row(r) for r in rows]
+
+
+def broadcasts_recent(limit: int = 5) -> List[dict]:
+    con = connect()
+    rows = con.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [_broadcast_row(r) for r in rows]
+
+
+# -------------------- media --------------------
+
+def media_all() -> List[dict]:
+    con = connect()
+    rows = con.execute("SELECT * FROM media ORDER BY updated_at, rowid").fetchall()
+    return [dict(r) for r in rows]
+
+
+def media_save(
+    file_unique_id: str,
+    file_id: str,
+    kind: str,
+    file_size: Optional[int],
+    caption: Optional[str],
+    tags: str,
+    updated_at: int,
+) -> None:
+    """Повторно присланный файл: свежий file_id, алиас сохраняется, подпись и теги — если пришли новые."""
     con = connect()
     con.execute(
         """
-        INSERT INTO subscriptions(user_id, plan, status)
-        VALUES (?,?,?)
-        ON CONFLICT(user_id) DO UPDATE
-        SET plan=excluded.plan, status=excluded.status, updated_at=CURRENT_TIMESTAMP
+        INSERT INTO media(file_unique_id, file_id, kind, file_size, caption, tags, updated_at)
+        VALUES (?,?,?,?,?,?,?)
+        ON CONFLICT(file_unique_id) DO UPDATE
+        SET file_id=excluded.file_id,
+            kind=excluded.kind,
+            file_size=COALESCE(excluded.file_size, file_size),
+            caption=COALESCE(excluded.caption, caption),
+            tags=CASE WHEN excluded.tags != '' THEN excluded.tags ELSE tags END,
+            updated_at=excluded.updated_at
         """,
-        (user_id, plan, status),
+        (file_unique_id, file_id, kind, file_size, caption, tags, updated_at),
     )
-    con.commit()
+    _commit(con)
+
+
+def media_set_alias(file_unique_id: str, alias: str) -> None:
+    """Алиас уникален: у прежнего владельца он снимается."""
+    con = connect()
+    con.execute("UPDATE media SET alias=NULL WHERE alias=? AND file_unique_id != ?", (alias, file_unique_id))
+    con.execute("UPDATE media SET alias=? WHERE file_unique_id=?", (alias, file_unique_id))
+    _commit(con)
+
+
+# -------------------- jobs --------------------
+# status: queued -> claimed (админ взял /next) -> delivered (готовое видео у пользователя)
+
+def job_create(
+    user_id: int,
+    day: int,
+    source_file_id: str,
+    description: Optional[str],
+    created_at: int,
+    source_unique_id: Optional[str] = None,
+    source_size: Optional[int] = None,
+    source_duration: Optional[int] = None,
+) -> int:
+    con = connect()
+    test_id = snapshot_active_test_id(_get_snapshot(user_id))
+    cur = con.execute(
+        """
+        INSERT INTO jobs(user_id, test_id, day, source_file_id, description, created_at,
+                         source_unique_id, source_size, source_duration)
+        VALUES (?,?,?,?,?,?,?,?,?)
+        """,
+        (user_id, test_id, day, source_file_id, description, created_at, source_unique_id, source_size, source_duration),
+    )
+    _commit(con)
+    return int(cur.lastrowid)
+
+
+def source_seen(source_unique_id: str, user_id: int) -> Optional[dict]:
+    """Задание с этим же исходником: сначала своё, потом чужое. {id, user_id, day, own} или None."""
+    con = connect()
+    row = con.execute(_SQL_SOURCE_SEEN_BY_USER, (source_unique_id, user_id)).fetchone()
+    if row is None:
+        row = con.execute(_SQL_SOURCE_SEEN, (source_unique_id,)).fetchone()
+    if row is None:
+        return None
+    return {**dict(row), "own": row["user_id"] == user_id}
+
+
+def job_claim(now: int, stale_before: int) -> Optional[dict]:
+    """
+    Берёт самое старое задание в очереди (или взятое раньше stale_before и не
+    сданное) одним UPDATE — два воркера одно задание не получат.
+    """
+    con = connect()
+    row = con.execute(
+        """
+        UPDATE jobs SET status='claimed', claimed_at=?
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status='queued' OR (status='claimed' AND claimed_at < ?)
+            ORDER BY id LIMIT 1
+        )
+        RETURNING *
+        """,
+        (now, stale_before),
+    ).fetchone()
+    _commit(con)
+    return dict(row) if row else None
+
+
+def job_deliver(job_id: int, result_file_id: str, delivered_at: int) -> bool:
+    con = connect()
+    cur = con.execute(
+        "UPDATE jobs SET status='delivered', result_file_id=?, delivered_at=? WHERE id=? AND status != 'delivered'",
+        (result_file_id, delivered_at, job_id),
+    )
+    _commit(con)
+    return cur.rowcount > 0
+
+
+def job_get(job_id: int) -> Optional[dict]:
+    con = connect()
+    row = con.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def jobs_open(limit: int = 10) -> List[dict]:
+    """Несданные задания, старые первыми."""
+    con = connect()
+    rows = con.execute(
+        "SELECT * FROM jobs WHERE status IN ('queued', 'claimed') ORDER BY id LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def jobs_stats() -> dict:
+    """{статус: (количество, самое раннее created_at)} по несданным заданиям."""
+    con = connect()
+    rows = con.execute(
+        "SELECT status, COUNT(*), MIN(created_at) FROM jobs WHERE status IN ('queued', 'claimed') GROUP BY status"
+    ).fetchall()
+    return {r[0]: (r[1], r[2]) for r in rows}
+
+
+# -------------------- cohorts --------------------
+
+def completed_test_totals() -> List[Tuple]:
+    """
+    Итоги завершённых тестов одним проходом по stats:
+    (niche, goal, days, views, likes, comments, follows) на каждый тест.
+    """
+    con = connect()
+    rows = con.execute(
+        """
+        SELECT t.niche, t.goal, COUNT(s.id),
+               SUM(s.views), SUM(s.likes), SUM(s.comments), SUM(s.follows)
+        FROM free_tests t
+        JOIN stats s ON s.test_id = t.id
+        WHERE t.is_done=1
+        GROUP BY t.id
+        """
+    ).fetchall()
+    return [tuple(r) for r in rows]
+
+
+# -------------------- export --------------------
+
+# таблица выгрузки -> (SELECT, колонка даты, фильтр по нише, ORDER BY)
+_EXPORT_NICHE_OF_USER = "EXISTS (SELECT 1 FROM free_tests t WHERE t.user_id=x.user_id AND t.niche=?)"
+EXPORTS = {
+    "users": (
+        "SELECT x.user_id, x.username, x.created_at FROM users x",
+        "x.created_at",
+        _EXPORT_NICHE_OF_USER,
+        "x.user_id",
+    ),
+    "tests": (
+        """
+        SELECT x.id, x.user_id, x.niche, x.tiktok_link, x.goal, x.material_type, x.material_value,
+               x.material_video_id, x.material_description, x.day, x.is_done, x.created_at
+        FROM free_tests x
+        """,
+        "x.created_at",
+        "x.niche=?",
+        "x.id",
+    ),
+    "stats": (
+        """
+        SELECT x.id, x.user_id, x.test_id, t.niche, t.goal, x.day, x.post_link,
+               x.views, x.likes, x.comments, x.follows, x.created_at
+        FROM stats x LEFT JOIN free_tests t ON t.id = x.test_id
+        """,
+        "x.created_at",
+        "t.niche=?",
+        "x.id",
+    ),
+    "subscriptions": (
+        "SELECT x.user_id, x.plan, x.status, x.updated_at FROM subscriptions x",
+        "x.updated_at",
+        _EXPORT_NICHE_OF_USER,
+        "x.user_id",
+    ),
+}
+
+
+def export_rows(
+    table: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    niche: Optional[str] = None,
+    batch_size: int = 1000,
+) -> Iterator[Tuple]:
+    """
+    Генератор выгрузки: первая строка — имена колонок, дальше строки
+    пачками по batch_size (fetchmany), в памяти не больше одной пачки.
+    since/until — 'YYYY-MM-DD' включительно. Потребляется в том же потоке.
+    """
+    select, date_column, niche_filter, order = EXPORTS[table]
+    where, params = [], []
+    if since:
+        where.append(f"{date_column} >= ?")
+        params.append(since)
+    if until:
+        where.append(f"{date_column} < date(?, '+1 day')")
+        params.append(until)
+    if niche:
+        where.append(niche_filter)
+        params.append(niche)
+
+    sql = select + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {order}"
+    cur = connect().execute(sql, params)
+    yield tuple(d[0] for d in cur.description)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield tuple(row)
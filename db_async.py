@@ -0,0 +1,491 @@
+"""
+Асинхронный фасад над db.py.
+
+Все записи идут через один выделенный поток-писатель (очередь запросов,
+единственное соединение db._conn), все SELECT — через пул потоков
+с отдельными read-only WAL-соединениями. Event loop aiogram никогда
+не ждёт диск напрямую.
+
+В write-behind режиме писатель объединяет записи в group-commit:
+одна транзакция (один fsync) на пачку операций.
+
+Использование:
+    db_async.start(readers=4)
+    await db_async.upsert_user(user_id, username)
+    ...
+    await db_async.close()
+"""
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+import db
+from metrics import add_db_time
+
+_writer: Optional["_Writer"] = None
+_readers: Optional[ThreadPoolExecutor] = None
+
+# повторы операции писателя, если БД заблокирована другим процессом
+LOCKED_RETRIES = 5
+
+_WRITE = "write"
+_READ = "read"
+_BARRIER = "barrier"
+
+
+class _Writer(threading.Thread):
+    """
+    Единственный поток, который пишет в SQLite.
+
+    Операции выполняются сразу по мере поступления внутри открытой транзакции,
+    а COMMIT делается:
+      - после каждой записи (обычный режим);
+      - раз в flush_ms или раз в flush_ops записей (write-behind);
+      - на барьере и при остановке.
+    """
+
+    def __init__(self, write_behind: bool = False, flush_ms: int = 50, flush_ops: int = 100) -> None:
+        super().__init__(name="db-writer", daemon=True)
+        self.requests: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self.write_behind = write_behind
+        self.flush_s = max(0, flush_ms) / 1000
+        self.flush_ops = max(1, flush_ops)
+
+        # записи, поставленные в очередь, но ещё не закоммиченные
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        self.commits = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, kind: str, fn: Optional[Callable], *args: Any, **kwargs: Any) -> Future:
+        fut: Future = Future()
+        if kind == _WRITE:
+            with self._pending_lock:
+                self._pending += 1
+        self.requests.put((kind, fn, args, kwargs, fut))
+        return fut
+
+    def run(self) -> None:
+        con = db.connect()
+        db.set_batch_mode(True)
+
+        uncommitted = 0
+        first_at = 0.0
+
+        while True:
+            timeout = None
+            if uncommitted:
+                timeout = max(0.0, first_at + self.flush_s - time.monotonic())
+
+            try:
+                item = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                self._commit(con, uncommitted)
+                uncommitted = 0
+                continue
+
+            if item is None:
+                self._commit(con, uncommitted)
+                break
+
+            kind, fn, args, kwargs, fut = item
+            if not fut.set_running_or_notify_cancel():
+                # отменённая запись не выполнится и не попадёт в COMMIT
+                if kind == _WRITE:
+                    with self._pending_lock:
+                        self._pending -= 1
+                continue
+
+            if kind == _BARRIER:
+                error = self._commit(con, uncommitted)
+                uncommitted = 0
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(None)
+                continue
+
+            result, error = None, None
+            try:
+                if kind == _WRITE:
+                    result = self._call(con, fn, args, kwargs)
+                else:
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                if kind == _WRITE and self.write_behind:
+                    logging.exception(f"Write-behind op {getattr(fn, '__name__', fn)} failed: {e}")
+
+            if kind == _WRITE:
+                if not uncommitted:
+                    first_at = time.monotonic()
+                uncommitted += 1
+
+                if not self.write_behind or uncommitted >= self.flush_ops:
+                    error = error or self._commit(con, uncommitted)
+                    uncommitted = 0
+
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+    def _call(self, con, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        """
+        Операция записи внутри SAVEPOINT: упавшая операция откатывается целиком
+        (ни одного из её операторов не будет в COMMIT), остальные записи пачки
+        остаются.
+
+        Несколько процессов на одной БД: первая запись транзакции может получить
+        "database is locked" и после busy_timeout. Если транзакция до операции
+        не была открыта, операция ещё ничего не записала — откатываем и повторяем.
+        С открытой транзакцией блокировка записи уже наша, такой ошибки не бывает.
+        """
+        clean = not con.in_transaction
+        for attempt in range(LOCKED_RETRIES):
+            # SAVEPOINT вне транзакции сам стал бы транзакцией и RELEASE закоммитил бы её
+            if not con.in_transaction:
+                con.execute("BEGIN")
+            con.execute("SAVEPOINT op")
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                con.execute("ROLLBACK TO op")
+                con.execute("RELEASE op")
+                locked = isinstance(e, sqlite3.OperationalError) and "locked" in str(e)
+                if not clean or not locked or attempt == LOCKED_RETRIES - 1:
+                    raise
+                con.rollback()
+                delay = 0.05 * (2 ** attempt)
+                logging.warning(f"DB locked by another process, retry {getattr(fn, '__name__', fn)} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            con.execute("RELEASE op")
+            return result
+
+    def _commit(self, con, count: int) -> Optional[Exception]:
+        """COMMIT пачки из count записей. Возвращает ошибку вместо raise — поток не должен падать."""
+        if not count:
+            return None
+        try:
+            con.commit()
+            self.commits += 1
+            return None
+        except Exception as e:
+            logging.exception(f"DB commit of {count} ops failed: {e}")
+            try:
+                con.rollback()
+            except Exception:
+                pass
+            # снимки уже отражают откатившиеся записи
+            db.clear_snapshot_cache()
+            return e
+        finally:
+            with self._pending_lock:
+                self._pending -= count
+
+    def stop(self) -> None:
+        self.requests.put(None)
+        self.join()
+
+
+def _init_reader() -> None:
+    db.bind_thread_connection(db.connect_readonly())
+
+
+def start(readers: int = 4, write_behind: bool = False, flush_ms: int = 50, flush_ops: int = 100) -> None:
+    """
+    Запускает поток-писатель и пул читателей. init_db должен быть уже выполнен.
+
+    write_behind=True: записи не ждут COMMIT, а сбрасываются одной транзакцией
+    каждые flush_ms миллисекунд или flush_ops операций. Для гарантии
+    durability — await barrier().
+    """
+    global _writer, _readers
+    if _writer is not None:
+        return
+
+    db.connect()
+    _writer = _Writer(write_behind=write_behind, flush_ms=flush_ms, flush_ops=flush_ops)
+    _writer.start()
+    _readers = ThreadPoolExecutor(
+        max_workers=max(1, readers),
+        thread_name_prefix="db-reader",
+        initializer=_init_reader,
+    )
+    mode = f"write-behind {flush_ms}ms/{flush_ops} ops" if write_behind else "commit per write"
+    logging.info(f"db_async started: 1 writer ({mode}), {max(1, readers)} readers")
+
+
+async def close() -> None:
+    """Сбрасывает все поставленные записи (финальный COMMIT) и останавливает потоки."""
+    global _writer, _readers
+    writer, readers = _writer, _readers
+    _writer, _readers = None, None
+
+    if writer is not None:
+        await asyncio.to_thread(writer.stop)
+    if readers is not None:
+        await asyncio.to_thread(readers.shutdown, True)
+
+
+def writer_stats() -> dict:
+    """Очередь писателя: незакоммиченные записи и число COMMIT с запуска."""
+    if _writer is None:
+        return {"pending": 0, "commits": 0}
+    return {"pending": _writer.pending, "commits": _writer.commits}
+
+
+async def _wait(fut: "asyncio.Future") -> Any:
+    """Ожидание БД; время засчитывается текущему апдейту (metrics)."""
+    started = time.perf_counter()
+    try:
+        return await fut
+    finally:
+        add_db_time(time.perf_counter() - started)
+
+
+async def barrier() -> None:
+    """Durability barrier: возвращается, когда всё поставленное ранее закоммичено."""
+    if _writer is None:
+        raise RuntimeError("db_async is not started: call db_async.start() first")
+    await _wait(asyncio.wrap_future(_writer.submit(_BARRIER, None)))
+
+
+async def _write(fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    if _writer is None:
+        raise RuntimeError("db_async is not started: call db_async.start() first")
+    fut = _writer.submit(_WRITE, fn, *args, **kwargs)
+    if _writer.write_behind:
+        # не ждём COMMIT; ошибки логирует сам писатель
+        return None
+    # shield: отмена хендлера не отменяет уже поставленную в очередь запись
+    return await _wait(asyncio.shield(asyncio.wrap_future(fut)))
+
+
+async def _write_result(fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Запись, результат которой нужен вызывающему: ждём выполнения даже в write-behind."""
+    if _writer is None:
+        raise RuntimeError("db_async is not started: call db_async.start() first")
+    return await _wait(asyncio.shield(asyncio.wrap_future(_writer.submit(_WRITE, fn, *args, **kwargs))))
+
+
+async def _read(fn: Callable, *args: Any) -> Any:
+    if _readers is None or _writer is None:
+        raise RuntimeError("db_async is not started: call db_async.start() first")
+    if _writer.pending:
+        # есть незакоммиченные записи: читаем через писателя, чтобы видеть свои же изменения
+        return await _wait(asyncio.wrap_future(_writer.submit(_READ, fn, *args)))
+    return await _wait(asyncio.get_running_loop().run_in_executor(_readers, fn, *args))
+
+
+async def run_in_reader(fn: Callable, *args: Any) -> Any:
+    """
+    Долгое read-only чтение (выгрузки) целиком в читающем потоке — писатель
+    не занимается. Несброшенные write-behind записи не видны: нужен barrier().
+    """
+    if _readers is None:
+        raise RuntimeError("db_async is not started: call db_async.start() first")
+    return await _wait(asyncio.get_running_loop().run_in_executor(_readers, fn, *args))
+
+
+async def _read_snapshot(fn: Callable, derive: Callable[[dict], Any], user_id: int) -> Any:
+    """Чтение из снимка теста: при попадании в кэш — без потоков и SQLite."""
+    if _writer is not None and not _writer.pending:
+        snap = db.cached_snapshot(user_id)
+        if snap is not None:
+            return derive(snap)
+    return await _read(fn, user_id)
+
+
+# -------------------- writes --------------------
+
+async def upsert_user(user_id: int, username: Optional[str]) -> None:
+    await _write(db.upsert_user, user_id, username)
+
+
+async def start_free_test(user_id: int) -> None:
+    await _write(db.start_free_test, user_id)
+
+
+async def update_test_field(user_id: int, field: str, value: Any) -> None:
+    await _write(db.update_test_field, user_id, field, value)
+
+
+async def update_test_fields(user_id: int, fields: dict) -> None:
+    await _write(db.update_test_fields, user_id, fields)
+
+
+async def set_test_day(user_id: int, day: int) -> None:
+    await _write(db.set_test_day, user_id, day)
+
+
+async def finish_test(user_id: int) -> None:
+    await _write(db.finish_test, user_id)
+
+
+async def add_stats(user_id: int, day: int, post_link: str, views: int, likes: int, comments: int, follows: int) -> None:
+    await _write(db.add_stats, user_id, day, post_link, views, likes, comments, follows)
+
+
+async def set_subscription(user_id: int, plan: str, status: str) -> None:
+    await _write(db.set_subscription, user_id, plan, status)
+
+
+async def fsm_save(key: str, state: Optional[str], data_json: Optional[str], updated_at: int) -> None:
+    await _write(db.fsm_save, key, state, data_json, updated_at)
+
+
+async def fsm_purge(older_than: int) -> int:
+    return await _write_result(db.fsm_purge, older_than)
+
+
+async def media_save(
+    file_unique_id: str,
+    file_id: str,
+    kind: str,
+    file_size: Optional[int],
+    caption: Optional[str],
+    tags: str,
+    updated_at: int,
+) -> None:
+    await _write(db.media_save, file_unique_id, file_id, kind, file_size, caption, tags, updated_at)
+
+
+async def media_set_alias(file_unique_id: str, alias: str) -> None:
+    await _write(db.media_set_alias, file_unique_id, alias)
+
+
+async def job_create(
+    user_id: int,
+    day: int,
+    source_file_id: str,
+    description: Optional[str],
+    created_at: int,
+    source_unique_id: Optional[str] = None,
+    source_size: Optional[int] = None,
+    source_duration: Optional[int] = None,
+) -> int:
+    return await _write_result(
+        db.job_create, user_id, day, source_file_id, description, created_at,
+        source_unique_id, source_size, source_duration,
+    )
+
+
+async def job_claim(now: int, stale_before: int) -> Optional[dict]:
+    return await _write_result(db.job_claim, now, stale_before)
+
+
+async def job_deliver(job_id: int, result_file_id: str, delivered_at: int) -> bool:
+    return await _write_result(db.job_deliver, job_id, result_file_id, delivered_at)
+
+
+async def update_mark_save(worker: int, update_id: int) -> None:
+    await _write(db.update_mark_save, worker, update_id)
+
+
+async def outbox_add(key: str, method: str, priority: int, payload: str, owner: int = 0) -> None:
+    await _write(db.outbox_add, key, method, priority, payload, owner)
+
+
+async def outbox_done(key: str) -> None:
+    await _write(db.outbox_done, key)
+
+
+async def broadcast_create(kind: str, payload: str, segment: str, owner: int = 0) -> Tuple[int, int]:
+    return await _write_result(db.broadcast_create, kind, payload, segment, owner)
+
+
+async def broadcast_record(broadcast_id: int, results: List[Tuple[int, int, Optional[str]]]) -> None:
+    await _write(db.broadcast_record, broadcast_id, results)
+
+
+async def broadcast_finish(broadcast_id: int, status: str) -> None:
+    await _write(db.broadcast_finish, broadcast_id, status)
+
+
+# -------------------- reads --------------------
+
+async def get_active_test_id(user_id: int) -> Optional[int]:
+    return await _read_snapshot(db.get_active_test_id, db.snapshot_active_test_id, user_id)
+
+
+async def get_test_day(user_id: int) -> int:
+    return await _read_snapshot(db.get_test_day, db.snapshot_test_day, user_id)
+
+
+async def get_last_test_fields(user_id: int) -> dict:
+    return await _read_snapshot(db.get_last_test_fields, db.snapshot_test_fields, user_id)
+
+
+async def get_stats_for_last_test(user_id: int) -> List[Tuple]:
+    return await _read(db.get_stats_for_last_test, user_id)
+
+
+async def fsm_load(key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    return await _read(db.fsm_load, key)
+
+
+async def media_all() -> List[dict]:
+    return await _read(db.media_all)
+
+
+async def job_get(job_id: int) -> Optional[dict]:
+    return await _read(db.job_get, job_id)
+
+
+async def source_seen(source_unique_id: str, user_id: int) -> Optional[dict]:
+    return await _read(db.source_seen, source_unique_id, user_id)
+
+
+async def jobs_open(limit: int = 10) -> List[dict]:
+    return await _read(db.jobs_open, limit)
+
+
+async def jobs_stats() -> dict:
+    return await _read(db.jobs_stats)
+
+
+async def update_mark_load(worker: int) -> int:
+    return await _read(db.update_mark_load, worker)
+
+
+async def outbox_pending(owner: int = 0, owners: int = 1) -> List[Tuple]:
+    return await _read(db.outbox_pending, owner, owners)
+
+
+async def segment_user_ids(segment: str, limit: int) -> List[int]:
+    return await _read(db.segment_user_ids, segment, limit)
+
+
+async def broadcast_pending_chunk(broadcast_id: int, after_user_id: int, limit: int) -> List[int]:
+    return await _read(db.broadcast_pending_chunk, broadcast_id, after_user_id, limit)
+
+
+async def broadcast_get(broadcast_id: int) -> Optional[dict]:
+    return await _read(db.broadcast_get, broadcast_id)
+
+
+async def broadcasts_by_status(status: str, owner: int = 0, owners: int = 1) -> List[dict]:
+    return await _read(db.broadcasts_by_status, status, owner, owners)
+
+
+async def broadcasts_recent(limit: int = 5) -> List[dict]:
+    return await _read(db.broadcasts_recent, limit)
+
+
+async def completed_test_totals() -> List[Tuple]:
+    return await _read(db.completed_test_totals)
+
+
+async def funnel_counts(since: Optional[str] = None, until: Optional[str] = None) -> dict:
+    return await _read(db.funnel_counts, since, until)
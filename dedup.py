@@ -0,0 +1,123 @@
+"""
+Защита от повторной доставки апдейтов.
+
+После рестарта или ретрая вебхука Telegram может прислать тот же апдейт ещё
+раз, а хендлеры вроде free_stats_follows (add_stats + set_test_day + уведомление
+админу) и premium_buy не идемпотентны.
+
+UpdateDedup — outer middleware на dp.update, самый первый из наших:
+- недавние update_id (в работе и обработанные) — ограниченное множество
+  в памяти, проверка O(1);
+- метка воркера в SQLite (update_marks): все апдейты с id <= метки уже
+  обработаны. Сохраняется раз в FLUSH_INTERVAL и при остановке; после
+  рестарта апдейты с id <= сохранённой метки отбрасываются. Во время работы
+  метка порог не двигает: вебхук может доставить апдейты не по порядку.
+
+Telegram начинает нумерацию заново (случайно), если апдейтов не было неделю:
+id намного меньше метки (больше RESET_WINDOW) считается новой последовательностью.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import db_async as adb
+from metrics import updates_duplicate
+
+FLUSH_INTERVAL = 1.0
+RESET_WINDOW = 100_000
+
+
+class UpdateDedup(BaseMiddleware):
+    def __init__(self, size: int = 10000, worker: int = 0) -> None:
+        self.size = size
+        self.worker = worker
+        self._recent: Deque[int] = deque()
+        self._recent_set: Set[int] = set()
+        self._in_flight: Set[int] = set()
+        self._max_seen = 0
+        self._mark = 0  # все апдейты с id <= _mark обработаны
+        self._saved = 0
+        self._floor = 0  # метка прошлого запуска
+        self._task: Optional[asyncio.Task] = None
+
+    def _remember(self, update_id: int) -> None:
+        if len(self._recent) >= self.size:
+            self._recent_set.discard(self._recent.popleft())
+        self._recent.append(update_id)
+        self._recent_set.add(update_id)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._recent_set:
+            return True
+        return self._floor - RESET_WINDOW < update_id <= self._floor
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id
+        if self.is_duplicate(update_id):
+            updates_duplicate.inc()
+            logging.info(f"Update {update_id} is a duplicate, skipped")
+            return None
+        if update_id <= max(self._floor, self._mark) - RESET_WINDOW:
+            logging.warning(f"update_id sequence restarted at {update_id} (mark was {self._mark})")
+            self._floor = self._mark = self._max_seen = update_id - 1
+
+        self._remember(update_id)
+        self._in_flight.add(update_id)
+        self._max_seen = max(self._max_seen, update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(update_id)
+
+    # -------------------- метка в БД --------------------
+
+    def _advance(self) -> int:
+        """Метка: всё до самого раннего апдейта в работе (или до последнего увиденного) обработано."""
+        done = min(self._in_flight) - 1 if self._in_flight else self._max_seen
+        if done > self._mark:
+            self._mark = done
+        return self._mark
+
+    async def flush(self) -> None:
+        mark = self._advance()
+        if mark != self._saved:
+            await adb.update_mark_save(self.worker, mark)
+            self._saved = mark
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Update mark flush failed")
+
+    async def start(self) -> None:
+        """dp.startup: поднимает метку с прошлого запуска."""
+        if self._task is not None:
+            return
+        self._floor = self._mark = self._saved = self._max_seen = await adb.update_mark_load(self.worker)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """dp.shutdown: дожидается фонового сброса и сохраняет метку до закрытия БД."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"recent": len(self._recent), "in_flight": len(self._in_flight), "mark": self._mark}
@@ -0,0 +1,77 @@
+"""
+Выгрузка данных админу (/export).
+
+Конвейер целиком работает в читающем потоке db_async:
+db.export_rows (fetchmany) -> csv/json построчно -> gzip во временный файл.
+В памяти одновременно не больше одной пачки строк; файл уходит в Telegram
+через FSInputFile, который тоже читается с диска кусками.
+"""
+import csv
+import gzip
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import db
+import db_async as adb
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# лимит Bot API на отправку документа
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+
+def write_export(
+    path: str,
+    table: str,
+    fmt: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    niche: Optional[str] = None,
+    batch_size: int = 1000,
+) -> int:
+    """Пишет выгрузку в gzip-файл path, возвращает число строк. Блокирующая: только вне event loop."""
+    rows = db.export_rows(table, since, until, niche, batch_size)
+    header = next(rows)
+    count = 0
+    # utf-8-sig: Excel без BOM показывает кириллицу в CSV кракозябрами
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+    with gzip.open(path, "wt", encoding=encoding, newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(header, row)), ensure_ascii=False))
+                f.write("\n")
+                count += 1
+    return count
+
+
+async def export_to_file(
+    table: str,
+    fmt: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    niche: Optional[str] = None,
+) -> Tuple[str, int]:
+    """(путь к временному .gz, число строк). Файл удаляет вызывающий."""
+    if table not in db.EXPORTS:
+        raise ValueError(f"Unknown export table: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    fd, path = tempfile.mkstemp(prefix=f"export-{table}-", suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        # выгрузка читает с диска: сначала сбрасываем отложенные write-behind записи
+        await adb.barrier()
+        count = await adb.run_in_reader(write_export, path, table, fmt, since, until, niche)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
@@ -0,0 +1,361 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов (aiohttp).
+
+- getUpdates (long polling) отдаёт апдейты из сценариев пользователей:
+  следующий апдейт пользователя выдаётся только после ответа бота
+  (сообщение в чат на сообщение, answerCallbackQuery на кнопку) и паузы
+  think_ms, как у живого человека; без ответа — через stall_s;
+- sendMessage / sendVideo / sendPhoto / sendDocument и прочие методы
+  принимаются и возвращают правдоподобный результат;
+- на send*-методы можно подмешать задержку, 429 RetryAfter и 5xx;
+- каждый вызов записывается: число по методам, время ответа бота на апдейт,
+  пиковая частота отправок (всего и в один чат) за секунду.
+
+Бот направляется сюда через TELEGRAM_API_URL (config.api_base_url).
+
+    python fakeapi.py --port 8081 --users 100 --latency-ms 30 --rate-429 0.01
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python bot.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from aiohttp import web
+
+SEND_METHODS = {"sendmessage", "sendvideo", "sendphoto", "senddocument"}
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class _User:
+    __slots__ = ("script", "released_at", "waiting", "callback")
+
+    def __init__(self, script: Iterable[Dict[str, Any]]) -> None:
+        self.script = iter(script)
+        self.released_at = 0.0
+        self.waiting = False
+        self.callback = False  # ждём answerCallbackQuery, а не сообщение
+
+
+class FakeBotApi:
+    def __init__(
+        self,
+        scripts: Dict[int, Iterable[Dict[str, Any]]],
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        rate_5xx: float = 0.0,
+        think_ms: float = 50.0,
+        stall_s: float = 5.0,
+        seed: int = 42,
+    ) -> None:
+        """scripts: user_id -> апдейты пользователя по порядку (dict без update_id)."""
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rate_5xx = rate_5xx
+        self.think_ms = think_ms
+        self.stall_s = stall_s
+        self._rnd = random.Random(seed)
+
+        self._users = {uid: _User(script) for uid, script in scripts.items()}
+        self._callbacks: Dict[str, int] = {}  # callback_query.id -> user_id
+        self._ready: Deque[Dict[str, Any]] = deque()
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.active = len(self._users)
+        self.finished = asyncio.Event()
+
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self.reply_latency: List[float] = []
+        self.stalled = 0
+        self._sends: Deque[float] = deque()
+        self._chat_sends: Dict[int, Deque[float]] = defaultdict(deque)
+        self.peak_rate = 0
+        self.peak_chat_rate = 0
+        self.started_at = time.monotonic()
+
+        self._runner: Optional[web.AppRunner] = None
+        self._stall_task: Optional[asyncio.Task] = None
+
+    # -------------------- сценарии --------------------
+
+    def _release(self, user_id: int) -> None:
+        user = self._users[user_id]
+        update = next(user.script, None)
+        if update is None:
+            user.waiting = False
+            self.active -= 1
+            if self.active == 0:
+                self.finished.set()
+            return
+        update = {"update_id": self._next_update_id, **update}
+        self._next_update_id += 1
+        user.callback = "callback_query" in update
+        if user.callback:
+            self._callbacks[update["callback_query"]["id"]] = user_id
+        user.released_at = time.monotonic()
+        user.waiting = True
+        self._ready.append(update)
+        self._new_updates.set()
+
+    def _replied(self, user_id: Optional[int], callback: bool) -> None:
+        user = self._users.get(user_id) if user_id is not None else None
+        if user is None or not user.waiting or user.callback != callback:
+            return
+        user.waiting = False
+        self.reply_latency.append(time.monotonic() - user.released_at)
+        if self.think_ms:
+            asyncio.get_running_loop().call_later(self.think_ms / 1000, self._release, user_id)
+        else:
+            self._release(user_id)
+
+    async def _stall_loop(self) -> None:
+        """Апдейт без ответа (ошибка хендлера, фильтр не сработал) не должен вешать пользователя."""
+        while True:
+            await asyncio.sleep(min(1.0, self.stall_s))
+            now = time.monotonic()
+            for user_id, user in self._users.items():
+                if user.waiting and now - user.released_at > self.stall_s:
+                    self.stalled += 1
+                    user.waiting = False
+                    self._release(user_id)
+
+    # -------------------- учёт отправок --------------------
+
+    def _record_send(self, chat_id: Optional[int]) -> None:
+        now = time.monotonic()
+        self._sends.append(now)
+        while self._sends and now - self._sends[0] > 1.0:
+            self._sends.popleft()
+        self.peak_rate = max(self.peak_rate, len(self._sends))
+        if chat_id is not None:
+            sends = self._chat_sends[chat_id]
+            sends.append(now)
+            while sends and now - sends[0] > 1.0:
+                sends.popleft()
+            self.peak_chat_rate = max(self.peak_chat_rate, len(sends))
+
+    # -------------------- методы API --------------------
+
+    def _message(self, chat_id: int, **content: Any) -> Dict[str, Any]:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **content,
+        }
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        chat_id = int(params["chat_id"]) if str(params.get("chat_id", "")).lstrip("-").isdigit() else 0
+        if method == "getme":
+            return BOT_USER
+        if method == "sendmessage":
+            return self._message(chat_id, text=params.get("text", ""))
+        if method == "sendvideo":
+            return self._message(chat_id, video={
+                "file_id": str(params.get("video")), "file_unique_id": "v", "width": 720, "height": 1280, "duration": 15,
+            })
+        if method == "sendphoto":
+            return self._message(chat_id, photo=[
+                {"file_id": str(params.get("photo")), "file_unique_id": "p", "width": 720, "height": 1280},
+            ])
+        if method == "senddocument":
+            return self._message(chat_id, document={"file_id": str(params.get("document")), "file_unique_id": "d"})
+        # answerCallbackQuery, deleteWebhook, setMyCommands и т.п.
+        return True
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # всё, что меньше offset, бот подтвердил
+        while self._ready and self._ready[0]["update_id"] < offset:
+            self._ready.popleft()
+        if not self._ready and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self._ready)[:limit]
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if method in SEND_METHODS:
+            delay = self.latency_ms + self._rnd.uniform(0, self.jitter_ms)
+            if delay:
+                await asyncio.sleep(delay / 1000)
+            roll = self._rnd.random()
+            if roll < self.rate_429:
+                self.injected["429"] += 1
+                return web.json_response(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after},
+                    },
+                    status=429,
+                )
+            if roll < self.rate_429 + self.rate_5xx:
+                self.injected["5xx"] += 1
+                return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+
+        result = self._result(method, params)
+        if method in SEND_METHODS:
+            chat_id = result["chat"]["id"]
+            self._record_send(chat_id)
+            self._replied(chat_id, callback=False)
+        elif method == "answercallbackquery":
+            self._replied(self._callbacks.pop(str(params.get("callback_query_id")), None), callback=True)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> Dict[str, Any]:
+        latency = sorted(self.reply_latency)
+        return {
+            "elapsed_s": round(time.monotonic() - self.started_at, 3),
+            "users_active": self.active,
+            "updates_served": self._next_update_id - 1,
+            "replies": len(latency),
+            "stalled": self.stalled,
+            "reply_ms": {
+                "p50": round(_percentile(latency, 0.5) * 1000, 2),
+                "p95": round(_percentile(latency, 0.95) * 1000, 2),
+                "p99": round(_percentile(latency, 0.99) * 1000, 2),
+            },
+            "calls": dict(self.calls),
+            "injected": dict(self.injected),
+            "peak_sends_per_s": self.peak_rate,
+            "peak_chat_sends_per_s": self.peak_chat_rate,
+        }
+
+    # -------------------- сервер --------------------
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        app.router.add_get("/bot{token}/{method}", self._handle)
+        app.router.add_get("/stats", self._stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> None:
+        self.started_at = time.monotonic()
+        for user_id in self._users:
+            self._release(user_id)
+        self._stall_task = asyncio.create_task(self._stall_loop())
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=host, port=port).start()
+        logging.info(f"Fake Bot API on http://{host}:{port} ({len(self._users)} scripted users)")
+
+    async def close(self) -> None:
+        if self._stall_task is not None:
+            self._stall_task.cancel()
+            self._stall_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def build_scripts(users: int, first_user_id: int, seed: int) -> Dict[int, List[Dict[str, Any]]]:
+    """Сценарии из bench.synthetic_user в виде JSON, как их отдаёт Telegram."""
+    from bench import FIRST_USER_ID, UpdateFactory, synthetic_user
+
+    first_user_id = first_user_id or FIRST_USER_ID
+    rnd = random.Random(seed)
+    factory = UpdateFactory()
+    scripts = {}
+    for uid in range(first_user_id, first_user_id + users):
+        updates = [
+            u.model_dump(mode="json", by_alias=True, exclude_none=True, exclude={"update_id"})
+            for u in synthetic_user(factory, uid, rnd)
+        ]
+        scripts[uid] = updates
+    return scripts
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    api = FakeBotApi(
+        build_scripts(args.users, args.first_user_id, args.seed),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        rate_5xx=args.rate_5xx,
+        think_ms=args.think_ms,
+        stall_s=args.stall_s,
+        seed=args.seed,
+    )
+    await api.start(args.host, args.port)
+    try:
+        await api.finished.wait()
+        logging.info("All scripted users finished")
+        await asyncio.Event().wait()  # оставляем сервер для /stats до Ctrl-C
+    finally:
+        print(json.dumps(api.stats(), ensure_ascii=False, indent=2))
+        await api.close()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--first-user-id", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every send*")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of send* answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="share of send* answered with 502")
+    # пауза "пользователя": хвостовые сообщения хендлера (их бывает два) не засчитываются
+    # ответом на следующий апдейт
+    parser.add_argument("--think-ms", type=float, default=50.0, help="user pause after the bot replies")
+    parser.add_argument("--stall-s", type=float, default=5.0, help="release the next update if the bot is silent")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
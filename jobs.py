@@ -0,0 +1,123 @@
+"""
+Очередь заданий free-теста: исходник пользователя -> готовое видео от админа.
+
+free_material ставит задание (пользователь, день, file_id исходника, описание)
+в таблицу jobs, админ получает исходник с подписью «Задание #N». Дальше:
+- /next — взять самое старое задание: бот присылает исходник и описание;
+- ответить (reply) готовым видео на сообщение с «Задание #N» — бот сам
+  доставляет его нужному пользователю и закрывает задание.
+
+Исходник, который уже был в каком-то задании (тот же file_unique_id), второй
+раз в очередь не попадает — пользователь сразу получает ответ.
+
+Взятое, но не сданное за CLAIM_TTL задание снова выдаётся по /next.
+Глубина очереди и возраст самого старого задания — gauge-метрики; счётчики
+обновляются сразу при изменениях и раз в REFRESH_INTERVAL из БД (задания
+ставят и закрывают все воркеры).
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import db_async as adb
+from metrics import job_turnaround_seconds
+
+JOB_QUEUED = "queued"
+JOB_CLAIMED = "claimed"
+JOB_DELIVERED = "delivered"
+
+CLAIM_TTL = 6 * 3600
+REFRESH_INTERVAL = 15.0
+
+JOB_REF_RE = re.compile(r"Задание #(\d+)")
+
+
+def job_caption(job_id: int) -> str:
+    return f"Задание #{job_id}"
+
+
+def job_ref(text: Optional[str]) -> Optional[int]:
+    """Номер задания из текста или подписи сообщения бота."""
+    match = JOB_REF_RE.search(text or "")
+    return int(match.group(1)) if match else None
+
+
+class JobQueue:
+    def __init__(self) -> None:
+        # статус -> (количество, самое раннее created_at)
+        self._stats: Dict[str, Tuple[int, Optional[int]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        self._stats = await adb.jobs_stats()
+
+    async def create(
+        self,
+        user_id: int,
+        day: int,
+        source_file_id: str,
+        description: Optional[str],
+        source_unique_id: Optional[str] = None,
+        source_size: Optional[int] = None,
+        source_duration: Optional[int] = None,
+    ) -> int:
+        job_id = await adb.job_create(
+            user_id, day, source_file_id, description, int(time.time()),
+            source_unique_id, source_size, source_duration,
+        )
+        await self.refresh()
+        return job_id
+
+    async def seen(self, source_unique_id: str, user_id: int) -> Optional[dict]:
+        """Задание с тем же исходником (file_unique_id): своё — own=True, чужое — own=False."""
+        return await adb.source_seen(source_unique_id, user_id)
+
+    async def claim(self) -> Optional[dict]:
+        now = int(time.time())
+        job = await adb.job_claim(now, now - CLAIM_TTL)
+        await self.refresh()
+        return job
+
+    async def get(self, job_id: int) -> Optional[dict]:
+        return await adb.job_get(job_id)
+
+    async def deliver(self, job: dict, result_file_id: str) -> bool:
+        now = int(time.time())
+        done = await adb.job_deliver(job["id"], result_file_id, now)
+        if done:
+            job_turnaround_seconds.observe(now - job["created_at"])
+        await self.refresh()
+        return done
+
+    async def open(self, limit: int = 10) -> List[dict]:
+        return await adb.jobs_open(limit)
+
+    def depth(self, status: str = JOB_QUEUED) -> int:
+        return self._stats.get(status, (0, None))[0]
+
+    def oldest_age(self) -> float:
+        """Сколько секунд ждёт самое старое несданное задание (0 — очередь пуста)."""
+        oldest = [created for _, created in self._stats.values() if created is not None]
+        return max(0.0, time.time() - min(oldest)) if oldest else 0.0
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception:
+                logging.exception("Job queue refresh failed")
+
+    async def start(self) -> None:
+        """dp.startup: счётчики из БД и периодическое обновление."""
+        if self._task is not None:
+            return
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -1,10 +1,61 @@
+import functools
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 PORTFOLIO_URL = "https://t.me/neurolux2025"
 
+# Клавиатуры зависят только от manager_username, поэтому строятся один раз
+# на каждое значение аргументов и переиспользуются (объекты aiogram frozen).
+# Для каждой сразу готов JSON — session.PreparedMarkupSession шлёт его как есть.
+
+_builders: List[Tuple[Callable, int]] = []
+_serialized: Dict[int, str] = {}
+
+
+def _prune(value: Any) -> Any:
+    # как BaseSession.prepare_value: None-поля в Bot API не отправляются
+    if isinstance(value, dict):
+        return {k: _prune(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_prune(v) for v in value if v is not None]
+    return value
+
+
+def _cached(builder: Callable[..., InlineKeyboardMarkup]) -> Callable[..., InlineKeyboardMarkup]:
+    @functools.lru_cache(maxsize=None)
+    def wrapper(*args: Any) -> InlineKeyboardMarkup:
+        markup = builder(*args)
+        _serialized[id(markup)] = json.dumps(_prune(markup.model_dump(warnings=False)), ensure_ascii=False)
+        return markup
+
+    functools.update_wrapper(wrapper, builder)
+    _builders.append((wrapper, builder.__code__.co_argcount))
+    return wrapper
+
+
+def serialized(markup: Any) -> Optional[str]:
+    """Готовый JSON для клавиатуры из кэша (None — клавиатура построена не здесь)."""
+    return _serialized.get(id(markup))
+
+
+def reset_cache() -> None:
+    for builder, _ in _builders:
+        builder.cache_clear()
+    _serialized.clear()
+
+
+def warm(manager_username: str) -> None:
+    """Строит все клавиатуры заранее; при смене MANAGER_USERNAME кэш сбрасывается."""
+    reset_cache()
+    for builder, argcount in _builders:
+        builder(*([manager_username] if argcount else []))
+
 def manager_url(username: str) -> str:
     return f"https://t.me/{username}"
 
+@_cached
 def main_menu(manager_username: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🎁 Бесплатный 3-дневный тест", callback_data="free:start")],
@@ -14,6 +65,7 @@ def main_menu(manager_username: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="👨‍💼 Менеджер", url=manager_url(manager_username))],
     ])
 
+@_cached
 def free_intro_kb(manager_username: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Начать тест", callback_data="free:begin")],
@@ -21,18 +73,21 @@ def free_intro_kb(manager_username: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")],
     ])
 
+@_cached
 def niche_kb() -> InlineKeyboardMarkup:
     opts = ["Эксперт", "Бизнес", "Товарка", "Блог", "Другое"]
     rows = [[InlineKeyboardButton(text=o, callback_data=f"free:niche:{o}")] for o in opts]
     rows.append([InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@_cached
 def goal_kb() -> InlineKeyboardMarkup:
     opts = ["Просмотры", "Подписчики", "Заявки"]
     rows = [[InlineKeyboardButton(text=o, callback_data=f"free:goal:{o}")] for o in opts]
     rows.append([InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@_cached
 def day_actions_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Я выложил (ввести ссылку)", callback_data="free:posted")],
@@ -40,12 +95,14 @@ def day_actions_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")],
     ])
 
+@_cached
 def after_posted_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📊 Ввести статистику", callback_data="free:stats")],
         [InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")],
     ])
 
+@_cached
 def after_test_kb(manager_username: str) -> InlineKeyboardMarkup:
     """
     ВАЖНО:
@@ -59,6 +116,7 @@ def after_test_kb(manager_username: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")],
     ])
 
+@_cached
 def premium_kb(manager_username: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Запросить подключение Premium", callback_data="premium:buy")],
@@ -66,6 +124,7 @@ def premium_kb(manager_username: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")],
     ])
 
+@_cached
 def lux_kb(manager_username: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Запросить Lux (анкета)", callback_data="lux:request")],
@@ -73,6 +132,7 @@ def lux_kb(manager_username: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🔙 В меню", callback_data="back:menu")],
     ])
 
+@_cached
 def manager_only_kb(manager_username: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="👨‍💼 Менеджер", url=manager_url(manager_username))],
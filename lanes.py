@@ -0,0 +1,71 @@
+"""
+Очередь апдейтов на пользователя.
+
+aiogram обрабатывает апдейты конкурентно, и два быстрых апдейта одного
+пользователя (двойное нажатие кнопки, два сообщения подряд) могли гоняться
+между get_test_day и set_test_day или между чтением FSM-состояния и его сменой.
+
+LaneMiddleware стоит на dp.update раньше FSM-middleware: апдейты одного
+пользователя проходят по одному в порядке поступления (asyncio.Lock отдаёт
+себя ожидающим по очереди), разные пользователи — параллельно.
+Очередь пользователя ограничена max_pending, лишние апдейты отбрасываются.
+Дорожка живёт, пока в ней есть апдейты, и удаляется сразу после последнего.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from metrics import lane_dropped, lane_wait_seconds
+
+
+class _Lane:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.pending = 0  # выполняется + ждут
+
+
+class LaneMiddleware(BaseMiddleware):
+    def __init__(self, max_pending: int = 20) -> None:
+        self.max_pending = max_pending
+        self._lanes: Dict[int, _Lane] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User = data.get("event_from_user")
+        if user is None or not self.max_pending:
+            return await handler(event, data)
+
+        lane = self._lanes.get(user.id)
+        if lane is None:
+            lane = self._lanes[user.id] = _Lane()
+        elif lane.pending >= self.max_pending:
+            lane_dropped.inc()
+            logging.warning(f"Lane of user {user.id} is full ({lane.pending}), update dropped")
+            return None
+
+        lane.pending += 1
+        try:
+            started = time.perf_counter()
+            async with lane.lock:
+                lane_wait_seconds.observe(time.perf_counter() - started)
+                return await handler(event, data)
+        finally:
+            lane.pending -= 1
+            if not lane.pending:
+                del self._lanes[user.id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "lanes": len(self._lanes),
+            "waiting": sum(lane.pending - 1 for lane in self._lanes.values()),
+        }
@@ -0,0 +1,155 @@
+"""
+Каталог медиа админа: готовые видео, фото и файлы, загруженные в Telegram один раз.
+
+Всё, что админ присылает боту (или отмечает /getid), попадает в таблицу media
+по file_unique_id: file_id, тип, размер, подпись и теги (#хэштеги из подписи).
+Файлу можно дать алиас (/alias) и дальше слать его по имени:
+/video <user_id> <алиас> — повторная отправка по file_id, без загрузки.
+
+Индекс целиком в памяти (файлов у админа сотни, не миллионы); SQLite —
+write-through, индекс поднимается на dp.startup.
+"""
+import itertools
+import re
+import time
+from typing import Dict, List, Optional
+
+from aiogram.types import Message
+
+import db_async as adb
+
+KIND_TITLES = {"video": "🎥", "photo": "🖼", "document": "📄"}
+
+# алиас не может быть числом — иначе его не отличить от user_id в командах
+ALIAS_RE = re.compile(r"^(?!\d+$)[\w-]{1,32}$")
+
+_HASHTAG_RE = re.compile(r"#(\w+)")
+
+
+class MediaItem:
+    __slots__ = ("file_unique_id", "file_id", "kind", "file_size", "caption", "tags", "alias", "updated_at")
+
+    def __init__(
+        self,
+        file_unique_id: str,
+        file_id: str,
+        kind: str,
+        file_size: Optional[int] = None,
+        caption: Optional[str] = None,
+        tags: str = "",
+        alias: Optional[str] = None,
+        updated_at: int = 0,
+    ) -> None:
+        self.file_unique_id = file_unique_id
+        self.file_id = file_id
+        self.kind = kind
+        self.file_size = file_size
+        self.caption = caption
+        self.tags = tags
+        self.alias = alias
+        self.updated_at = updated_at
+
+    def title(self) -> str:
+        name = self.alias or self.file_unique_id
+        size = f" {self.file_size / 1024 / 1024:.1f} MB" if self.file_size else ""
+        caption = f" — {self.caption[:40]}" if self.caption else ""
+        tags = f" [{self.tags}]" if self.tags else ""
+        return f"{KIND_TITLES.get(self.kind, '')} {name}{size}{caption}{tags}"
+
+
+def message_media(m: Message) -> Optional[MediaItem]:
+    """Медиа из сообщения (видео, файл или самое большое фото) или None."""
+    if m.video:
+        f, kind = m.video, "video"
+    elif m.document:
+        f, kind = m.document, "document"
+    elif m.photo:
+        f, kind = m.photo[-1], "photo"
+    else:
+        return None
+    caption = (m.caption or "").strip() or None
+    tags = " ".join(t.lower() for t in _HASHTAG_RE.findall(caption or ""))
+    return MediaItem(f.file_unique_id, f.file_id, kind, f.file_size, caption, tags)
+
+
+class MediaCatalog:
+    def __init__(self) -> None:
+        # порядок = давность: свежие в конце
+        self._items: Dict[str, MediaItem] = {}
+        self._aliases: Dict[str, str] = {}
+        self._last: Dict[str, str] = {}
+
+    def _index(self, item: MediaItem) -> None:
+        self._items.pop(item.file_unique_id, None)
+        self._items[item.file_unique_id] = item
+        if item.alias:
+            self._aliases[item.alias] = item.file_unique_id
+        self._last[item.kind] = item.file_unique_id
+
+    async def load(self) -> None:
+        """dp.startup: индекс из БД (по возрастанию updated_at — последний каждого типа будет LAST)."""
+        self._items.clear()
+        self._aliases.clear()
+        self._last.clear()
+        for row in await adb.media_all():
+            self._index(MediaItem(**row))
+
+    async def add(self, item: MediaItem) -> MediaItem:
+        """Сохраняет медиа и делает его LAST своего типа; повтор того же файла обновляет запись."""
+        known = self._items.get(item.file_unique_id)
+        if known is not None:
+            item.alias = known.alias
+            item.file_size = item.file_size or known.file_size
+            item.caption = item.caption or known.caption
+            item.tags = item.tags or known.tags
+        item.updated_at = int(time.time())
+        await adb.media_save(
+            item.file_unique_id, item.file_id, item.kind, item.file_size, item.caption, item.tags, item.updated_at
+        )
+        self._index(item)
+        return item
+
+    def get(self, ref: str) -> Optional[MediaItem]:
+        """По алиасу или file_unique_id."""
+        uid = self._aliases.get(ref, ref)
+        return self._items.get(uid)
+
+    def last(self, kind: str) -> Optional[MediaItem]:
+        uid = self._last.get(kind)
+        return self._items.get(uid) if uid else None
+
+    def latest(self) -> Optional[MediaItem]:
+        return next(reversed(self._items.values()), None)
+
+    def resolve(self, ref: str, kind: str) -> Optional[str]:
+        """file_id для отправки: алиас/file_unique_id из каталога, иначе сам ref (это file_id). None — другой тип."""
+        item = self.get(ref)
+        if item is None:
+            return ref
+        return item.file_id if item.kind == kind else None
+
+    async def set_alias(self, item: MediaItem, alias: str) -> None:
+        previous = self.get(alias)
+        if previous is not None and previous is not item and previous.alias == alias:
+            previous.alias = None
+        if item.alias:
+            self._aliases.pop(item.alias, None)
+        item.alias = alias
+        self._aliases[alias] = item.file_unique_id
+        await adb.media_set_alias(item.file_unique_id, alias)
+
+    def recent(self, kind: Optional[str] = None, limit: int = 10) -> List[MediaItem]:
+        items = (i for i in reversed(self._items.values()) if kind is None or i.kind == kind)
+        return list(itertools.islice(items, limit))
+
+    def search(self, query: str, limit: int = 10) -> List[MediaItem]:
+        """Подстрока в алиасе, подписи или тегах, свежие первыми."""
+        q = query.casefold().lstrip("#")
+        found = (
+            i for i in reversed(self._items.values())
+            if q in (i.alias or "").casefold() or q in (i.caption or "").casefold() or q in i.tags
+        )
+        return list(itertools.islice(found, limit))
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,348 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+- MetricsMiddleware (outer на dp.update): время обработки апдейта по хендлеру
+  и маршруту (callback_data / команда / FSM-состояние), ошибки хендлеров,
+  время ожидания БД и Telegram API внутри апдейта;
+- RouteMiddleware (inner на message/callback_query): узнаёт, какой хендлер сработал;
+- ApiTimingMiddleware (request-middleware сессии): длительность каждого HTTP-запроса к API;
+- gauge-функции: глубина очередей, кэши и т.п. считаются в момент чтения.
+
+Отдаётся на METRICS_HOST:METRICS_PORT/metrics, сводка — командой /metrics.
+Без внешних зависимостей: ContextVar + словари счётчиков.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.filters import Command
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _render_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_render_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по бакетам (не кумулятивные) + "+Inf", сумма]
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        record = self.values.get(labels)
+        if record is None:
+            record = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = record
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        total[0] += value
+
+    def count(self, *labels: str) -> int:
+        record = self.values.get(labels)
+        return sum(record[0]) if record else 0
+
+    def mean(self, *labels: str) -> float:
+        record = self.values.get(labels)
+        n = sum(record[0]) if record else 0
+        return record[1][0] / n if n else 0.0
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """Оценка квантиля по бакетам (линейно внутри бакета), как histogram_quantile."""
+        record = self.values.get(labels)
+        if not record:
+            return 0.0
+        counts = record[0]
+        rank = q * sum(counts)
+        seen, lower = 0, 0.0
+        for i, bound in enumerate(self.buckets):
+            if counts[i] and seen + counts[i] >= rank:
+                return lower + (bound - lower) * (rank - seen) / counts[i]
+            seen += counts[i]
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _render_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_render_labels(self.labelnames, labels)} {total[0]:.6f}")
+            lines.append(f"{self.name}_count{_render_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Значение считается функцией в момент отдачи метрик."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        self.name, self.help, self.fn = name, help, fn
+
+    def value(self) -> float:
+        try:
+            return float(self.fn())
+        except Exception:
+            return float("nan")
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value():g}"]
+
+
+# -------------------- реестр --------------------
+
+update_seconds = Histogram("bot_update_seconds", "Update handling time", ("handler", "route"))
+update_db_seconds = Histogram("bot_update_db_seconds", "Time an update waited for the DB", ("handler",))
+update_api_seconds = Histogram("bot_update_api_seconds", "Time an update waited for Telegram API", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by handlers", ("handler", "error"))
+api_seconds = Histogram("bot_api_request_seconds", "Telegram API request time", ("method",))
+api_errors = Counter("bot_api_errors_total", "Failed Telegram API requests", ("method", "error"))
+lane_wait_seconds = Histogram("bot_lane_wait_seconds", "Time an update waited for earlier updates of the same user")
+lane_dropped = Counter("bot_lane_dropped_total", "Updates dropped because the user's lane was full")
+updates_duplicate = Counter("bot_updates_duplicate_total", "Updates skipped as already processed")
+throttled = Counter("bot_throttled_total", "Updates dropped by the per-user flood limit", ("group",))
+material_duplicate = Counter(
+    "bot_material_duplicate_total", "Free test sources rejected as already submitted", ("scope",)
+)
+job_turnaround_seconds = Histogram(
+    "bot_job_turnaround_seconds",
+    "Time from a free test submission to the finished video delivered",
+    buckets=(300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600, 48 * 3600),
+)
+
+_metrics: List[Any] = [
+    update_seconds,
+    update_db_seconds,
+    update_api_seconds,
+    handler_errors,
+    api_seconds,
+    api_errors,
+    lane_wait_seconds,
+    lane_dropped,
+    updates_duplicate,
+    throttled,
+    material_duplicate,
+    job_turnaround_seconds,
+]
+gauges: Dict[str, Gauge] = {}
+
+
+def gauge(name: str, help: str, fn: Callable[[], float]) -> None:
+    gauges[name] = Gauge(name, help, fn)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics + list(gauges.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------- время внутри апдейта --------------------
+
+class UpdateTiming:
+    __slots__ = ("handler", "route", "db", "api")
+
+    def __init__(self) -> None:
+        self.handler = "unhandled"
+        self.route = "-"
+        self.db = 0.0
+        self.api = 0.0
+
+
+# апдейт, который обрабатывается в текущей задаче (None — фоновые задачи)
+current_update: ContextVar[Optional[UpdateTiming]] = ContextVar("current_update", default=None)
+
+
+def add_db_time(seconds: float) -> None:
+    timing = current_update.get()
+    if timing is not None:
+        timing.db += seconds
+
+
+def _handler_commands(handler_object: Optional[HandlerObject]) -> Tuple[str, ...]:
+    """Команды из фильтров Command(...) хендлера."""
+    commands: List[str] = []
+    for event_filter in (handler_object.filters or ()) if handler_object else ():
+        if isinstance(event_filter.callback, Command):
+            commands.extend(c for c in event_filter.callback.commands if isinstance(c, str))
+    return tuple(commands)
+
+
+def _route(event: TelegramObject, data: Dict[str, Any]) -> str:
+    """
+    Маршрут с ограниченным числом значений: префикс callback_data, команда или
+    FSM-состояние. Команда берётся, только если её объявил сработавший хендлер:
+    произвольный "/что-угодно" (его ловит fsm_fallback) — это "other", иначе
+    любой пользователь наплодит сколько угодно серий гистограммы.
+    """
+    if isinstance(event, CallbackQuery) and event.data:
+        return ":".join(event.data.split(":")[:2])
+    if isinstance(event, Message) and event.text and event.text.startswith("/"):
+        command = event.text.split(maxsplit=1)[0].split("@")[0][1:]
+        return f"/{command}" if command in _handler_commands(data.get("handler")) else "other"
+    return data.get("raw_state") or "-"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        timing = UpdateTiming()
+        token = current_update.set(timing)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(timing.handler, type(e).__name__)
+            raise
+        finally:
+            current_update.reset(token)
+            update_seconds.observe(time.perf_counter() - started, timing.handler, timing.route)
+            update_db_seconds.observe(timing.db, timing.handler)
+            update_api_seconds.observe(timing.api, timing.handler)
+
+
+class RouteMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        timing = current_update.get()
+        handler_object: Optional[HandlerObject] = data.get("handler")
+        if timing is not None and handler_object is not None:
+            timing.handler = getattr(handler_object.callback, "__name__", "handler")
+            timing.route = _route(event, data)
+        return await handler(event, data)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Регистрировать после OutboundMiddleware: меряет сам HTTP-запрос, без ожидания лимитов."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_errors.inc(method.__api_method__, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            api_seconds.observe(elapsed, method.__api_method__)
+            timing = current_update.get()
+            if timing is not None:
+                timing.api += elapsed
+
+
+# -------------------- отдача --------------------
+
+def summary(limit: int = 15) -> str:
+    """Текст для /metrics: самые частые маршруты, ошибки, очереди."""
+    rows = sorted(update_seconds.values, key=lambda labels: -update_seconds.count(*labels))[:limit]
+    lines = ["📈 Метрики (с запуска)", "", "хендлер [маршрут]: n, p50/p95 мс, БД/API мс в среднем"]
+    for handler, route in rows:
+        lines.append(
+            f"{handler} [{route}]: {update_seconds.count(handler, route)}, "
+            f"{update_seconds.quantile(0.5, handler, route) * 1000:.0f}/"
+            f"{update_seconds.quantile(0.95, handler, route) * 1000:.0f}, "
+            f"{update_db_seconds.mean(handler) * 1000:.1f}/{update_api_seconds.mean(handler) * 1000:.1f}"
+        )
+    if not rows:
+        lines.append("— апдейтов ещё не было")
+
+    if handler_errors.values:
+        lines += ["", "Ошибки:"]
+        lines += [f"{h} {err}: {n:g}" for (h, err), n in sorted(handler_errors.values.items())]
+    if api_errors.values:
+        lines += ["", "Ошибки API:"]
+        lines += [f"{m} {err}: {n:g}" for (m, err), n in sorted(api_errors.values.items())]
+
+    if gauges:
+        lines += [""]
+        lines += [f"{g.name}: {g.value():g}" for g in gauges.values()]
+    return "\n".join(lines)
+
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+class MetricsServer:
+    """Отдельный aiohttp-сервер с /metrics (dp.startup / dp.shutdown)."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108) -> None:
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        if self._runner is not None or not self.port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", _handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        logging.info(f"Metrics: http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,270 @@
+"""
+Исходящие сообщения: лимиты Telegram, приоритеты, ретраи, очередь для админа.
+
+- RateLimiter: глобальный token bucket (~30 msg/s) + bucket на каждый чат (~1 msg/s).
+  Ожидающие с более высоким приоритетом проходят первыми.
+- OutboundMiddleware: request-middleware сессии бота. Через него идут ВСЕ
+  вызовы с chat_id (в том числе m.answer в хендлерах): ждёт токены,
+  повторяет запрос на RetryAfter (429) и 5xx с backoff.
+- Outbox: фоновая очередь уведомлений админу. Хендлер ставит сообщение
+  и сразу отвечает пользователю; очередь хранится в SQLite (таблица outbox),
+  поэтому неотправленное переживает рестарт.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+import db_async as adb
+
+PRIORITY_USER = 0   # ответы пользователю в хендлерах
+PRIORITY_ADMIN = 1  # уведомления админу
+PRIORITY_BULK = 2   # массовые рассылки
+
+# приоритет текущей задачи; по умолчанию — ответ пользователю
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_USER)
+
+OUTBOX_METHODS = {"send_message", "send_video", "send_photo", "send_document"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже есть)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_chats: int = 10000,
+        chat_limits: Optional[Dict[int, Tuple[float, float]]] = None,
+    ) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        # свои (rate, burst) для отдельных чатов — например, админа, которому пишут все воркеры
+        self.chat_limits = dict(chat_limits or {})
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # сколько задач каждого приоритета упёрлись в глобальный лимит
+        self._global_waiters: Dict[int, int] = {PRIORITY_USER: 0, PRIORITY_ADMIN: 0, PRIORITY_BULK: 0}
+
+    def _chat(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(*self.chat_limits.get(chat_id, (self.chat_rate, self.chat_burst)))
+            self._chats[chat_id] = bucket
+            # давно не использованный bucket уже полон — его можно забыть
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _higher_priority_waiting(self, priority: int) -> bool:
+        return any(n for p, n in self._global_waiters.items() if p < priority)
+
+    async def acquire(self, chat_id: int, priority: int = PRIORITY_USER) -> None:
+        waiting_global = False
+        try:
+            while True:
+                now = time.monotonic()
+                chat = self._chat(chat_id)
+                chat_wait = chat.delay(now)
+                global_wait = self.global_bucket.delay(now)
+
+                if self._higher_priority_waiting(priority):
+                    global_wait = max(global_wait, 1 / self.global_bucket.rate)
+
+                if chat_wait <= 0 and global_wait <= 0:
+                    chat.take()
+                    self.global_bucket.take()
+                    return
+
+                if global_wait > 0 and not waiting_global:
+                    waiting_global = True
+                    self._global_waiters[priority] = self._global_waiters.get(priority, 0) + 1
+                await asyncio.sleep(max(chat_wait, global_wait))
+        finally:
+            if waiting_global:
+                self._global_waiters[priority] -= 1
+
+    def block(self, chat_id: Optional[int], seconds: float) -> None:
+        """RetryAfter: не слать в этот чат (или вообще, если чат неизвестен) seconds секунд."""
+        if chat_id is None:
+            self.global_bucket.block(seconds)
+        else:
+            self._chat(chat_id).block(seconds)
+
+    def waiting(self) -> int:
+        return sum(self._global_waiters.values())
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    def __init__(self, limiter: RateLimiter, max_retries: int = 5, base_backoff: float = 0.5) -> None:
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.retries = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            return await make_request(bot, method)
+
+        priority = outbound_priority.get()
+        attempt = 0
+        while True:
+            await self.limiter.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.limiter.block(chat_id, e.retry_after)
+                logging.warning(f"RetryAfter {e.retry_after}s for chat {chat_id} ({method.__api_method__})")
+            except TelegramServerError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.base_backoff * (2 ** attempt) * (1 + random.random())
+                logging.warning(f"Telegram {type(e).__name__}, retry in {delay:.1f}s ({method.__api_method__})")
+                await asyncio.sleep(delay)
+            attempt += 1
+            self.retries += 1
+
+
+class Outbox:
+    """Фоновая очередь уведомлений: ставится мгновенно, хранится в SQLite до доставки."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        max_attempts: int = 5,
+        base_backoff: float = 1.0,
+        owner: int = 0,
+        owners: int = 1,
+    ) -> None:
+        self.bot = bot
+        # номер воркера и число воркеров: после рестарта поднимаем только свои строки
+        self.owner = owner
+        self.owners = owners
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self._queue: "asyncio.PriorityQueue[tuple]" = asyncio.PriorityQueue()
+        self._seq = 0
+        self._worker: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.failed = 0
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _put(self, priority: int, key: str, method: str, params: Dict[str, Any]) -> None:
+        self._seq += 1
+        self._queue.put_nowait((priority, self._seq, key, method, params))
+
+    async def enqueue(self, method: str, priority: int = PRIORITY_ADMIN, **params: Any) -> None:
+        if method not in OUTBOX_METHODS:
+            raise ValueError(f"Outbox does not support {method}")
+        key = uuid.uuid4().hex
+        await adb.outbox_add(key, method, priority, json.dumps(params, ensure_ascii=False), self.owner)
+        self._put(priority, key, method, params)
+
+    async def send_message(self, chat_id: int, text: str, **params: Any) -> None:
+        await self.enqueue("send_message", chat_id=chat_id, text=text, **params)
+
+    async def send_video(self, chat_id: int, video: str, **params: Any) -> None:
+        await self.enqueue("send_video", chat_id=chat_id, video=video, **params)
+
+    async def start(self) -> None:
+        """Поднимает неотправленное с прошлого запуска и запускает воркер (dp.startup)."""
+        if self._worker is not None:
+            return
+        # всё, что успели поставить до старта, уже лежит в БД — она источник истины
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        pending = await adb.outbox_pending(self.owner, self.owners)
+        for key, method, priority, payload in pending:
+            self._put(priority, key, method, json.loads(payload))
+        if pending:
+            logging.info(f"Outbox: restored {len(pending)} queued messages")
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Останавливает воркер; недоставленное остаётся в БД до следующего запуска."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            priority, _, key, method, params = await self._queue.get()
+            outbound_priority.set(priority)
+            try:
+                await self._deliver(key, method, params)
+            except Exception as e:
+                # воркер один на процесс: его падение остановило бы все уведомления админу
+                logging.exception(f"Outbox {method} {key} failed: {e}")
+
+    async def _deliver(self, key: str, method: str, params: Dict[str, Any]) -> None:
+        for attempt in range(self.max_attempts):
+            try:
+                await getattr(self.bot, method)(**params)
+                self.sent += 1
+                break
+            except (TelegramNetworkError, TelegramServerError, TelegramRetryAfter) as e:
+                delay = self.base_backoff * (2 ** attempt)
+                logging.warning(f"Outbox {method} failed ({type(e).__name__}), retry in {delay:.0f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logging.exception(f"Outbox {method} dropped: {e}")
+                self.failed += 1
+                break
+        else:
+            logging.error(f"Outbox {method} dropped after {self.max_attempts} attempts")
+            self.failed += 1
+
+        await adb.outbox_done(key)
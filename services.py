@@ -1,6 +1,150 @@
-from typing import List, Tuple
+"""
+Отчёт по free-тесту.
 
-def make_test_report(stats_rows: List[Tuple]) -> str:
+Результат теста сравнивается с другими завершёнными тестами той же ниши
+и цели: для каждой когорты держим отсортированные array('d') по четырём
+метрикам, перцентиль считается bisect'ом за O(log n). Распределения
+строятся один раз при старте (CohortIndex.rebuild) и дополняются по мере
+завершения тестов (CohortIndex.observe), поэтому отчёт не ходит в stats.
+"""
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# метрики теста: средние просмотры на видео и доли лайков/комментариев/подписок от просмотров
+METRICS = ("views", "likes_rate", "comments_rate", "follows_rate")
+METRIC_TITLES = {
+    "views": "Просмотры",
+    "likes_rate": "Лайки / просмотры",
+    "comments_rate": "Комментарии / просмотры",
+    "follows_rate": "Подписки / просмотры",
+}
+
+# меньше тестов в когорте — сравнение ненадёжно, берём когорту шире
+MIN_COHORT_SIZE = 20
+
+SCOPE_TITLES = {
+    "niche_goal": "та же ниша и цель",
+    "niche": "та же ниша",
+    "all": "все тесты",
+}
+
+CohortKey = Tuple[Optional[str], Optional[str]]
+
+
+class CohortStanding(NamedTuple):
+    scope: str
+    size: int
+    percentiles: Tuple[float, ...]  # в порядке METRICS, 0..100
+
+
+def _norm(value: Optional[str]) -> Optional[str]:
+    value = (value or "").strip().lower()
+    return value or None
+
+
+def test_metrics(videos: int, views: int, likes: int, comments: int, follows: int) -> Tuple[float, ...]:
+    views = views or 0
+
+    def rate(x: Optional[int]) -> float:
+        return (x or 0) / views if views else 0.0
+
+    return (views / max(1, videos), rate(likes), rate(comments), rate(follows))
+
+
+def metrics_from_rows(stats_rows: Sequence[Tuple]) -> Tuple[float, ...]:
+    """stats_rows — строки get_stats_for_last_test: (day, post_link, views, likes, comments, follows)."""
+    totals = [sum(int(r[i] or 0) for r in stats_rows) for i in (2, 3, 4, 5)]
+    return test_metrics(len(stats_rows), *totals)
+
+
+class _Distribution:
+    __slots__ = ("columns",)
+
+    def __init__(self, columns: Optional[List[array]] = None) -> None:
+        self.columns = columns or [array("d") for _ in METRICS]
+
+    def __len__(self) -> int:
+        return len(self.columns[0])
+
+    def add(self, metrics: Sequence[float]) -> None:
+        for column, value in zip(self.columns, metrics):
+            insort(column, value)
+
+    def percentiles(self, metrics: Sequence[float]) -> Tuple[float, ...]:
+        n = len(self)
+        # mid-rank: равные значения делят позицию пополам
+        return tuple(
+            (bisect_left(column, value) + bisect_right(column, value)) * 50.0 / n
+            for column, value in zip(self.columns, metrics)
+        )
+
+
+class CohortIndex:
+    def __init__(self, min_size: int = MIN_COHORT_SIZE) -> None:
+        self.min_size = max(1, min_size)
+        self._dists: Dict[CohortKey, _Distribution] = {}
+
+    @staticmethod
+    def _keys(niche: Optional[str], goal: Optional[str]) -> List[Tuple[str, CohortKey]]:
+        niche, goal = _norm(niche), _norm(goal)
+        return [("niche_goal", (niche, goal)), ("niche", (niche, None)), ("all", (None, None))]
+
+    def rebuild(self, totals: Iterable[Tuple]) -> int:
+        """totals — строки db.completed_test_totals(): (niche, goal, days, views, likes, comments, follows)."""
+        raw: Dict[CohortKey, List[List[float]]] = {}
+        count = 0
+        for niche, goal, days, views, likes, comments, follows in totals:
+            metrics = test_metrics(days, views, likes, comments, follows)
+            for _, key in self._keys(niche, goal):
+                columns = raw.get(key)
+                if columns is None:
+                    columns = raw[key] = [[] for _ in METRICS]
+                for column, value in zip(columns, metrics):
+                    column.append(value)
+            count += 1
+
+        # собираем новое состояние целиком и подменяем одной ссылкой
+        self._dists = {
+            key: _Distribution([array("d", sorted(column)) for column in columns])
+            for key, columns in raw.items()
+        }
+        return count
+
+    def observe(self, niche: Optional[str], goal: Optional[str], metrics: Sequence[float]) -> None:
+        for _, key in self._keys(niche, goal):
+            dist = self._dists.get(key)
+            if dist is None:
+                dist = self._dists[key] = _Distribution()
+            dist.add(metrics)
+
+    def rank(self, niche: Optional[str], goal: Optional[str], metrics: Sequence[float]) -> Optional[CohortStanding]:
+        """Самая узкая когорта, где хватает тестов для сравнения; None — сравнивать не с чем."""
+        for scope, key in self._keys(niche, goal):
+            dist = self._dists.get(key)
+            if dist is not None and len(dist) >= self.min_size:
+                return CohortStanding(scope, len(dist), dist.percentiles(metrics))
+        return None
+
+    def stats(self) -> dict:
+        total = self._dists.get((None, None))
+        return {"cohorts": len(self._dists), "tests": len(total) if total else 0}
+
+
+def _verdict(avg_views: float, standing: Optional[CohortStanding]) -> str:
+    if standing is not None:
+        strong, normal = standing.percentiles[0] >= 75, standing.percentiles[0] >= 40
+    else:
+        strong, normal = avg_views >= 10000, avg_views >= 2000
+
+    if strong:
+        return "Формат выглядит сильным. Имеет смысл масштабировать серией."
+    if normal:
+        return "Формат нормальный. Нужны вариации хуков и продолжение серии."
+    return "Слабые сигналы. Нужны правки хуков/темпа и серия тестов."
+
+
+def make_test_report(stats_rows: List[Tuple], standing: Optional[CohortStanding] = None) -> str:
     if not stats_rows:
         return "Статистика не найдена. Введи данные по 1–3 дням."
 
@@ -11,17 +155,19 @@ def make_test_report(stats_rows: List[Tuple]) -> str:
     best_day = stats_rows[best_idx][0]
     best_views = views[best_idx]
 
-    if avg_views >= 10000:
-        verdict = "Формат выглядит сильным. Имеет смысл масштабировать серией."
-    elif avg_views >= 2000:
-        verdict = "Формат нормальный. Нужны вариации хуков и продолжение серии."
-    else:
-        verdict = "Слабые сигналы. Нужны правки хуков/темпа и серия тестов."
-
-    return (
+    report = (
         f"📊 *Отчёт по 3-дневному тесту*\n\n"
         f"• Видео: {len(views)}\n"
         f"• Средние просмотры: *{int(avg_views)}*\n"
         f"• Лучший день: *{best_day}* (просмотры: *{best_views}*)\n\n"
-        f"Вывод: {verdict}"
     )
+
+    if standing is not None:
+        metrics = metrics_from_rows(stats_rows)
+        report += f"*Сравнение* ({SCOPE_TITLES[standing.scope]}, тестов: {standing.size}):\n"
+        for name, value, pct in zip(METRICS, metrics, standing.percentiles):
+            shown = f"{int(value)}" if name == "views" else f"{value * 100:.1f}%"
+            report += f"• {METRIC_TITLES[name]}: {shown} — лучше, чем у *{int(pct)}%*\n"
+        report += "\n"
+
+    return report + f"Вывод: {_verdict(avg_views, standing)}"
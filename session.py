@@ -0,0 +1,40 @@
+"""
+HTTP-сессия бота.
+
+PreparedMarkupSession — AiohttpSession, которая для клавиатур из keyboards.py
+не сериализует reply_markup заново на каждый запрос, а подставляет
+готовый JSON, построенный один раз при старте.
+"""
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+from aiohttp import FormData
+
+import keyboards as kb
+
+
+class PreparedMarkupSession(AiohttpSession):
+    def build_form_data(self, bot: Bot, method: TelegramMethod[TelegramType]) -> FormData:
+        prepared = kb.serialized(getattr(method, "reply_markup", None))
+        if prepared is None:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", prepared)
+        for key, value in files.items():
+            form.add_field(
+                key,
+                value.read(bot),
+                filename=value.filename or key,
+            )
+        return form
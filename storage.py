@@ -0,0 +1,156 @@
+"""
+FSM storage для aiogram поверх той же SQLite-базы.
+
+Два уровня:
+- память: LRU ограниченного размера с TTL — горячие сессии отвечают без БД;
+- SQLite (таблица fsm_states): write-through на каждое изменение,
+  поэтому деплой не теряет пользователей посреди теста.
+
+Брошенные сессии (нет изменений дольше session_ttl) удаляются из БД
+фоновой задачей, из памяти — по TTL/LRU.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import db_async as adb
+
+
+def _encode_key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        )
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        cache_size: int = 10000,
+        cache_ttl: float = 1800,
+        session_ttl: float = 7 * 24 * 3600,
+        purge_interval: float = 3600,
+    ) -> None:
+        self.cache_size = max(1, cache_size)
+        self.cache_ttl = cache_ttl
+        self.session_ttl = session_ttl
+        self.purge_interval = purge_interval
+
+        # key -> (state, data, touched_at); порядок = LRU (свежие в конце)
+        self._cache: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any], float]]" = OrderedDict()
+        self._purge_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    # -------------------- memory tier --------------------
+
+    def _evict_expired(self, now: float) -> None:
+        while self._cache:
+            _, (_, _, touched_at) = next(iter(self._cache.items()))
+            if now - touched_at < self.cache_ttl:
+                break
+            self._cache.popitem(last=False)
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        self._cache[key] = (state, data, now)
+        self._cache.move_to_end(key)
+        self._evict_expired(now)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        record = self._cache.get(key)
+        if record is not None and time.monotonic() - record[2] < self.cache_ttl:
+            self.hits += 1
+            state, data, _ = record
+            self._remember(key, state, data)
+            return state, data
+
+        self.misses += 1
+        row = await adb.fsm_load(key)
+        state, data = None, {}
+        if row is not None:
+            state = row[0]
+            data = json.loads(row[1]) if row[1] else {}
+
+        # отсутствие записи тоже кэшируем: get_state зовётся на каждый апдейт
+        self._remember(key, state, data)
+        return state, data
+
+    async def _save(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        self._remember(key, state, data)
+        data_json = json.dumps(data, ensure_ascii=False) if data else None
+        await adb.fsm_save(key, state, data_json, int(time.time()))
+
+    # -------------------- BaseStorage --------------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _encode_key(key)
+        _, data = await self._load(k)
+        await self._save(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(_encode_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = _encode_key(key)
+        state, _ = await self._load(k)
+        await self._save(k, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(_encode_key(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+        self._cache.clear()
+
+    # -------------------- expiry --------------------
+
+    async def start(self) -> None:
+        """Запускает фоновую очистку брошенных сессий (dp.startup)."""
+        if self._purge_task is None:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def purge_expired(self) -> int:
+        return await adb.fsm_purge(int(time.time() - self.session_ttl))
+
+    async def _purge_loop(self) -> None:
+        while True:
+            try:
+                removed = await self.purge_expired()
+                if removed:
+                    logging.info(f"FSM storage: purged {removed} abandoned sessions")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(f"FSM purge error: {e}")
+            await asyncio.sleep(self.purge_interval)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "capacity": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
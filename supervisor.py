@@ -0,0 +1,291 @@
+"""
+Несколько процессов-воркеров за одним входом апдейтов.
+
+Супервизор сам получает апдейты (long polling getUpdates или публичный
+вебхук) и раздаёт их воркерам по consistent hashing от user id:
+все апдейты пользователя идут в один и тот же процесс и в порядке
+поступления, поэтому кэши FSM и снимков теста в памяти воркера остаются
+верными. Воркер — обычный bot.py в webhook-режиме на 127.0.0.1:WORKER_BASE_PORT+i
+(вебхук в Telegram не регистрирует, принимает апдейты только с внутренним секретом).
+
+SQLite: у каждого воркера свой писатель; WAL + busy_timeout (DB_BUSY_TIMEOUT_MS)
+и повтор операции писателя при "database is locked" (db_async).
+Outbox и рассылки принадлежат воркеру, который их создал (колонка owner).
+
+Лимиты Telegram общие на токен: воркер берёт 1/WORKERS от OUT_GLOBAL_RATE
+и от OUT_CHAT_RATE для чата админа (bot.create_bot). Доли статичны:
+простаивающий воркер свою долю не отдаёт, поэтому суммарно воркеры шлют
+не быстрее, а при перекосе нагрузки — медленнее одного процесса.
+
+Упавший воркер перезапускается; апдейты для него ждут в его очереди.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+from config import Config
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+# сколько апдейтов ждут отправки в один воркер, дальше — backpressure на получение
+QUEUE_SIZE = 10000
+
+# поля апдейта, у которых есть from (порядок как в Update)
+_USER_EVENTS = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "poll_answer",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing: при смене числа воркеров переезжает ~1/N пользователей."""
+
+    def __init__(self, nodes: int, vnodes: int = 64) -> None:
+        points = sorted((_hash(f"worker-{node}-{v}"), node) for node in range(nodes) for v in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key: int) -> int:
+        i = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[i]
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    for field in _USER_EVENTS:
+        event = update.get(field)
+        if not event:
+            continue
+        user = event.get("from") or event.get("user")
+        if user and "id" in user:
+            return int(user["id"])
+        chat = event.get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+    return None
+
+
+class Supervisor:
+    def __init__(self, cfg: Config, bot: Bot, workers: int, allowed_updates: List[str]) -> None:
+        self.cfg = cfg
+        self.bot = bot
+        self.workers = workers
+        self.allowed_updates = allowed_updates
+        self.ring = HashRing(workers)
+        # апдейты от супервизора воркерам — только с этим секретом
+        self.secret = secrets.token_hex(16)
+
+        self._queues = [asyncio.Queue(maxsize=QUEUE_SIZE) for _ in range(workers)]
+        self._procs: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self._tasks: List[asyncio.Task] = []
+        self._forwarders: List[Optional[asyncio.Task]] = [None] * workers
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._stopping = asyncio.Event()
+
+        self.routed = [0] * workers
+
+    # -------------------- воркеры --------------------
+
+    def worker_port(self, i: int) -> int:
+        return self.cfg.worker_base_port + i
+
+    def _worker_env(self, i: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "WORKERS": str(self.workers),
+            "WORKER_ID": str(i),
+            "BOT_MODE": "webhook",
+            "WEBHOOK_URL": "",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "PORT": str(self.worker_port(i)),
+            "WEBHOOK_PORT": str(self.worker_port(i)),
+            "WEBHOOK_PATH": self.cfg.webhook_path,
+            "WEBHOOK_SECRET": self.secret,
+            # у каждого воркера свой порт метрик: METRICS_PORT+1+i
+            "METRICS_PORT": str(self.cfg.metrics_port + 1 + i) if self.cfg.metrics_port else "0",
+        })
+        return env
+
+    async def _run_worker(self, i: int) -> None:
+        """Запускает воркер и перезапускает его при падении."""
+        backoff = 1.0
+        while not self._stopping.is_set():
+            proc = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, "--webhook", env=self._worker_env(i))
+            self._procs[i] = proc
+            logging.info(f"Worker {i}: pid {proc.pid}, port {self.worker_port(i)}")
+            code = await proc.wait()
+            self._procs[i] = None
+            if self._stopping.is_set():
+                break
+            logging.error(f"Worker {i} exited with code {code}, restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    async def _forward(self, i: int) -> None:
+        """Отправляет апдейты воркеру строго по одному и по порядку; ждёт, пока воркер поднимется."""
+        url = f"http://127.0.0.1:{self.worker_port(i)}{self.cfg.webhook_path}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret}
+        queue = self._queues[i]
+        while True:
+            body = await queue.get()
+            delay = 0.1
+            while True:
+                try:
+                    async with self._http.post(url, data=body, headers=headers) as resp:
+                        if resp.status < 500:
+                            if resp.status != 200:
+                                logging.error(f"Worker {i} rejected update: HTTP {resp.status}")
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                except Exception as e:
+                    logging.exception(f"Worker {i}: forwarding update failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+            queue.task_done()
+
+    def _start_forwarder(self, i: int) -> None:
+        task = asyncio.create_task(self._forward(i))
+        self._forwarders[i] = task
+        task.add_done_callback(lambda t: self._forwarder_done(i, t))
+
+    def _forwarder_done(self, i: int, task: asyncio.Task) -> None:
+        """Упавший пересыльщик перезапускается: иначе пользователи воркера молча остаются без апдейтов."""
+        if task.cancelled() or self._stopping.is_set():
+            return
+        logging.error(f"Worker {i}: forwarder died, restarting", exc_info=task.exception())
+        self._start_forwarder(i)
+
+    async def route(self, update: Dict[str, Any], body: Optional[bytes] = None) -> None:
+        key = update_user_id(update)
+        i = self.ring.node_for(key if key is not None else update.get("update_id", 0))
+        self.routed[i] += 1
+        await self._queues[i].put(body if body is not None else json.dumps(update).encode())
+
+    # -------------------- вход апдейтов --------------------
+
+    def _api_url(self, method: str) -> str:
+        base = self.cfg.api_base_url or "https://api.telegram.org"
+        return f"{base}/bot{self.cfg.bot_token}/{method}"
+
+    async def _poll(self) -> None:
+        """Long polling сырым getUpdates: апдейты не разбираются в модели aiogram, только JSON."""
+        offset = 0
+        backoff = 1.0
+        while not self._stopping.is_set():
+            payload = {"offset": offset, "timeout": 25, "allowed_updates": self.allowed_updates}
+            try:
+                async with self._http.post(self._api_url("getUpdates"), json=payload) as resp:
+                    data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.warning(f"getUpdates failed ({type(e).__name__}), retry in {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            if not data.get("ok"):
+                retry_after = (data.get("parameters") or {}).get("retry_after")
+                logging.warning(f"getUpdates error: {data.get('description')}")
+                await asyncio.sleep(retry_after or backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            backoff = 1.0
+            for update in data["result"]:
+                await self.route(update)
+                offset = update["update_id"] + 1
+
+    async def _handle_webhook(self, request: web.Request) -> web.Response:
+        if self.cfg.webhook_secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.cfg.webhook_secret:
+            return web.Response(status=401)
+        body = await request.read()
+        await self.route(json.loads(body), body)
+        return web.Response()
+
+    # -------------------- жизненный цикл --------------------
+
+    async def run(self, mode: str) -> None:
+        timeout = aiohttp.ClientTimeout(total=60)
+        self._http = aiohttp.ClientSession(timeout=timeout)
+        self._tasks = [asyncio.create_task(self._run_worker(i)) for i in range(self.workers)]
+        for i in range(self.workers):
+            self._start_forwarder(i)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        runner: Optional[web.AppRunner] = None
+        poller: Optional[asyncio.Task] = None
+        if mode == "webhook":
+            app = web.Application()
+            app.router.add_post(self.cfg.webhook_path, self._handle_webhook)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, host=self.cfg.webhook_host, port=self.cfg.webhook_port).start()
+            if self.cfg.webhook_url:
+                await self.bot.set_webhook(
+                    url=self.cfg.webhook_url + self.cfg.webhook_path,
+                    secret_token=self.cfg.webhook_secret or None,
+                    allowed_updates=self.allowed_updates,
+                )
+            logging.info(f"Supervisor: webhook on {self.cfg.webhook_host}:{self.cfg.webhook_port}, {self.workers} workers")
+        else:
+            poller = asyncio.create_task(self._poll())
+            logging.info(f"Supervisor: polling, {self.workers} workers")
+
+        try:
+            await self._stopping.wait()
+        finally:
+            logging.info("Supervisor: stopping")
+            if poller is not None:
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+            if runner is not None:
+                await runner.cleanup()
+
+            # дожидаемся, пока принятые апдейты дойдут до воркеров
+            try:
+                await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), 10)
+            except asyncio.TimeoutError:
+                logging.warning(f"Supervisor: {sum(q.qsize() for q in self._queues)} updates not delivered")
+            for task in self._forwarders:
+                if task is not None:
+                    task.cancel()
+
+            for proc in self._procs:
+                if proc is not None and proc.returncode is None:
+                    proc.send_signal(signal.SIGTERM)
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._http.close()
+            logging.info(f"Supervisor: stopped, updates per worker: {self.routed}")
+
+
+async def run_supervisor(cfg: Config, bot: Bot, mode: str, workers: int, allowed_updates: List[str]) -> None:
+    await Supervisor(cfg, bot, workers, allowed_updates).run(mode)
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+import db
+import db_async as adb
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DEFAULT_DB_PATH", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(db, "_conn", None)
+    db.init_db()
+    adb.start(readers=1)
+    yield adb._writer
+    asyncio.run(adb.close())
+    db._conn.close()
+
+
+def _blocked(release: threading.Event) -> None:
+    release.wait(5)
+
+
+def test_cancelled_write_is_kept_and_not_pending(writer):
+    async def scenario():
+        release = threading.Event()
+        blocker = asyncio.create_task(adb._write(_blocked, release))
+        task = asyncio.create_task(adb.upsert_user(1, "u1"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        await blocker
+        await adb.barrier()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert writer.pending == 0
+    assert db.connect().execute("SELECT COUNT(*) FROM users WHERE user_id = 1").fetchone()[0] == 1
+
+
+def test_cancelled_future_releases_pending(writer):
+    async def scenario():
+        release = threading.Event()
+        blocker = asyncio.create_task(adb._write(_blocked, release))
+        await asyncio.sleep(0.05)
+        writer.submit(adb._WRITE, db.upsert_user, 2, "u2").cancel()
+        release.set()
+        await blocker
+        await adb.barrier()
+
+    asyncio.run(scenario())
+    assert writer.pending == 0
+    assert db.connect().execute("SELECT COUNT(*) FROM users WHERE user_id = 2").fetchone()[0] == 0
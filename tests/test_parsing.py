@@ -0,0 +1,21 @@
+import bot
+
+
+def test_recipients_separated_by_space_or_newline():
+    assert bot.parse_recipients("/video 123 ABC") == ("123", "ABC")
+    assert bot.parse_recipients("/video 123\nABC") == ("123", "ABC")
+    assert bot.parse_recipients("/say 5,7\n\nпривет\nвсем") == ("5,7", "привет\nвсем")
+    assert bot.parse_recipients("/video 123") == ("123", None)
+    assert bot.parse_recipients("/video") == (None, None)
+
+
+def test_stats_four_numbers():
+    assert bot.parse_stats("12500 830 41 12") == (12500, 830, 41, 12)
+    assert bot.parse_stats("12.5k, 830; 41 | 12") == (12500, 830, 41, 12)
+    assert bot.parse_count("12500 830 41 12") is None
+
+
+def test_stats_negative_number_rejected():
+    assert bot.parse_stats("12500 -830 41 12") is None
+    assert bot.parse_stats("-12500 830 41 12") is None
+    assert bot.parse_count("-5") is None
@@ -0,0 +1,20 @@
+import sqlite3
+
+import db
+
+
+def migrated(tmp_path) -> sqlite3.Connection:
+    con = sqlite3.connect(tmp_path / "bot.db")
+    con.row_factory = sqlite3.Row
+    db.migrate(con)
+    return con
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    assert db.check_query_plans(migrated(tmp_path)) == {}
+
+
+def test_missing_index_is_reported(tmp_path):
+    con = migrated(tmp_path)
+    con.execute("DROP INDEX idx_free_tests_user")
+    assert "last_test" in db.check_query_plans(con)
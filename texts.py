@@ -71,3 +71,10 @@ LUX_REQUEST_SENT = (
     "Менеджер уточнит детали и финальную цену (10–15k ₸/мес).\n"
     "Нажми «Менеджер» и отправь данные."
 )
+
+THROTTLED = "⏳ Слишком много сообщений подряд. Подожди пару секунд и продолжай."
+
+JOB_READY = (
+    "🎬 Твоё видео для Дня {day} готово!\n"
+    "Выложи его в течение 24 часов и нажми «Я выложил»."
+)
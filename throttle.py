@@ -0,0 +1,105 @@
+"""
+Анти-флуд: token bucket на пользователя и группу хендлеров.
+
+ThrottleMiddleware — inner middleware на message/callback_query: хендлер уже
+выбран, но ещё ничего не сделал (ни записи в БД, ни ответа). Группа берётся
+из флага хендлера: @dp.message(..., flags={"throttle": "material"}),
+без флага — "default". Лимиты задаются строкой THROTTLE:
+
+    default=2:20,material=1:10,fallback=0.2:3   (группа=токенов в секунду:ёмкость)
+
+Лишний апдейт отбрасывается; на первый за эпизод пользователь получает одно
+предупреждение (texts.THROTTLED), дальше — тишина, пока бакет не наполнится.
+Бакеты лежат в LRU ограниченного размера: вытесняется самый давно не
+писавший, а у него бакет и так успел бы наполниться.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+import texts
+from metrics import throttled
+from outbox import TokenBucket
+
+Rates = Dict[str, Tuple[float, float]]
+
+
+def parse_rates(spec: str) -> Rates:
+    """'группа=rate:burst,...' -> {группа: (rate, burst)}; 'off' — без ограничений."""
+    spec = spec.strip()
+    if spec.lower() in {"", "0", "off"}:
+        return {}
+    rates: Rates = {}
+    for item in spec.split(","):
+        group, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        try:
+            rates[group.strip()] = (float(rate), float(burst or rate))
+        except ValueError:
+            raise ValueError(f"Bad THROTTLE entry: {item!r}, expected group=rate:burst") from None
+    return rates
+
+
+class _Bucket(TokenBucket):
+    def __init__(self, rate: float, burst: float) -> None:
+        super().__init__(rate, burst)
+        self.noticed = False
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    def __init__(self, rates: Rates, max_buckets: int = 100000, exempt: Tuple[int, ...] = ()) -> None:
+        self.rates = rates
+        self.max_buckets = max(1, max_buckets)
+        self.exempt = set(exempt)
+        # (user_id, группа) -> бакет; порядок = LRU (свежие в конце)
+        self._buckets: "OrderedDict[Tuple[int, str], _Bucket]" = OrderedDict()
+
+    def _bucket(self, user_id: int, group: str) -> Optional[_Bucket]:
+        rate = self.rates.get(group) or self.rates.get("default")
+        if rate is None:
+            return None
+        key = (user_id, group)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(*rate)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User = data.get("event_from_user")
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        group = get_flag(data, "throttle", default="default")
+        bucket = self._bucket(user.id, group)
+        if bucket is None:
+            return await handler(event, data)
+
+        if bucket.delay(time.monotonic()) <= 0:
+            bucket.take()
+            bucket.noticed = False
+            return await handler(event, data)
+
+        throttled.inc(group)
+        if not bucket.noticed:
+            bucket.noticed = True
+            if isinstance(event, CallbackQuery):
+                await event.answer(texts.THROTTLED)
+            elif isinstance(event, Message):
+                await event.answer(texts.THROTTLED, parse_mode=None)
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"buckets": len(self._buckets)}
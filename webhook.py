@@ -0,0 +1,88 @@
+"""
+Webhook-режим: встроенный aiohttp-сервер вместо dp.start_polling.
+
+- Telegram шлёт апдейты POST'ом на WEBHOOK_PATH;
+- заголовок X-Telegram-Bot-Api-Secret-Token сверяется с WEBHOOK_SECRET;
+- ответ 200 отдаётся сразу, апдейт обрабатывается в фоне;
+- при остановке сервер перестаёт принимать апдейты и дожидается фоновых
+  (не дольше DRAIN_TIMEOUT), и только потом dp.shutdown и закрытие БД;
+- allowed_updates = только те типы, на которые есть хендлеры.
+
+Локальная проверка (WEBHOOK_URL пустой — вебхук в Telegram не регистрируется):
+    curl -X POST localhost:8080/webhook \
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+         -H "Content-Type: application/json" -d @update.json
+"""
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import Config
+
+# сколько ждать апдейты, которые ещё обрабатываются, при остановке
+DRAIN_TIMEOUT = 30.0
+
+
+def build_app(dp: Dispatcher, bot: Bot, cfg: Config) -> web.Application:
+    app = web.Application()
+    handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=cfg.webhook_secret or None,
+    )
+
+    async def drain(_: web.Application) -> None:
+        # первым в on_shutdown: до закрытия сессии бота и dp.shutdown
+        tasks = list(handler._background_feed_update_tasks)
+        if not tasks:
+            return
+        logging.info(f"Webhook: waiting for {len(tasks)} updates in progress")
+        _, pending = await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT)
+        if pending:
+            logging.warning(f"Webhook: {len(pending)} updates still in progress after {DRAIN_TIMEOUT:.0f}s, cancelled")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    app.on_shutdown.append(drain)
+    handler.register(app, path=cfg.webhook_path)
+    # dp.startup / dp.shutdown вызываются вместе со стартом и остановкой приложения
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, cfg: Config) -> None:
+    app = build_app(dp, bot, cfg)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=cfg.webhook_host, port=cfg.webhook_port)
+    await site.start()
+    logging.info(f"Webhook server listening on {cfg.webhook_host}:{cfg.webhook_port}{cfg.webhook_path}")
+
+    if cfg.webhook_url:
+        await bot.set_webhook(
+            url=cfg.webhook_url + cfg.webhook_path,
+            secret_token=cfg.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info(f"Webhook registered: {cfg.webhook_url}{cfg.webhook_path}")
+    else:
+        logging.warning("WEBHOOK_URL is empty: webhook is not registered in Telegram (local mode)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()